@@ -5,29 +5,44 @@ from a MongoDB collection.
 """
 
 import os
+import multiprocessing
+import socket
+import threading
 import time
-from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from dotenv import load_dotenv
 from pymongo import MongoClient
 
 import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 
 from gensim import corpora, models
-from gensim.models import CoherenceModel
 from gensim.models.phrases import Phrases, Phraser
 
-from sumy.parsers.plaintext import PlaintextParser
-from sumy.nlp.tokenizers import Tokenizer
-from sumy.summarizers.lex_rank import LexRankSummarizer
-import text2emotion as te
-
+import numpy as np
 import spacy
 
+from preprocessing import preprocess_sentences, topic_tokens, summary_words
+from emotion import emotion_lexicon
+from sentence_columns import SCORE_FIELDS, EntityTable, SentenceColumns
+from sentence_cache import SentenceCache
+from job_store import (
+    ANALYZER_VERSION,
+    STORAGE_ERRORS,
+    ChangeStreamsUnavailable,
+    load_sentences,
+    open_job_store,
+    split_chunks,
+)
+from scheduling import JobCostModel
+from topic_model import GlobalTopicModel
+from diagnostics import start_diagnostics_process
+from summarizer import summarize
+from metrics import StageTimer, WorkerMetrics, format_timings, serve_metrics
+from stage_graph import Stage, StageGraph
+
 # step 1: retrive the data in this structure
 # {
 #     "_id": ObjectId("..."),
@@ -46,8 +61,18 @@ import spacy
 #         // ... more sentences
 #     ],
 #     "overall_status": "pending",   // Indicates the status of the entire submission
-#     "timestamp": ISODate("...")    // Timestamp of the submission
+#     "timestamp": ISODate("..."),   // Timestamp of the submission
+#     "sentence_count": 2,           // Size of the submission, used to schedule it
+#     "char_count": 24
 # }
+#
+# while a worker holds a document it is flipped to "processing" and tagged with
+# "worker_id", "lease_expires_at" and an "attempts" counter, so several workers
+# can drain the queue without processing the same document twice
+#
+# with SENTENCE_CHUNK_SIZE set in the web app, larger submissions have
+# "chunk_size" and "chunk_count" instead of "sentences"; their sentence entries
+# are in text_chunks as {"request_id", "chunk": index, "sentences": [...]}
 
 # step 2: do analysis and store Compond, Neutural, Postive, and Negative metircs into analysis field
 # step 3: do Topic Modeling, Emotion Detection, Text Summarization, Sentiment Trend Analysis
@@ -60,47 +85,124 @@ client = MongoClient(mongo_uri)
 db = client["sentiment"]
 texts_collection = db["texts"]
 
+# the job queue lives in MongoDB, or with STORAGE_BACKEND=sqlite in an embedded
+# database at SQLITE_PATH (":memory:" keeps it in this process)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+job_store = open_job_store(
+    STORAGE_BACKEND, texts_collection, os.getenv("SQLITE_PATH", "jobs.sqlite3")
+)
+
+# job claiming: a claimed document is leased to one worker until the lease expires
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", "300"))
+MAX_ATTEMPTS = int(os.getenv("MAX_ATTEMPTS", "3"))
+
+# job pickup: "watch" wakes on inserts through a change stream, "poll" backs off while idle
+WORKER_MODE = os.getenv("WORKER_MODE", "watch")
+POLL_MIN_SECONDS = float(os.getenv("POLL_MIN_SECONDS", "0.2"))
+POLL_MAX_SECONDS = float(os.getenv("POLL_MAX_SECONDS", "5"))
+# how often an idle watcher rescans anyway, so expired leases are retried
+RESCAN_SECONDS = float(os.getenv("RESCAN_SECONDS", "30"))
+# number of child processes analysing documents; 1 processes them in the worker itself
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+# pending documents are claimed smallest first; the delay a document's size adds
+# to its timestamp is capped, so large documents still run within a bounded wait
+job_cost_model = JobCostModel(
+    seconds_per_sentence=float(os.getenv("SCHEDULE_SECONDS_PER_SENTENCE", "0.05")),
+    seconds_per_char=float(os.getenv("SCHEDULE_SECONDS_PER_CHAR", "0")),
+    max_delay_seconds=float(os.getenv("SCHEDULE_MAX_DELAY_SECONDS", "600")),
+    window_size=int(os.getenv("SCHEDULE_WINDOW", "1000")),
+)
+# documents tried per claim before the candidates are looked up again
+CLAIM_CANDIDATES = 5
+
+# sentence results are cached across documents under the shared ANALYZER_VERSION
+sentence_cache = SentenceCache(
+    ANALYZER_VERSION,
+    max_size=int(os.getenv("SENTENCE_CACHE_SIZE", "10000")),
+    collection=db["sentence_cache"] if os.getenv("SENTENCE_CACHE_PERSIST") else None,
+)
+
+# topics come from a persistent model updated online; an empty TOPIC_MODEL_DIR
+# trains a fresh LDA per document instead
+TOPIC_MODEL_DIR = os.getenv("TOPIC_MODEL_DIR", "topic_model")
+global_topic_model = GlobalTopicModel(
+    TOPIC_MODEL_DIR,
+    num_topics=int(os.getenv("TOPIC_MODEL_TOPICS", "20")),
+    batch_size=int(os.getenv("TOPIC_UPDATE_BATCH", "2000")),
+    retrain_seconds=float(os.getenv("TOPIC_RETRAIN_SECONDS", "86400")),
+) if TOPIC_MODEL_DIR else None
+
+# long documents are summarized hierarchically in windows, bounded in memory and time
+SUMMARY_HIERARCHICAL_THRESHOLD = int(os.getenv("SUMMARY_HIERARCHICAL_THRESHOLD", "2000"))
+SUMMARY_MEMORY_MB = int(os.getenv("SUMMARY_MEMORY_MB", "256"))
+SUMMARY_TIME_BUDGET_SECONDS = float(os.getenv("SUMMARY_TIME_BUDGET_SECONDS", "30"))
+
+# per-stage timings are stored on each document; the worker serves aggregates on
+# http://<host>:METRICS_PORT/metrics (0 disables the endpoint)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# claimed documents with at least this many sentences publish each group of
+# results as soon as it is ready; smaller ones are written once
+PROGRESSIVE_MIN_SENTENCES = int(os.getenv("PROGRESSIVE_MIN_SENTENCES", "50"))
+RESULT_STAGES = ["sentiment", "emotions", "entities", "summary", "topics"]
+# in a pool process, the queue partial results are sent to the parent on (see
+# ProcessPoolWorker); the parent holds the lease and publishes them
+pool_progress = None
+# how often the parent looks for partial results sent by its pool processes
+PROGRESS_POLL_SECONDS = 0.05
+
+# threads running the independent analyses of one document concurrently;
+# 1 runs them one after another, which is faster on a single core
+STAGE_THREADS = int(os.getenv("STAGE_THREADS", str(min(4, os.cpu_count() or 1))))
+stage_executor = (
+    ThreadPoolExecutor(STAGE_THREADS, thread_name_prefix="stage") if STAGE_THREADS > 1 else None
+)
+
+# seconds between passes of the low-priority model-quality diagnostics job
+# (topic coherence, perplexity); 0 leaves it to a separate diagnostics.py process
+DIAGNOSTICS_SECONDS = float(os.getenv("DIAGNOSTICS_SECONDS", "600"))
+
 # download necessary NLTK data
 nltk.download("punkt")
 nltk.download("stopwords")
 nltk.download("wordnet")
 nltk.download("vader_lexicon")
 
-# Load the spaCy English model
-nlp = spacy.load("en_core_web_sm")
 
-def perform_sentiment_analysis(sentences):
+def warm_up_corpora():
     """
-    Perform sentiment analysis on each sentence in the list.
-    Adds sentiment scores (compound, neutral, positive, negative) to each sentence entry.
-
-    :param sentences: List of sentence entries
-    :return: Updated list with sentiment scores and status set to 'processed'
+    Load the NLTK corpora the stages share. NLTK loads a corpus on its first
+    access without a lock, so threads of the document graph touching one at the
+    same time can see it half loaded; this runs before any stage does.
     """
-    analyzer = SentimentIntensityAnalyzer()
+    topic_tokens(preprocess_sentences([{"sentence": "Warm up the corpora."}])[0])
+    emotion_lexicon()
 
-    def analyze_sentence(sentence_entry):
-        if sentence_entry["status"] == "pending":
-            sentiment_scores = analyzer.polarity_scores(sentence_entry["sentence"])
-            return {
-                # unpack dictionary: extracts all key-value pairs from that dictionary
-                **sentence_entry,
-                "analysis": sentiment_scores,
-                "status": "processed",
-            }
-        return sentence_entry
 
-    return list(map(analyze_sentence, sentences))
+warm_up_corpora()
 
+# Load the spaCy English model with only the components NER needs
+NER_EXCLUDED_COMPONENTS = ["tagger", "parser", "senter", "attribute_ruler", "lemmatizer"]
+NER_BATCH_SIZE = int(os.getenv("NER_BATCH_SIZE", "256"))
+nlp = spacy.load("en_core_web_sm", exclude=NER_EXCLUDED_COMPONENTS)
+# the shared tok2vec only feeds the excluded components unless NER listens to it
+if "tok2vec" in nlp.pipe_names and "ner" not in nlp.get_pipe("tok2vec").listening_components:
+    nlp.remove_pipe("tok2vec")
 
 # topic modeling
-def perform_topic_modeling(sentences, num_topics=5):
+def perform_topic_modeling(sentences, num_topics=5, preprocessed=None, topic_model=None):
     """
     Perform topic modeling on the list of sentences.
     Identifies main topics using LDA with improved preprocessing.
+    With a global topic model the topics are inferred from it and the sentences
+    are fed into its next online update; a fresh LDA is only trained for this
+    document while the global model has nothing to offer yet.
 
     :param sentences: List of sentence entries
     :param num_topics: Number of topics to identify
+    :param preprocessed: Output of preprocess_sentences, computed if not given
+    :param topic_model: Optional GlobalTopicModel
     :return: List of identified topics
     :raises: ValueError
     """
@@ -108,18 +210,14 @@ def perform_topic_modeling(sentences, num_topics=5):
     if not sentences:
         print("No sentences provided for topic modeling.")
         return []
-    
-    def preprocess(text):
-        tokens = word_tokenize(text.lower())
-        tokens = [
-            WordNetLemmatizer().lemmatize(token) for token in tokens if token.isalnum()
-        ]
-        tokens = [token for token in tokens if token not in stopwords.words("english")]
-        return tokens
 
-    texts = list(
-        map(preprocess, [sentence_entry["sentence"] for sentence_entry in sentences])
-    )
+    preprocessed = preprocessed or preprocess_sentences(sentences)
+    texts = [topic_tokens(sentence_tokens) for sentence_tokens in preprocessed]
+    if topic_model is not None:
+        topic_model.observe(texts)
+        topics = topic_model.infer(texts, num_topics=num_topics)
+        if topics:
+            return topics
     # Create bigrams
     bigram = Phrases(texts, min_count=5, threshold=100)
     bigram_mod = Phraser(bigram)
@@ -153,68 +251,21 @@ def perform_topic_modeling(sentences, num_topics=5):
         eta="auto",
         random_state=42,
     )
-    # skip coherence calculation in test environment
-    if not os.getenv("TESTING"):
-        try:
-            coherence_model_lda = CoherenceModel(
-                model=lda_model, texts=texts, dictionary=dictionary, coherence="c_v"
-            )
-            coherence_score = coherence_model_lda.get_coherence()
-            print(f"Coherence Score: {coherence_score}")
-        except ValueError as e:
-            print(f"Skipping coherence calculation: {str(e)}")
-
+    # coherence is scored later by the diagnostics job, off the critical path
     topics = lda_model.print_topics(num_words=4)
     return topics
 
 
-# emotion detection
-def perform_emotion_detection(sentences):
-    """
-    Detect emotions in each sentence using the text2emotion package.
-    Adds an 'emotions' field to each sentence entry.
-
-    :param sentences: List of sentence entries
-    :return: Updated list of sentence entries with emotions detected
-    """
-
-    def detect_emotion(sentence_entry):
-        if "analysis" in sentence_entry and sentence_entry["analysis"] is not None:
-            text = sentence_entry["sentence"]
-            emotions = te.get_emotion(text)
-            # determin dominat emotion(s)
-            if any(emotions.values()):
-                max_value = max(emotions.values())
-                dominant_emotions = [
-                    emotion
-                    for emotion, score in emotions.items()
-                    if score == max_value and score > 0
-                ]
-            else:
-                dominant_emotions = ["Neutral"]
-
-            return {**sentence_entry, "emotions": dominant_emotions}
-        return sentence_entry
-
-    return list(map(detect_emotion, sentences))
-
-
 # overall emotion detection
 def perform_overall_emotion_detection(sentences):
     """
     Determine the overall dominant emotion(s) across all sentences.
     Adds an 'overall_emotions' field to the document.
 
-    :param sentences: List of sentence entries
+    :param sentences: SentenceColumns, or list of sentence entries
     :return: Overall emotions list
     """
-
-    emotion_counter = defaultdict(int)
-    for sentence in sentences:
-        emotions = sentence.get("emotions", [])
-        for emotion in emotions:
-            emotion_counter[emotion] += 1
-
+    emotion_counter = as_columns(sentences).emotion_counts()
     if emotion_counter:
         max_count = max(emotion_counter.values())
         dominant_overall_emotions = [
@@ -227,20 +278,29 @@ def perform_overall_emotion_detection(sentences):
 
 
 # text summarization
-def perform_text_summarization(sentences, sentence_count=5):
+def perform_text_summarization(sentences, sentence_count=5, preprocessed=None, return_indices=False):
     """
-    Generate a summary of the text using LexRank summarizer.
+    Generate a summary of the text using the built-in sparse LexRank summarizer.
+    Works on the stored sentences and their preprocessed words, so the text
+    is neither re-split nor re-tokenized. Documents above
+    SUMMARY_HIERARCHICAL_THRESHOLD sentences are summarized window by window.
 
     :param sentences: List of sentence entries
     :param sentence_count: Number of sentences in the summary
-    :return: Summary string
+    :param preprocessed: Output of preprocess_sentences, computed if not given
+    :param return_indices: Also return the indices of the summary sentences
+    :return: Summary string, or (summary, indices) with return_indices
     """
-    full_text = " ".join(sentence["sentence"] for sentence in sentences)
-    parser = PlaintextParser.from_string(full_text, Tokenizer("english"))
-    summarizer = LexRankSummarizer()
-    summary_sentences = summarizer(parser.document, sentences_count=sentence_count)
-    summary = " ".join(str(sentence) for sentence in summary_sentences)
-    return summary
+    preprocessed = preprocessed or preprocess_sentences(sentences)
+    indices = summarize(
+        [summary_words(sentence_tokens) for sentence_tokens in preprocessed],
+        sentence_count,
+        threshold=SUMMARY_HIERARCHICAL_THRESHOLD,
+        memory_limit_bytes=SUMMARY_MEMORY_MB * 1024 * 1024,
+        time_budget=SUMMARY_TIME_BUDGET_SECONDS,
+    )
+    summary = " ".join(sentences[index]["sentence"].strip() for index in indices)
+    return (summary, indices) if return_indices else summary
 
 
 # sentiment trend analysis
@@ -249,20 +309,256 @@ def perform_sentiment_trend_analysis(sentences):
     Analyze sentiment trend by tracking compound scores of each sentence.
     Returns a list of sentiment scores with sentence indices.
 
-    :param sentences: List of sentence entries
+    :param sentences: SentenceColumns, or list of sentence entries
     :return: List of dictionaries with sentence index and compound score
     """
+    return [
+        {"sentence_index": index, "compound": compound}
+        for index, compound in enumerate(as_columns(sentences).compound().tolist())
+    ]
+
+
+def as_columns(sentences):
+    """
+    SentenceColumns of the sentences, converted if they are given as entries.
+
+    :param sentences: SentenceColumns, or list of sentence entries
+    :return: SentenceColumns
+    """
+    return sentences if isinstance(sentences, SentenceColumns) else SentenceColumns.from_entries(sentences)
+
+
+def score_sentiments(texts):
+    """
+    VADER scores of sentences.
+
+    :param texts: List of sentence strings
+    :return: Array of shape (len(texts), 4) in SCORE_FIELDS order
+    """
+    analyzer = SentimentIntensityAnalyzer()
+    scores = np.empty((len(texts), len(SCORE_FIELDS)))
+    for row, text in enumerate(texts):
+        polarity = analyzer.polarity_scores(text)
+        scores[row] = [polarity[field] for field in SCORE_FIELDS]
+    return scores
+
+
+# stages of document processing, scheduled by DOCUMENT_GRAPH; the per-sentence
+# results are kept in SentenceColumns until they are written out
+def preprocessing_stage(sentences, timer):
+    """Tokenize and lemmatize once for every analysis."""
+    with timer.stage("preprocessing", sentences=len(sentences)) as stage:
+        preprocessed = preprocess_sentences(sentences)
+        stage["tokens"] = sum(len(sentence_tokens.tokens) for sentence_tokens in preprocessed)
+    return preprocessed
+
+
+def sentence_cache_stage(sentences, timer):
+    """
+    Look the sentences up in the sentence cache.
+
+    :return: (SentenceColumns with the cached results, the row of the first
+             occurrence of each sentence, indices of the first occurrences of
+             the sentences that still have to be analysed)
+    """
+    texts = [sentence_entry["sentence"] for sentence_entry in sentences]
+    with timer.stage("sentence_cache", sentences=len(texts)) as stage:
+        cached = sentence_cache.get_many(texts)
+        # distinct sentences found and not found, summed up by WorkerMetrics
+        stage["hits"] = len(cached)
+        stage["misses"] = len(set(texts)) - len(cached)
+    first = {}
+    first_rows = np.array([first.setdefault(text, index) for index, text in enumerate(texts)], dtype=np.int64)
+    columns = SentenceColumns(len(texts))
+    missing = []
+    for text, index in first.items():
+        if text in cached:
+            columns.set_row(index, cached[text])
+        else:
+            missing.append(index)
+    return columns, first_rows, missing
+
+
+def sentiment_stage(sentences, columns, missing, timer):
+    """Sentiment scores of the sentences missing from the cache."""
+    if missing:
+        with timer.stage("sentiment", sentences=len(missing)):
+            columns.set_scores(missing, score_sentiments([sentences[index]["sentence"] for index in missing]))
+    return missing
+
+
+def emotion_stage(scored, columns, preprocessed, timer):
+    """Emotions of the sentences missing from the cache, once they have sentiment scores."""
+    if scored:
+        with timer.stage("emotion", sentences=len(scored)):
+            columns.emotions[scored] = emotion_lexicon().dominant_codes(
+                [preprocessed[index].tokens for index in scored]
+            )
+    return scored
+
+
+def ner_stage(sentences, columns, missing, timer):
+    """Named entities of the sentences missing from the cache."""
+    if missing:
+        with timer.stage("ner", sentences=len(missing)):
+            entities = extract_entities(
+                [sentences[index]["sentence"] for index in missing], columns.entity_table
+            )
+            for index, entity_ids in zip(missing, entities):
+                columns.entities[index] = entity_ids
+    return missing
+
+
+def annotate_stage(sentences, columns, first_rows, missing, emotions, entities):  # pylint: disable=unused-argument
+    """
+    Cache the fresh results and copy the results of each distinct sentence to
+    its repeats. Runs once emotions and entities are done.
+    """
+    fresh = {sentences[index]["sentence"]: columns.row(index) for index in missing}
+    if fresh:
+        sentence_cache.put_many(fresh)
+    return columns.take(first_rows)
+
 
-    def extract_compound_score(idx_entry):
-        index, sentence_entry = idx_entry
-        compound_score = (
-            sentence_entry["analysis"]["compound"]
-            if sentence_entry.get("analysis")
-            else 0
+def trend_stage(annotated, timer):
+    """
+    Sentiment trend, overall emotions and the document-level aggregates (see
+    SentenceColumns.aggregates) of the annotated sentences.
+    """
+    with timer.stage("trend", sentences=len(annotated)):
+        return (
+            perform_sentiment_trend_analysis(annotated),
+            perform_overall_emotion_detection(annotated),
+            annotated.aggregates(),
         )
-        return {"sentence_index": index, "compound": compound_score}
 
-    return list(map(extract_compound_score, enumerate(sentences)))
+
+def summary_stage(sentences, preprocessed, timer):
+    """Summary of the document and the indices of its sentences."""
+    with timer.stage("summary", sentences=len(sentences)):
+        return perform_text_summarization(sentences, preprocessed=preprocessed, return_indices=True)
+
+
+def topics_stage(sentences, preprocessed, timer):
+    """Topics of the document."""
+    with timer.stage("topics", sentences=len(sentences)):
+        return perform_topic_modeling(sentences, preprocessed=preprocessed, topic_model=global_topic_model)
+
+
+SENTENCE_STAGES = [
+    Stage(
+        "sentence_cache", sentence_cache_stage, ["sentences", "timer"], ["columns", "first_rows", "missing"]
+    ),
+    Stage("sentiment", sentiment_stage, ["sentences", "columns", "missing", "timer"], ["scored"]),
+    Stage("emotion", emotion_stage, ["scored", "columns", "preprocessed", "timer"], ["emotions"]),
+    Stage("ner", ner_stage, ["sentences", "columns", "missing", "timer"], ["entities"]),
+    Stage(
+        "annotate",
+        annotate_stage,
+        ["sentences", "columns", "first_rows", "missing", "emotions", "entities"],
+        ["annotated"],
+    ),
+]
+SENTENCE_GRAPH = StageGraph(SENTENCE_STAGES, inputs=["sentences", "preprocessed", "timer"])
+# NER, summary and topics only need the sentences and their preprocessing, so
+# they run alongside the sentiment -> emotion chain
+DOCUMENT_GRAPH = StageGraph([
+    Stage("preprocessing", preprocessing_stage, ["sentences", "timer"], ["preprocessed"]),
+    *SENTENCE_STAGES,
+    Stage("trend", trend_stage, ["annotated", "timer"], ["sentiment_trend", "overall_emotions", "aggregates"]),
+    Stage("summary", summary_stage, ["sentences", "preprocessed", "timer"], ["summary", "summary_sentences"]),
+    Stage("topics", topics_stage, ["sentences", "preprocessed", "timer"], ["topics"]),
+], inputs=["sentences", "timer"])
+
+
+def annotate_sentences(sentences, preprocessed, timer=None):
+    """
+    Add sentiment scores, emotions and entities to every sentence entry.
+    Sentences seen before, in this or any earlier document, are served from the
+    sentence cache; only the remaining distinct sentences are analysed.
+
+    :param sentences: List of sentence entries
+    :param preprocessed: Output of preprocess_sentences for the same sentences
+    :param timer: Optional StageTimer recording each analysis as a stage
+    :return: New list of sentence entries with the results
+    """
+    values = SENTENCE_GRAPH.run(
+        {"sentences": sentences, "preprocessed": preprocessed, "timer": timer or StageTimer()},
+        executor=stage_executor,
+    )
+    return values["annotated"].to_entries(sentences, status="processed")
+
+
+def document_sentences(document):
+    """
+    Sentence entries of a processed document in the stored shape, built from its
+    sentence_columns if it has them.
+
+    :param document: Document
+    :return: List of sentence entries
+    """
+    columns = document.get("sentence_columns")
+    if columns is None:
+        return document.get("sentences", [])
+    return columns.to_entries(document.get("sentences", []), status="processed")
+
+
+def document_chunks(document):
+    """
+    Sentence entries of a processed chunked document, built one chunk at a time
+    from its sentence_columns, so the entries of the whole document are never
+    held at once.
+
+    :param document: Document with chunk_size and sentence_columns
+    :return: Iterator of (chunk index, list of sentence entries)
+    """
+    sentences = document["sentences"]
+    columns = document.get("sentence_columns")
+    for index, chunk in split_chunks(sentences, document["chunk_size"]):
+        if columns is not None:
+            start = index * document["chunk_size"]
+            chunk = columns.take(np.arange(start, start + len(chunk))).to_entries(chunk, status="processed")
+        yield index, chunk
+
+
+def progress_callback(document):
+    """
+    Stage callback publishing each group of results of the document as soon as
+    the stages it needs are done, or None if the document does not publish.
+
+    :param document: Document being processed
+    :return: Callable taking (stage_name, values), or None
+    """
+    if not publishes_progress(document):
+        return None
+    publish = progress_publisher(document)
+
+    def on_complete(stage, values):
+        if stage == "sentiment":
+            columns = values["columns"].take(values["first_rows"])
+            publish(["sentiment"], {
+                "sentences": columns.to_entries(values["sentences"], fields=["analysis"]),
+                "sentiment_trend": perform_sentiment_trend_analysis(columns),
+            })
+        elif stage == "emotion":
+            columns = values["columns"].take(values["first_rows"])
+            publish(["emotions"], {
+                "sentences": columns.to_entries(values["sentences"], fields=["analysis", "emotions"]),
+                "overall_emotions": perform_overall_emotion_detection(columns),
+            })
+        elif stage == "trend":
+            publish(["sentiment", "emotions", "entities"], {
+                "sentences": values["annotated"].to_entries(values["sentences"], status="processed"),
+                "sentiment_trend": values["sentiment_trend"],
+                "overall_emotions": values["overall_emotions"],
+                "aggregates": values["aggregates"],
+            })
+        elif stage == "summary":
+            publish(["summary"], {
+                "summary": values["summary"], "summary_sentences": values["summary_sentences"],
+            })
+
+    return on_complete
 
 
 # process all
@@ -270,6 +566,13 @@ def process_document(document):
     """
     Process a single document: perform sentiment analysis, topic modeling,
     emotion detection, text summarization, sentiment trend analysis, and NER.
+    The analyses run as the stages of DOCUMENT_GRAPH, independent ones concurrently
+    on STAGE_THREADS threads. Per-sentence results are returned as
+    "sentence_columns" and merged into the sentence entries when the document is
+    written (see document_sentences).
+
+    Claimed documents publish each group of results as soon as it is ready
+    (see progress_publisher), so the web app can show partial results.
 
     :param document: MongoDB document
     :return: Updated document with analyses
@@ -285,44 +588,105 @@ def process_document(document):
         }
         return updated_document
 
-    sentences = perform_sentiment_analysis(sentences)
-    topics = perform_topic_modeling(sentences)
-    sentences = perform_emotion_detection(sentences)
-    sentences = perform_ner(sentences)
-    summary = perform_text_summarization(sentences)
-    sentiment_trend = perform_sentiment_trend_analysis(sentences)
-    overall_emotions = perform_overall_emotion_detection(sentences)
+    timer = StageTimer()
+    values = DOCUMENT_GRAPH.run(
+        {"sentences": sentences, "timer": timer},
+        executor=stage_executor,
+        on_complete=progress_callback(document),
+    )
 
     # Update document
     updated_document = {
         **document,
-        "sentences": sentences,
+        "sentence_columns": values["annotated"],
         "overall_status": "processed",
-        "topics": topics,
-        "summary": summary,
-        "sentiment_trend": sentiment_trend,
-        "overall_emotions": overall_emotions,
+        "topics": values["topics"],
+        "summary": values["summary"],
+        "summary_sentences": values["summary_sentences"],
+        "sentiment_trend": values["sentiment_trend"],
+        "overall_emotions": values["overall_emotions"],
+        "aggregates": values["aggregates"],
+        "completed_stages": list(RESULT_STAGES),
+        "diagnostics": timer.result(),
         "timestamp": datetime.now(),
     }
     return updated_document
 
 
+def publish_stages(document, stages, fields):
+    """
+    Write the results of finished stages of a claimed document right away.
+    Like the final write, it only applies while this worker holds the lease;
+    sentence chunks only while no later claim has written them.
+
+    :param document: Claimed document
+    :param stages: Names of the stages that are now complete
+    :param fields: Result fields to store; the sentences of a chunked document
+                   go to its chunks
+    """
+    if document.get("chunk_count") and "sentences" in fields:
+        fields = dict(fields)
+        job_store.write_chunks(
+            document["request_id"],
+            split_chunks(fields.pop("sentences"), document["chunk_size"]),
+            attempt=document.get("attempts"),
+        )
+    job_store.publish(document["_id"], document["worker_id"], stages, fields)
+
+
+def publishes_progress(document):
+    """
+    Whether a document publishes partial results: only claimed documents with at
+    least PROGRESSIVE_MIN_SENTENCES sentences do; for the others the extra writes
+    would cost more than the wait for the final result.
+
+    :param document: Document being processed
+    :return: bool
+    """
+    return bool(document.get("worker_id")) and len(document.get("sentences", [])) >= PROGRESSIVE_MIN_SENTENCES
+
+
+def progress_publisher(document):
+    """
+    Callback publishing partial results of a document; a no-op unless
+    publishes_progress(document). In a pool process the results are sent to
+    the parent instead, which publishes them while it holds the lease.
 
+    :param document: Document being processed
+    :return: Callable taking (stages, fields)
+    """
+    if not publishes_progress(document):
+        return lambda stages, fields: None
+
+    def publish(stages, fields):
+        if pool_progress is not None:
+            pool_progress.put((document["_id"], stages, fields))
+            return
+        try:
+            publish_stages(document, stages, fields)
+        except STORAGE_ERRORS as e:
+            print(f"Could not publish {stages} for request_id {document.get('request_id')}: {e}")
+
+    return publish
 
 
 # update to database
 def update_document_in_db(document):
     """
-    Update the processed document in MongoDB.
+    Update the processed document in the job store. The sentences of a chunked
+    document are written chunk by chunk before the document itself.
 
     :param document: Document to update
     """
     doc_id = document["_id"]
     update_fields = {
-        "sentences": document.get("sentences", []),
         "overall_status": document.get("overall_status", "processed"),
         "timestamp": document["timestamp"],
     }
+    if not document.get("chunk_count"):
+        update_fields["sentences"] = document_sentences(document)
+    elif document.get("overall_status") == "processed":
+        job_store.write_chunks(document["request_id"], document_chunks(document), attempt=document.get("attempts"))
 
     if document.get("overall_status") == "processed":
         update_fields.update({
@@ -330,49 +694,465 @@ def update_document_in_db(document):
             "summary": document.get("summary", ""),
             "sentiment_trend": document.get("sentiment_trend", []),
             "overall_emotions": document.get("overall_emotions", []),
+            # identical submissions are aliased to this document while the version matches
+            "analyzer_version": ANALYZER_VERSION,
         })
+        for optional_field in ("summary_sentences", "aggregates", "completed_stages", "diagnostics"):
+            if optional_field in document:
+                update_fields[optional_field] = document[optional_field]
     elif document.get("overall_status") == "error":
         update_fields["error_message"] = document.get("error_message", "An error occurred during processing.")
 
-    texts_collection.update_one(
-        {"_id": doc_id},
-        {"$set": update_fields},
-    )
+    # only the worker holding the lease may write results back
+    if not job_store.write_results(doc_id, update_fields, worker_id=document.get("worker_id")):
+        print(f"Lease lost for document {doc_id}, result discarded.")
 
 
 # perform named entity recognition
 def perform_ner(sentences):
     """
     Perform Named Entity Recognition on each sentence.
-    Adds an 'entities' field to each sentence entry.
+    Adds an 'entities' field to each sentence entry, in place.
+    All sentences are streamed through the pipeline in batches.
 
     :param sentences: List of sentence entries
-    :return: Updated list with entities extracted
+    :return: The same list, with entities extracted
     """
-    def extract_entities(sentence_entry):
-        text = sentence_entry["sentence"]
-        doc = nlp(text)
-        entities = [{"text": ent.text, "label": ent.label_} for ent in doc.ents]
-        return {**sentence_entry, "entities": entities}
+    entity_table = EntityTable()
+    entities = extract_entities([sentence_entry["sentence"] for sentence_entry in sentences], entity_table)
+    for sentence_entry, entity_ids in zip(sentences, entities):
+        sentence_entry["entities"] = entity_table.to_dicts(entity_ids)
+    return sentences
 
-    return list(map(extract_entities, sentences))
 
+def extract_entities(texts, entity_table):
+    """
+    Named entities of sentences, streamed through the pipeline in batches.
 
-def main():
+    :param texts: List of sentence strings
+    :param entity_table: EntityTable the entities are interned in
+    :return: List of tuples of entity ids, one per sentence
     """
-    Continuously check and process pending documents in the MongoDB collection.
-    Processes each document, performs analyses, updates results in the database,
-    and repeats after a delay.
+    docs = nlp.pipe(texts, batch_size=NER_BATCH_SIZE)
+    return [
+        tuple(entity_table.intern(ent.text, ent.label_) for ent in doc.ents)
+        for doc in docs
+    ]
+
+
+def ensure_indexes():
     """
-    while True:
-        pending_documents = texts_collection.find({"overall_status": "pending"})
-        for document in pending_documents:
+    Create the indexes the queue's queries rely on (unique request_id, status and
+    submission time, content hash, sentence chunks, topic coherence), if they are
+    missing. The web app creates them too when it starts; test_query_plans.py
+    checks that no query scans a whole collection.
+    """
+    job_store.ensure_indexes()
+
+
+def queue_depth():
+    """
+    Number of queued documents, for the metrics endpoint.
+
+    :return: Dict with the pending and processing counts
+    """
+    return job_store.queue_depth()
+
+
+worker_metrics = WorkerMetrics(queue_depth=queue_depth)
+
+
+def claim_next_document(worker_id=WORKER_ID, lease_seconds=LEASE_SECONDS):
+    """
+    Atomically claim the pending document with the earliest priority time (see
+    scheduling.JobCostModel), or one whose lease has expired. The document is
+    flipped to 'processing' and tagged with the worker id and lease expiry, so
+    no other worker can pick it up while the lease is held. Candidates another
+    worker claims first are skipped.
+
+    :param worker_id: Identifier of the claiming worker
+    :param lease_seconds: How long the claim is valid without renewal
+    :return: The claimed document with its sentences loaded from its chunks if
+             it is chunked, or None if the queue is empty
+    """
+    document = job_store.claim(worker_id, lease_seconds, job_cost_model, CLAIM_CANDIDATES)
+    if document is not None and document.get("chunk_count"):
+        document["sentences"] = load_sentences(job_store, document)
+    return document
+
+
+def renew_lease(document, worker_id=WORKER_ID, lease_seconds=LEASE_SECONDS):
+    """
+    Extend the lease on a document this worker is still processing.
+
+    :param document: Claimed document
+    :param worker_id: Identifier of the worker holding the lease
+    :param lease_seconds: New lease length from now
+    :return: True if the lease is still held by this worker
+    """
+    return job_store.renew_lease(document["_id"], worker_id, lease_seconds)
+
+
+class LeaseHeartbeat:
+    """
+    Context manager that keeps renewing a document's lease in a background
+    thread while the document is being processed.
+    """
+
+    def __init__(self, document, worker_id=WORKER_ID, lease_seconds=LEASE_SECONDS):
+        self.document = document
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            if not renew_lease(self.document, self.worker_id, self.lease_seconds):
+                print(f"Could not renew lease for request_id: {self.document.get('request_id')}")
+                return
+
+    def start(self):
+        """Start renewing the lease."""
+        self._thread.start()
+
+    def stop(self):
+        """Stop renewing the lease and wait for the renewal thread."""
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def release_lease(document, worker_id=WORKER_ID):
+    """
+    Hand a claimed document back to the queue without waiting for the lease
+    to expire, e.g. after the process analysing it crashed.
+
+    :param document: Claimed document
+    :param worker_id: Identifier of the worker holding the lease
+    """
+    job_store.release(document["_id"], worker_id)
+
+
+def abandon_exhausted_document(document):
+    """
+    Mark a document as an error once it has been claimed more than MAX_ATTEMPTS times.
+
+    :param document: Claimed document
+    :return: True if the document was abandoned
+    """
+    if document.get("attempts", 1) <= MAX_ATTEMPTS:
+        return False
+    update_document_in_db({
+        **document,
+        "overall_status": "error",
+        "error_message": f"Processing failed after {MAX_ATTEMPTS} attempts.",
+        "timestamp": datetime.now(),
+    })
+    print(f"Giving up on document with request_id: {document['request_id']}")
+    return True
+
+
+def process_claimed_document(document, worker_id=WORKER_ID):
+    """
+    Process a document claimed by this worker and write the result back.
+    A document whose processing fails is handed back to the queue, and marked
+    as an error after MAX_ATTEMPTS claims.
+
+    :param document: Claimed document
+    :param worker_id: Identifier of the worker holding the lease
+    """
+    if abandon_exhausted_document(document):
+        return
+
+    try:
+        with LeaseHeartbeat(document, worker_id):
             updated_document = process_document(document)
+    except Exception as e:  # pylint: disable=broad-except
+        print(f"Error processing request_id {document['request_id']}: {e}")
+        worker_metrics.record_failure()
+        release_lease(document, worker_id)
+        return
+    update_document_in_db(updated_document)
+    worker_metrics.record_document(updated_document)
+    print(
+        f"Processed document with request_id: {document['request_id']} "
+        f"in {format_timings(updated_document.get('diagnostics'))}"
+    )
+
+
+def drain_queue(worker_id=WORKER_ID):
+    """
+    Claim and process documents until no pending document is left.
+
+    :param worker_id: Identifier of the worker
+    :return: Number of documents processed
+    """
+    processed = 0
+    while True:
+        document = claim_next_document(worker_id)
+        if document is None:
+            return processed
+        process_claimed_document(document, worker_id)
+        processed += 1
+
+
+def init_pool_process(progress=None):
+    """
+    Initializer for pool processes. Each child loads the models and corpora
+    once when it imports this module; warm-up calls keep the first document
+    fast.
+
+    :param progress: Queue partial results are sent to the parent on, if any
+    """
+    global pool_progress  # pylint: disable=global-statement
+    pool_progress = progress
+    warm_up_corpora()
+    nlp("Warm up.")
+    print(f"Pool process {os.getpid()} ready")
+
+
+class ProcessPoolWorker:
+    """
+    Analyse documents in a pool of child processes. The parent claims documents,
+    keeps their leases alive and writes all results back: the children send
+    their partial results to the parent, which publishes them while the
+    document is in flight, and only touch MongoDB through the sentence cache.
+    A crashed child is replaced by restarting the pool and the documents it
+    held are handed back to the queue.
+    """
+
+    def __init__(self, processes, worker_id=WORKER_ID):
+        self.processes = processes
+        self.worker_id = worker_id
+        self.in_flight = {}
+        # in_flight only changes under this lock, so no partial result is
+        # published once the document's final result is being written
+        self._lock = threading.Lock()
+        # spawn so children do not inherit the MongoClient or heartbeat threads
+        self._context = multiprocessing.get_context("spawn")
+        self._start_progress()
+        self.executor = self._start_executor()
+
+    def _start_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=self._context,
+            initializer=init_pool_process,
+            initargs=(self.progress,),
+        )
+
+    def _start_progress(self):
+        # a fresh queue per pool, as a crashed child may leave the old one locked
+        self.progress = self._context.SimpleQueue()
+        self._progress_stop = threading.Event()
+        threading.Thread(
+            target=self._relay_progress, args=(self.progress, self._progress_stop), daemon=True
+        ).start()
+
+    def _relay_progress(self, progress, stop):
+        """
+        Publish the partial results the pool processes send, as long as their
+        documents are in flight.
+
+        :param progress: Queue of (document id, stages, fields)
+        :param stop: Event ending the relay
+        """
+        while not stop.is_set():
+            if progress.empty():
+                stop.wait(PROGRESS_POLL_SECONDS)
+                continue
+            document_id, stages, fields = progress.get()
+            with self._lock:
+                for document, _ in self.in_flight.values():
+                    if document["_id"] == document_id:
+                        progress_publisher(document)(stages, fields)
+                        break
+
+    def submit(self, document):
+        """
+        Start analysing a claimed document in the pool.
+
+        :param document: Claimed document
+        """
+        if abandon_exhausted_document(document):
+            return
+        heartbeat = LeaseHeartbeat(document, self.worker_id)
+        heartbeat.start()
+        with self._lock:
+            future = self.executor.submit(process_document, document)
+            self.in_flight[future] = (document, heartbeat)
+
+    def collect(self, block=False):
+        """
+        Write back the results of finished documents.
+
+        :param block: Wait until at least one document has finished
+        :return: Number of documents finished
+        """
+        if not self.in_flight:
+            return 0
+        done, _ = wait(
+            list(self.in_flight), timeout=None if block else 0, return_when=FIRST_COMPLETED
+        )
+        broken = False
+        for future in done:
+            with self._lock:
+                document, heartbeat = self.in_flight.pop(future)
+            heartbeat.stop()
+            try:
+                updated_document = future.result()
+            except BrokenProcessPool:
+                broken = True
+                release_lease(document, self.worker_id)
+                continue
+            except Exception as e:  # pylint: disable=broad-except
+                print(f"Error processing request_id {document['request_id']}: {e}")
+                worker_metrics.record_failure()
+                release_lease(document, self.worker_id)
+                continue
             update_document_in_db(updated_document)
-            print(f"Processed document with request_id: {document['request_id']}")
+            worker_metrics.record_document(updated_document)
+            print(
+                f"Processed document with request_id: {document['request_id']} "
+                f"in {format_timings(updated_document.get('diagnostics'))}"
+            )
+        if broken:
+            self.restart()
+        return len(done)
+
+    def restart(self):
+        """Replace a broken pool and hand every document it held back to the queue."""
+        print("Pool process died, restarting the pool.")
+        self.release_in_flight()
+        self.executor.shutdown(wait=False)
+        self._progress_stop.set()
+        self._start_progress()
+        self.executor = self._start_executor()
+
+    def release_in_flight(self):
+        """Stop all heartbeats and hand in-flight documents back to the queue."""
+        with self._lock:
+            released = list(self.in_flight.values())
+            self.in_flight.clear()
+        for document, heartbeat in released:
+            heartbeat.stop()
+            release_lease(document, self.worker_id)
 
-        # Add a delay to avoid overwhelming the database
-        time.sleep(5)
+    def drain(self):
+        """
+        Keep every pool process busy until no pending document is left.
+
+        :return: Number of documents claimed or finished, plus those still running
+        """
+        progress = self.collect()
+        while True:
+            while len(self.in_flight) < self.processes:
+                document = claim_next_document(self.worker_id)
+                if document is None:
+                    return progress + self.collect() + len(self.in_flight)
+                self.submit(document)
+                progress += 1
+            progress += self.collect(block=True)
+
+    def close(self):
+        """Shut the pool down, handing unfinished documents back to the queue."""
+        self.release_in_flight()
+        self.executor.shutdown(cancel_futures=True)
+        self._progress_stop.set()
+
+
+def run_poll_mode(worker_id=WORKER_ID, drain=None):
+    """
+    Poll the queue, doubling the delay between empty polls up to POLL_MAX_SECONDS
+    and dropping back to POLL_MIN_SECONDS as soon as work shows up.
+
+    :param worker_id: Identifier of the worker
+    :param drain: Callable draining the queue, defaults to drain_queue
+    """
+    drain = drain or (lambda: drain_queue(worker_id))
+    delay = POLL_MIN_SECONDS
+    while True:
+        if drain():
+            delay = POLL_MIN_SECONDS
+            continue
+        time.sleep(delay)
+        delay = min(delay * 2, POLL_MAX_SECONDS)
+
+
+def run_watch_mode(worker_id=WORKER_ID, drain=None):
+    """
+    Wake up on inserts of pending documents through a MongoDB change stream
+    (or the in-process notifications of an in-memory SQLite job store).
+    The backlog is drained once the stream is open, so nothing inserted before
+    startup is missed; a stream that closes or fails is opened again. Falls
+    back to polling when change streams are not available (e.g. a standalone
+    mongod or a shared SQLite file).
+
+    :param worker_id: Identifier of the worker
+    :param drain: Callable draining the queue, defaults to drain_queue
+    """
+    poll_drain = drain
+    drain = drain or (lambda: drain_queue(worker_id))
+    while True:
+        try:
+            watch = job_store.watch_pending()
+        except ChangeStreamsUnavailable as e:
+            print(f"Change streams unavailable, falling back to polling: {e}")
+            run_poll_mode(worker_id, poll_drain)
+            return
+        with watch as stream:
+            print(f"Worker {worker_id} watching for pending documents")
+            busy = drain()
+            last_scan = time.monotonic()
+            while stream.alive:
+                try:
+                    change = stream.try_next()
+                except STORAGE_ERRORS as e:
+                    print(f"Change stream failed: {e}")
+                    break
+                # keep draining while documents are still running in a pool
+                if change is not None or busy or time.monotonic() - last_scan >= RESCAN_SECONDS:
+                    busy = drain()
+                    last_scan = time.monotonic()
+        print("Change stream closed, opening it again")
+        time.sleep(POLL_MIN_SECONDS)
+
+
+def main():
+    """
+    Continuously claim and process pending documents in the MongoDB collection.
+    Each document is claimed atomically, so several workers can run side by side.
+    Pending documents are picked up through a change stream, or by polling when
+    WORKER_MODE is "poll" or change streams are unavailable. With WORKER_PROCESSES
+    above 1 the documents are analysed in a pool of child processes.
+    Model-quality diagnostics run in a separate low-priority process on the
+    MongoDB backend, and processing metrics are served on METRICS_PORT.
+    """
+    print(f"Worker {WORKER_ID} started")
+    ensure_indexes()
+    # the diagnostics job reads and writes MongoDB collections
+    if DIAGNOSTICS_SECONDS > 0 and STORAGE_BACKEND == "mongo":
+        start_diagnostics_process(DIAGNOSTICS_SECONDS, TOPIC_MODEL_DIR)
+    if METRICS_PORT:
+        serve_metrics(worker_metrics, METRICS_PORT)
+        print(f"Serving metrics on port {METRICS_PORT}")
+    pool = ProcessPoolWorker(WORKER_PROCESSES) if WORKER_PROCESSES > 1 else None
+    drain = pool.drain if pool else None
+    try:
+        if WORKER_MODE == "poll":
+            run_poll_mode(WORKER_ID, drain)
+        else:
+            run_watch_mode(WORKER_ID, drain)
+    finally:
+        if pool:
+            pool.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,401 @@
+"""
+Benchmark suite for the ML pipeline. Runs each analysis stage and the whole
+process_document on speech.txt, speech1.txt, sentiment.texts.json and synthetic
+corpora, reports time and peak memory per stage, writes the results as JSON and
+compares them against a stored baseline. No MongoDB is needed: the sentence cache
+stays in memory and the global topic model lives in a temporary directory.
+
+Usage:
+    python benchmark.py [--sizes 10 1000 10000 50000] [--output benchmark_results.json]
+    python benchmark.py --save-baseline        # record the reference numbers
+    python benchmark.py --baseline benchmark_baseline.json   # exit 1 on regressions
+
+The CI runs "python benchmark.py --ci" against the committed
+benchmark_baseline.json, recorded with "--ci --save-baseline"; a missing
+baseline is an error, not a pass.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+import nltk
+import numpy as np
+from nltk.tokenize import sent_tokenize
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.join(HERE, "..")
+DEFAULT_SIZES = [10, 1000, 10000, 50000]
+DEFAULT_BASELINE = os.path.join(HERE, "benchmark_baseline.json")
+# what --ci runs, and the committed baseline holds (see .github/workflows/ml-client.yml)
+CI_SIZES = [1000, 10000]
+CI_STAGES = ["sentiment", "emotion", "topics", "summary", "trend", "process_document"]
+CI_REPEAT = 5
+# stages --ci runs on fewer corpora: the whole graph's time and peak memory on
+# the largest corpus are what the columnar results and batching must keep down
+CI_STAGE_CORPORA = {"process_document": ["synthetic-10000"]}
+
+# a stage only regresses if it is both this much slower/larger and above the noise floor
+TIME_TOLERANCE = 0.25
+MIN_TIME_DELTA_SECONDS = 0.05
+MEMORY_TOLERANCE = 0.25
+MIN_MEMORY_DELTA_MB = 5.0
+
+
+def read_text_file(path):
+    """
+    Split a text file into sentences, like the web app does on submission.
+
+    :param path: Path of the text file
+    :return: List of sentence strings
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [sentence.strip() for sentence in sent_tokenize(f.read())]
+
+
+def read_export(path):
+    """
+    Sentences of a JSON export of the texts collection.
+
+    :param path: Path of the export
+    :return: List of sentence strings
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        documents = json.load(f)
+    return [entry["sentence"] for document in documents for entry in document.get("sentences", [])]
+
+
+def synthetic_sentences(source_sentences, count, seed=13):
+    """
+    Reproducible synthetic corpus: sentences drawn word by word from the
+    vocabulary and length distribution of real sentences.
+
+    :param source_sentences: Real sentences the corpus imitates
+    :param count: Number of sentences
+    :param seed: Random seed
+    :return: List of sentence strings
+    """
+    rng = random.Random(f"{seed}-{count}")
+    tokenized = [sentence.split() for sentence in source_sentences]
+    frequencies = Counter(word.strip(".,!?;:\"'").lower() for words in tokenized for word in words)
+    frequencies.pop("", None)
+    vocabulary, weights = zip(*sorted(frequencies.items()))
+    lengths = [len(words) for words in tokenized if words]
+    sentences = []
+    for _ in range(count):
+        words = rng.choices(vocabulary, weights=weights, k=rng.choice(lengths))
+        sentences.append(" ".join(words).capitalize() + ".")
+    return sentences
+
+
+def load_corpora(sizes):
+    """
+    Every benchmark corpus.
+
+    :param sizes: Sizes of the synthetic corpora
+    :return: Dict of corpus name to list of sentence strings
+    """
+    corpora = {
+        "speech": read_text_file(os.path.join(REPO_ROOT, "speech.txt")),
+        "speech1": read_text_file(os.path.join(REPO_ROOT, "speech1.txt")),
+        "sentiment.texts": read_export(os.path.join(HERE, "sentiment.texts.json")),
+    }
+    source = corpora["speech"] + corpora["speech1"]
+    for size in sizes:
+        corpora[f"synthetic-{size}"] = synthetic_sentences(source, size)
+    return corpora
+
+
+def pending_sentences(texts):
+    """Sentence entries as stored by the web app."""
+    return [{"sentence": text, "status": "pending", "analysis": None} for text in texts]
+
+
+# each setup function prepares the stage's input untimed and returns the timed
+# callable, which runs what the matching stage of process_document runs
+def setup_preprocessing(app, texts):
+    """Tokenization and lemmatization of the sentences."""
+    sentences = pending_sentences(texts)
+    return lambda: app.preprocess_sentences(sentences)
+
+
+def setup_sentiment(app, texts):
+    """VADER scores of the sentences."""
+    return lambda: app.score_sentiments(texts)
+
+
+def setup_emotion(app, texts):
+    """Emotion lexicon lookup over preprocessed tokens."""
+    token_lists = [tokens.tokens for tokens in app.preprocess_sentences(pending_sentences(texts))]
+    return lambda: app.emotion_lexicon().dominant_codes(token_lists)
+
+
+def setup_ner(app, texts):
+    """Named entities of the sentences, through the batched spaCy pipeline."""
+    return lambda: app.extract_entities(texts, app.EntityTable())
+
+
+def flush_topic_model(app):
+    """Fold updates queued by earlier runs into the global topic model, so they are not timed."""
+    if app.global_topic_model is not None:
+        app.global_topic_model.flush()
+
+
+def setup_topics(app, texts):
+    """Topic inference against the global model, with its update queued."""
+    flush_topic_model(app)
+    sentences = pending_sentences(texts)
+    preprocessed = app.preprocess_sentences(sentences)
+    return lambda: app.perform_topic_modeling(
+        sentences, preprocessed=preprocessed, topic_model=app.global_topic_model
+    )
+
+
+def setup_summary(app, texts):
+    """LexRank summary of preprocessed sentences."""
+    sentences = pending_sentences(texts)
+    preprocessed = app.preprocess_sentences(sentences)
+    return lambda: app.perform_text_summarization(sentences, preprocessed=preprocessed)
+
+
+def setup_trend(app, texts):
+    """Sentiment trend and overall emotions of annotated sentences."""
+    sentences = pending_sentences(texts)
+    annotated = app.SentenceColumns(len(sentences))
+    timer = app.StageTimer()
+    scored = app.sentiment_stage(sentences, annotated, list(range(len(sentences))), timer)
+    app.emotion_stage(scored, annotated, app.preprocess_sentences(sentences), timer)
+    return lambda: (
+        app.perform_sentiment_trend_analysis(annotated),
+        app.perform_overall_emotion_detection(annotated),
+    )
+
+
+def setup_process_document(app, texts):
+    """The whole document graph, starting from an empty sentence cache."""
+    # every run starts cold, as for a document never seen before
+    app.sentence_cache.clear()
+    flush_topic_model(app)
+    document = {
+        "_id": "benchmark",
+        "request_id": "benchmark",
+        "sentences": pending_sentences(texts),
+        "overall_status": "pending",
+    }
+    # including the conversion of the results into the stored sentence entries
+    return lambda: app.document_sentences(app.process_document(document))
+
+
+STAGES = {
+    "preprocessing": setup_preprocessing,
+    "sentiment": setup_sentiment,
+    "emotion": setup_emotion,
+    "ner": setup_ner,
+    "topics": setup_topics,
+    "summary": setup_summary,
+    "trend": setup_trend,
+    "process_document": setup_process_document,
+}
+
+
+def measure(app, setup, texts, repeat, memory):
+    """
+    Time a stage and measure its peak traced memory, on top of its input.
+
+    :param app: The imported app module
+    :param setup: Setup function returning the timed callable
+    :param texts: Sentence strings
+    :param repeat: Timed runs; the fastest one is reported
+    :param memory: Also run once under tracemalloc
+    :return: Dict with seconds and peak_memory_mb
+    """
+    timings = []
+    for _ in range(repeat):
+        run = setup(app, texts)
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    result = {"seconds": min(timings), "peak_memory_mb": None}
+    if memory:
+        run = setup(app, texts)
+        tracemalloc.start()
+        try:
+            baseline, _ = tracemalloc.get_traced_memory()
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result["peak_memory_mb"] = (peak - baseline) / (1024 * 1024)
+    return result
+
+
+def run_benchmarks(app, corpora, stages=None, repeat=1, memory=True, stage_corpora=None):
+    """
+    Benchmark the stages on every corpus.
+
+    :param app: The imported app module
+    :param corpora: Dict of corpus name to sentence strings
+    :param stages: Stage names to run, all by default
+    :param repeat: Timed runs per stage
+    :param memory: Measure peak memory
+    :param stage_corpora: Optional dict of stage name to the only corpora it runs on
+    :return: List of result records
+    """
+    stage_corpora = stage_corpora or {}
+    results = []
+    for corpus, texts in corpora.items():
+        for stage in stages or STAGES:
+            if stage in stage_corpora and corpus not in stage_corpora[stage]:
+                continue
+            record = {"corpus": corpus, "sentences": len(texts), "stage": stage}
+            record.update(measure(app, STAGES[stage], texts, repeat, memory))
+            memory_text = f"{record['peak_memory_mb']:8.1f} MB" if memory else ""
+            print(f"{corpus:<18} {len(texts):>6} {stage:<17} {record['seconds']:9.3f}s {memory_text}")
+            results.append(record)
+    return results
+
+
+def calibrate(repeat=20):
+    """
+    Time a fixed mix of interpreted and numpy work, so timings taken on
+    different machines (a developer's and the CI runner) can be compared.
+
+    :param repeat: Runs; the fastest one is reported
+    :return: Seconds
+    """
+    rng = np.random.default_rng(0)
+    matrix = rng.random((300, 300))
+    words = [f"word{index % 997}" for index in range(200000)]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        Counter(word.upper() for word in words)
+        np.linalg.svd(matrix)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def compare_with_baseline(results, baseline, speed=1.0):
+    """
+    Find stages that got slower or use more memory than in the baseline.
+
+    :param results: Current result records
+    :param baseline: Baseline result records
+    :param speed: Calibration time of this machine over that of the baseline's;
+                  baseline timings are scaled by it
+    :return: List of regression messages
+    """
+    reference = {(record["corpus"], record["stage"]): record for record in baseline}
+    regressions = []
+    for record in results:
+        previous = reference.get((record["corpus"], record["stage"]))
+        if previous is None:
+            continue
+        name = f"{record['corpus']}/{record['stage']}"
+        expected = previous["seconds"] * speed
+        delta = record["seconds"] - expected
+        if delta > MIN_TIME_DELTA_SECONDS and record["seconds"] > expected * (1 + TIME_TOLERANCE):
+            regressions.append(f"{name}: {expected:.3f}s -> {record['seconds']:.3f}s")
+        if record.get("peak_memory_mb") is not None and previous.get("peak_memory_mb") is not None:
+            delta = record["peak_memory_mb"] - previous["peak_memory_mb"]
+            if delta > MIN_MEMORY_DELTA_MB and record["peak_memory_mb"] > previous["peak_memory_mb"] * (1 + MEMORY_TOLERANCE):
+                regressions.append(
+                    f"{name}: {previous['peak_memory_mb']:.1f} MB -> {record['peak_memory_mb']:.1f} MB"
+                )
+    return regressions
+
+
+def import_app(topic_model_dir):
+    """
+    Import the worker module without MongoDB-backed caches, with the global topic
+    model in the given directory, and bootstrap that model on the speech files.
+
+    :param topic_model_dir: Directory for the global topic model
+    :return: The app module
+    """
+    os.environ.pop("SENTENCE_CACHE_PERSIST", None)
+    os.environ["TOPIC_MODEL_DIR"] = topic_model_dir
+    sys.path.insert(0, HERE)
+    import app  # pylint: disable=import-outside-toplevel
+
+    if app.global_topic_model is not None and not app.global_topic_model.refresh():
+        source = pending_sentences(
+            read_text_file(os.path.join(REPO_ROOT, "speech.txt"))
+            + read_text_file(os.path.join(REPO_ROOT, "speech1.txt"))
+        )
+        app.global_topic_model.observe([app.topic_tokens(p) for p in app.preprocess_sentences(source)])
+        app.global_topic_model.flush()
+    return app
+
+
+def main(argv=None):
+    """Run the benchmarks, write the results and check them against the baseline."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="*", default=DEFAULT_SIZES, help="synthetic corpus sizes")
+    parser.add_argument("--stages", nargs="*", choices=list(STAGES), help="stages to run, all by default")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per stage, the fastest is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--output", default=os.path.join(HERE, "benchmark_results.json"))
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--ci", action="store_true", help="run the CI sizes, stages and repeats")
+    args = parser.parse_args(argv)
+    stage_corpora = None
+    if args.ci:
+        args.sizes, args.stages, args.repeat = CI_SIZES, CI_STAGES, CI_REPEAT
+        stage_corpora = CI_STAGE_CORPORA
+
+    nltk.download("punkt", quiet=True)
+    calibration = calibrate()
+    with tempfile.TemporaryDirectory() as topic_model_dir:
+        app = import_app(topic_model_dir)
+        results = run_benchmarks(
+            app, load_corpora(args.sizes), args.stages, args.repeat,
+            memory=not args.no_memory, stage_corpora=stage_corpora,
+        )
+        # let a background update finish before its directory is removed
+        flush_topic_model(app)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "calibration_seconds": calibration,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one.")
+        return 1
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    speed = calibration / baseline["calibration_seconds"] if baseline.get("calibration_seconds") else 1.0
+    print(f"This machine takes {speed:.2f}x the baseline machine's time on the calibration run.")
+    regressions = compare_with_baseline(results, baseline["results"], speed)
+    if regressions:
+        print("PERFORMANCE REGRESSIONS:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""
+Offline bulk analysis: runs process_document over a file of texts without
+MongoDB, e.g. to backfill or re-analyse an export. Input is streamed from a
+JSONL file ({"request_id", "text"} or {"request_id", "sentences"} per line), a
+directory of .txt files or a JSON export of the texts collection (like
+sentiment.texts.json), and analysed in a pool of processes with a bounded number
+of documents in flight. Every result is appended to the output as one JSON line
+as soon as it is done, so an interrupted run resumes where it stopped: documents
+already processed in the output are skipped, failed ones are retried.
+
+Usage:
+    python bulk.py texts.jsonl --output results.jsonl [--processes 4]
+    python bulk.py speeches/ --output results.jsonl
+    python bulk.py sentiment.texts.json --output results.jsonl
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+from nltk.tokenize import sent_tokenize
+
+from app import document_sentences, init_pool_process, process_document
+
+# result fields written for every document
+OUTPUT_FIELDS = [
+    "request_id", "overall_status", "error_message", "sentences", "topics", "summary",
+    "summary_sentences", "sentiment_trend", "overall_emotions", "aggregates", "diagnostics",
+]
+READ_CHUNK_SIZE = 1 << 20
+PROGRESS_SECONDS = 10
+
+
+def pending_document(request_id, sentences):
+    """
+    Document in the shape the web app stores.
+
+    :param request_id: Document id, also the resume key
+    :param sentences: Sentence strings, or entries with a "sentence" field
+    :return: Document dict
+    """
+    texts = [sentence["sentence"] if isinstance(sentence, dict) else sentence for sentence in sentences]
+    return {
+        "request_id": request_id,
+        "sentences": [{"sentence": text, "status": "pending", "analysis": None} for text in texts],
+        "overall_status": "pending",
+        "timestamp": datetime.now(),
+    }
+
+
+def split_text(text):
+    """
+    Split a text into sentences, like the web app does on submission.
+
+    :param text: Text
+    :return: List of sentence strings
+    """
+    return [sentence.strip() for sentence in sent_tokenize(text)]
+
+
+def read_jsonl(path):
+    """
+    Documents of a JSONL file. Lines without a request_id are named after
+    their line number.
+
+    :param path: Path of the file
+    :return: Iterator of documents
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            request_id = str(record.get("request_id") or f"{os.path.basename(path)}:{line_number}")
+            if "sentences" in record:
+                yield pending_document(request_id, record["sentences"])
+            else:
+                yield pending_document(request_id, split_text(record.get("text", "")))
+
+
+def read_directory(path):
+    """
+    Documents of the .txt files in a directory tree, named by their relative path.
+
+    :param path: Directory
+    :return: Iterator of documents
+    """
+    for root, directories, files in os.walk(path):
+        directories.sort()
+        for name in sorted(files):
+            if not name.endswith(".txt"):
+                continue
+            file_path = os.path.join(root, name)
+            with open(file_path, "r", encoding="utf-8") as f:
+                text = f.read()
+            yield pending_document(os.path.relpath(file_path, path), split_text(text))
+
+
+def iter_json_array(f, chunk_size=READ_CHUNK_SIZE):
+    """
+    Items of a JSON array, decoded one at a time so that only the current item
+    and one chunk of the file are held in memory.
+
+    :param f: Text file positioned at the array
+    :param chunk_size: Characters read at a time
+    :return: Iterator of items
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started and buffer.startswith("["):
+            started = True
+            buffer = buffer[1:]
+        # skip the separators between items
+        buffer = buffer.lstrip(", \t\r\n")
+        if buffer.startswith("]"):
+            return
+        if buffer and started:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield item
+                buffer = buffer[end:]
+                continue
+        elif eof:
+            return
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+
+
+def read_export(path):
+    """
+    Documents of a JSON export of the texts collection.
+
+    :param path: Path of the export
+    :return: Iterator of documents
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for index, record in enumerate(iter_json_array(f)):
+            yield pending_document(str(record.get("request_id") or index), record.get("sentences", []))
+
+
+def read_documents(path):
+    """
+    Documents of the input, by its kind: a directory, a .jsonl file or a JSON export.
+
+    :param path: Input path
+    :return: Iterator of documents
+    """
+    if os.path.isdir(path):
+        return read_directory(path)
+    if path.endswith(".jsonl"):
+        return read_jsonl(path)
+    return read_export(path)
+
+
+def completed_request_ids(path):
+    """
+    Ids of the documents already processed in an earlier run's output. A line
+    cut off by an interruption is removed, so appending starts on a new line.
+
+    :param path: Output path
+    :return: Set of request ids
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, "rb+") as f:
+        end = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            end += len(line)
+            record = json.loads(line)
+            if record.get("overall_status") == "processed":
+                completed.add(record["request_id"])
+        f.truncate(end)
+    return completed
+
+
+def analyse_document(document):
+    """
+    Analyse one document and encode its result.
+
+    :param document: Pending document
+    :return: (JSON line, number of sentences, succeeded)
+    """
+    try:
+        result = process_document(document)
+        result = {**result, "sentences": document_sentences(result)}
+    except Exception as e:  # pylint: disable=broad-except
+        result = {**document, "overall_status": "error", "error_message": str(e)}
+    record = {field: result[field] for field in OUTPUT_FIELDS if field in result}
+    line = json.dumps(record, default=str) + "\n"
+    return line, len(document["sentences"]), result["overall_status"] == "processed"
+
+
+class BulkRun:
+    """
+    Counters and output of one bulk run.
+
+    :param output: Output file opened for appending
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.documents = 0
+        self.sentences = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self._reported = self.started
+
+    def record(self, line, sentence_count, succeeded):
+        """
+        Append one result and report progress now and then.
+
+        :param line: Encoded result
+        :param sentence_count: Sentences of the document
+        :param succeeded: Whether the document was processed
+        """
+        self.output.write(line)
+        self.output.flush()
+        self.documents += 1
+        self.sentences += sentence_count
+        self.errors += 0 if succeeded else 1
+        if time.monotonic() - self._reported >= PROGRESS_SECONDS:
+            self._reported = time.monotonic()
+            print(self.report())
+
+    def report(self):
+        """
+        Throughput so far.
+
+        :return: Summary line
+        """
+        seconds = max(time.monotonic() - self.started, 1e-9)
+        return (
+            f"{self.documents} documents ({self.sentences} sentences, {self.errors} errors) "
+            f"in {seconds:.1f}s: {self.documents / seconds:.2f} documents/sec, "
+            f"{self.sentences / seconds:.1f} sentences/sec"
+        )
+
+
+def run_bulk(documents, output_path, processes=1, in_flight=None):
+    """
+    Analyse documents and append their results to the output, skipping those
+    an earlier run already processed.
+
+    :param documents: Iterable of pending documents
+    :param output_path: JSONL output path
+    :param processes: Pool processes; 1 analyses the documents in this process
+    :param in_flight: Documents queued in the pool at most, 2 per process by default
+    :return: BulkRun with the counters
+    """
+    completed = completed_request_ids(output_path)
+    if completed:
+        print(f"Resuming: {len(completed)} documents already processed")
+    remaining = (document for document in documents if document["request_id"] not in completed)
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        run = BulkRun(output)
+        if processes <= 1:
+            for document in remaining:
+                run.record(*analyse_document(document))
+            return run
+
+        in_flight = in_flight or 2 * processes
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_pool_process,
+        ) as executor:
+            running = set()
+            for document in remaining:
+                if len(running) >= in_flight:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        run.record(*future.result())
+                running.add(executor.submit(analyse_document, document))
+            for future in running:
+                run.record(*future.result())
+        return run
+
+
+def main(argv=None):
+    """Analyse the input and report the throughput."""
+    parser = argparse.ArgumentParser(description="Analyse texts in bulk without MongoDB.")
+    parser.add_argument("input", help="JSONL file, directory of .txt files or JSON export")
+    parser.add_argument("--output", required=True, help="JSONL file the results are appended to")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("WORKER_PROCESSES", "1")))
+    args = parser.parse_args(argv)
+
+    run = run_bulk(read_documents(args.input), args.output, args.processes)
+    print(f"Done: {run.report()}")
+    return 1 if run.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
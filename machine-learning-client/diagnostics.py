@@ -0,0 +1,233 @@
+"""
+Model-quality diagnostics, computed off the document-processing path.
+A low-priority background job scores the coherence of the topics stored on
+processed documents and evaluates each new version of the global topic model
+(coherence, perplexity on recent sentences, topic diversity). Results are stored
+in MongoDB for the model-quality dashboard. Run it from a worker (see
+DIAGNOSTICS_SECONDS in app.py) or on its own:
+
+    python diagnostics.py [--once] [--interval 600]
+"""
+
+import argparse
+import multiprocessing
+import os
+import re
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+from gensim import corpora
+from gensim.models import CoherenceModel
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from job_store import MongoJobStore
+from preprocessing import preprocess_sentences, topic_tokens
+from topic_model import GlobalTopicModel
+
+# words inside a print_topic string: 0.100*"climate" + 0.050*"change"
+TOPIC_WORD_PATTERN = re.compile(r'\*\s*"([^"]+)"')
+# fields score_documents reads; the sentences of chunked documents are in their chunks
+SCORED_FIELDS = {"request_id": 1, "alias_of": 1, "chunk_count": 1, "sentences.sentence": 1, "topics": 1}
+
+
+def topic_words(topics):
+    """
+    Top words of each topic in the print_topics format.
+
+    :param topics: List of (topic_id, topic string)
+    :return: List of word lists, skipping topics without words
+    """
+    words = [TOPIC_WORD_PATTERN.findall(topic) for _, topic in topics]
+    return [topic for topic in words if topic]
+
+
+def topic_coherence(topics, texts, coherence="c_v"):
+    """
+    Coherence of topics against the texts they were found in.
+
+    :param topics: List of word lists
+    :param texts: Token lists the coherence is measured on
+    :param coherence: Gensim coherence measure
+    :return: Coherence score, or None if it cannot be computed
+    """
+    dictionary = corpora.Dictionary(texts)
+    topics = [[word for word in topic if word in dictionary.token2id] for topic in topics]
+    topics = [topic for topic in topics if len(topic) > 1]
+    if not topics:
+        return None
+    try:
+        score = CoherenceModel(
+            topics=topics, texts=texts, dictionary=dictionary, coherence=coherence
+        ).get_coherence()
+    except ValueError as e:
+        print(f"Skipping coherence calculation: {str(e)}")
+        return None
+    return None if score != score else float(score)  # NaN for degenerate texts
+
+
+def document_coherence(document):
+    """
+    Coherence of the topics stored on a processed document.
+
+    :param document: Document with sentences and topics
+    :return: Coherence score, or None if it cannot be computed
+    """
+    texts = [topic_tokens(tokens) for tokens in preprocess_sentences(document.get("sentences", []))]
+    texts = [tokens for tokens in texts if tokens]
+    if not texts:
+        return None
+    return topic_coherence(topic_words(document.get("topics") or []), texts)
+
+
+def score_documents(collection, limit=20):
+    """
+    Store the topic coherence of processed documents that have none yet.
+    Documents whose sentences cannot be read are left unscored, so they are
+    tried again on the next pass.
+
+    :param collection: Texts collection
+    :param limit: Maximum number of documents scored in one pass
+    :return: Number of documents scored
+    """
+    store = MongoJobStore(collection)
+    documents = collection.find(
+        {"overall_status": "processed", "topic_coherence": {"$exists": False}}, SCORED_FIELDS
+    )
+    scored = 0
+    for document in documents:
+        if scored >= limit:
+            break
+        sentences = [
+            sentence for chunk in store.iter_chunks(document, ["sentence"]) for sentence in chunk
+        ]
+        if not sentences:
+            print(f"No sentences to score for document with request_id: {document.get('request_id')}")
+            continue
+        collection.update_one(
+            {"_id": document["_id"], "topic_coherence": {"$exists": False}},
+            {"$set": {"topic_coherence": document_coherence({**document, "sentences": sentences})}},
+        )
+        scored += 1
+    return scored
+
+
+def model_diagnostics(topic_model, sample_size=5000, topn=10):
+    """
+    Quality metrics of the current global topic model, measured on the most
+    recent sentences of its retained corpus.
+
+    :param topic_model: GlobalTopicModel
+    :param sample_size: Recent sentences used for coherence and perplexity
+    :param topn: Top words per topic used for coherence and diversity
+    :return: Dict of metrics, or None if there is no model yet
+    """
+    if not topic_model.refresh():
+        return None
+    lda, dictionary = topic_model.lda, topic_model.dictionary
+    texts = [tokens for tokens in topic_model.recent_texts(sample_size) if tokens]
+    topics = [[word for word, _ in lda.show_topic(topic_id, topn=topn)] for topic_id in range(lda.num_topics)]
+    words = [word for topic in topics for word in topic]
+    corpus = [bow for bow in (dictionary.doc2bow(tokens) for tokens in texts) if bow]
+
+    return {
+        "model_version": topic_model.version,
+        "num_topics": lda.num_topics,
+        "vocabulary_size": len(dictionary),
+        "sample_sentences": len(texts),
+        "coherence_c_v": topic_coherence(topics, texts) if texts else None,
+        "coherence_u_mass": topic_coherence(topics, texts, coherence="u_mass") if texts else None,
+        "log_perplexity": float(lda.log_perplexity(corpus)) if corpus else None,
+        # share of distinct words among the topics' top words; low means overlapping topics
+        "topic_diversity": len(set(words)) / len(words) if words else None,
+        "topics": topics,
+    }
+
+
+def record_model_diagnostics(topic_model, collection):
+    """
+    Evaluate the global topic model once per version and store the result.
+
+    :param topic_model: GlobalTopicModel
+    :param collection: Collection holding one record per model version
+    :return: The stored record, or None if nothing new was evaluated
+    """
+    if not topic_model.refresh() or collection.find_one({"model_version": topic_model.version}):
+        return None
+    record = model_diagnostics(topic_model)
+    record["computed_at"] = datetime.now()
+    collection.update_one(
+        {"model_version": record["model_version"]}, {"$setOnInsert": record}, upsert=True
+    )
+    return record
+
+
+def run_diagnostics_once(texts_collection, diagnostics_collection, topic_model=None):
+    """
+    One diagnostics pass: score new documents, then evaluate a new model version.
+
+    :param texts_collection: Texts collection
+    :param diagnostics_collection: Collection for model diagnostics
+    :param topic_model: Optional GlobalTopicModel
+    """
+    try:
+        scored = score_documents(texts_collection)
+        if scored:
+            print(f"Scored topic coherence of {scored} documents")
+        if topic_model is not None and record_model_diagnostics(topic_model, diagnostics_collection):
+            print(f"Stored diagnostics of topic model version {topic_model.version}")
+    except PyMongoError as e:
+        print(f"Diagnostics pass failed: {e}")
+
+
+def run_diagnostics(interval, topic_model_dir=None):
+    """
+    Run diagnostics passes forever at the lowest CPU priority.
+
+    :param interval: Seconds between passes
+    :param topic_model_dir: Directory of the global topic model, if any
+    """
+    os.nice(19)
+    load_dotenv()
+    db = MongoClient(os.getenv("MONGO_URI"))["sentiment"]
+    topic_model = GlobalTopicModel(topic_model_dir) if topic_model_dir else None
+    while True:
+        run_diagnostics_once(db["texts"], db["model_diagnostics"], topic_model)
+        time.sleep(interval)
+
+
+def start_diagnostics_process(interval, topic_model_dir=None):
+    """
+    Start the diagnostics job in a separate low-priority process.
+
+    :param interval: Seconds between passes
+    :param topic_model_dir: Directory of the global topic model, if any
+    :return: The started process
+    """
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_diagnostics, args=(interval, topic_model_dir), daemon=True
+    )
+    process.start()
+    return process
+
+
+def main(argv=None):
+    """Command line entry point for running the diagnostics job on its own."""
+    parser = argparse.ArgumentParser(description="Compute model-quality diagnostics.")
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    parser.add_argument("--interval", type=float, default=float(os.getenv("DIAGNOSTICS_SECONDS", "600")))
+    parser.add_argument("--topic-model-dir", default=os.getenv("TOPIC_MODEL_DIR", "topic_model"))
+    args = parser.parse_args(argv)
+
+    if args.once:
+        load_dotenv()
+        db = MongoClient(os.getenv("MONGO_URI"))["sentiment"]
+        topic_model = GlobalTopicModel(args.topic_model_dir) if args.topic_model_dir else None
+        run_diagnostics_once(db["texts"], db["model_diagnostics"], topic_model)
+    else:
+        run_diagnostics(args.interval, args.topic_model_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Built-in emotion scorer replacing per-sentence text2emotion calls.
+The text2emotion lexicon is compiled once into a word index, and a whole batch
+of preprocessed sentences is scored in one vectorized pass. Scores use the same
+Happy/Angry/Surprise/Sad/Fear categories and normalization as text2emotion.
+"""
+
+import ast
+import inspect
+import warnings
+from functools import lru_cache
+
+import numpy as np
+from nltk.corpus import stopwords
+import text2emotion as te
+
+from preprocessing import lemmatize
+
+EMOTIONS = ("Happy", "Angry", "Surprise", "Sad", "Fear")
+EMOTION_CODES = {emotion: code for code, emotion in enumerate(EMOTIONS)}
+# a sentence's dominant emotions as one small integer: bit i set for EMOTION_LABELS[i]
+EMOTION_LABELS = EMOTIONS + ("Neutral",)
+NEUTRAL_BIT = 1 << EMOTION_LABELS.index("Neutral")
+
+# tables defined inside text2emotion.get_emotion, rebuilt there on every call
+TEXT2EMOTION_TABLES = ("df", "emoj", "d", "shortcuts")
+
+
+def load_text2emotion_tables():
+    """
+    Read the lexicon tables out of the installed text2emotion source, so the
+    engine stays in sync with the package instead of carrying a copy.
+
+    :return: Dict of table name to table
+    :raises: ValueError if a table cannot be found
+    """
+    with warnings.catch_warnings():
+        # text2emotion's regexes use invalid escape sequences
+        warnings.simplefilter("ignore", (DeprecationWarning, SyntaxWarning))
+        tree = ast.parse(inspect.getsource(te))
+    tables = {}
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Assign)
+            and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name)
+            and node.targets[0].id in TEXT2EMOTION_TABLES
+        ):
+            tables[node.targets[0].id] = ast.literal_eval(node.value)
+    missing = set(TEXT2EMOTION_TABLES) - set(tables)
+    if missing:
+        raise ValueError(f"text2emotion tables not found: {sorted(missing)}")
+    return tables
+
+
+class EmotionLexicon:
+    """
+    Word index mapping lemmas to emotion codes, plus text2emotion's rules for
+    negations ("not happy"), chat shortcuts and emojis.
+    """
+
+    def __init__(self, words, negations, shortcuts, emojis, stop_words):
+        self.index = {word: EMOTION_CODES[emotion] for word, emotion in words.items()}
+        self.negations = {phrase: emotion.lower() for phrase, emotion in negations.items()}
+        self.shortcuts = {token: tuple(expansion.lower().split()) for token, expansion in shortcuts.items()}
+        self.emojis = {char: emotion.lower() for char, emotion in emojis.items()}
+        self.stop_words = stop_words
+        self._codes = {}
+
+    @classmethod
+    def from_text2emotion(cls):
+        """
+        Compile the lexicon shipped with text2emotion.
+
+        :return: EmotionLexicon
+        """
+        tables = load_text2emotion_tables()
+        words = {}
+        # text2emotion looks words up with list.index, so the first entry wins,
+        # and it skips whatever sits at index 0
+        for word, emotion in list(zip(tables["df"]["Word"], tables["df"]["Emotion"]))[1:]:
+            words.setdefault(word, emotion)
+        emojis = {}
+        for char, emotion in zip(tables["emoj"]["Emoji"], tables["emoj"]["Emotion"]):
+            if len(char) == 1:
+                emojis.setdefault(char, emotion)
+        return cls(
+            words,
+            tables["d"],
+            tables["shortcuts"],
+            emojis,
+            # text2emotion filters with the stopwords of every language
+            frozenset(word.lower() for word in stopwords.words()),
+        )
+
+    def expand(self, tokens):
+        """
+        Apply the negation, contraction, shortcut and emoji rules to a token list.
+
+        :param tokens: Lowercased word tokens of one sentence
+        :return: List of words to look up
+        """
+        tokens = ["not" if token == "n't" else token for token in tokens]
+        words = []
+        position = 0
+        while position < len(tokens):
+            token = tokens[position]
+            if token == "not" and position + 1 < len(tokens):
+                replacement = self.negations.get(f"not {tokens[position + 1]}")
+                if replacement:
+                    words.append(replacement)
+                    position += 2
+                    continue
+            if token.startswith(("http", "www.", "//")):
+                position += 1
+                continue
+            emoji_words = [self.emojis[char] for char in token if char in self.emojis]
+            words.extend(emoji_words or self.shortcuts.get(token, (token,)))
+            position += 1
+        return words
+
+    def code(self, word):
+        """
+        Emotion code of a word, or -1 if it carries none. Results are cached.
+
+        :param word: Lowercased word
+        :return: Index into EMOTIONS, or -1
+        """
+        code = self._codes.get(word)
+        if code is None:
+            if word.isdigit() or len(word) <= 2 or word in self.stop_words:
+                code = -1
+            else:
+                code = self.index.get(lemmatize(lemmatize(word, "v"), "n"), -1)
+            self._codes[word] = code
+        return code
+
+    def score(self, token_lists):
+        """
+        Score a batch of sentences.
+
+        :param token_lists: List of token lists, one per sentence
+        :return: Array of shape (sentences, 5) with each row normalized to sum to 1
+                 (rounded to 2 decimals like text2emotion), or all zeros
+        """
+        rows, codes = [], []
+        for row, tokens in enumerate(token_lists):
+            for word in self.expand(tokens):
+                code = self.code(word)
+                if code >= 0:
+                    rows.append(row)
+                    codes.append(code)
+        counts = np.zeros((len(token_lists), len(EMOTIONS)))
+        np.add.at(counts, (np.array(rows, dtype=int), np.array(codes, dtype=int)), 1)
+        totals = counts.sum(axis=1, keepdims=True)
+        return np.round(np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0), 2)
+
+    def dominant_codes(self, token_lists):
+        """
+        Dominant emotion(s) of each sentence as bitmask codes (see emotion_labels),
+        Neutral if none was found.
+
+        :param token_lists: List of token lists, one per sentence
+        :return: uint8 array, one code per sentence
+        """
+        scores = self.score(token_lists)
+        if not len(scores):
+            return np.zeros(0, dtype=np.uint8)
+        peaks = scores.max(axis=1, keepdims=True)
+        codes = ((scores == peaks) & (peaks > 0)) @ (1 << np.arange(len(EMOTIONS)))
+        codes[peaks.ravel() <= 0] = NEUTRAL_BIT
+        return codes.astype(np.uint8)
+
+    def dominant_emotions(self, token_lists):
+        """
+        Dominant emotion(s) of each sentence, or ["Neutral"] if none was found.
+
+        :param token_lists: List of token lists, one per sentence
+        :return: List of emotion lists, one per sentence
+        """
+        return [emotion_labels(code) for code in self.dominant_codes(token_lists)]
+
+
+def emotion_code(emotions):
+    """
+    Bitmask code of a list of emotions.
+
+    :param emotions: List of names from EMOTION_LABELS, or None
+    :return: int, 0 for no emotions
+    """
+    return sum(1 << EMOTION_LABELS.index(emotion) for emotion in set(emotions or ()) if emotion in EMOTION_LABELS)
+
+
+def emotion_labels(code):
+    """
+    Emotion names of a bitmask code, in EMOTION_LABELS order.
+
+    :param code: Bitmask code
+    :return: List of emotion names
+    """
+    return [label for bit, label in enumerate(EMOTION_LABELS) if int(code) >> bit & 1]
+
+
+@lru_cache(maxsize=None)
+def emotion_lexicon():
+    """
+    Compile the emotion lexicon once per process.
+
+    :return: EmotionLexicon
+    """
+    return EmotionLexicon.from_text2emotion()
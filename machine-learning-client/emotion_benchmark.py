@@ -0,0 +1,96 @@
+"""
+Agreement benchmark between the built-in emotion engine and text2emotion.
+Every sentence of the given files (speech.txt and speech1.txt by default) is
+scored by both, and the script reports how often the dominant emotions match
+and how long each one took.
+
+Usage: python emotion_benchmark.py [file ...]
+"""
+
+import argparse
+import os
+import time
+
+import nltk
+from nltk.tokenize import sent_tokenize
+import text2emotion as te
+
+from emotion import EMOTIONS, emotion_lexicon
+from preprocessing import preprocess_sentences
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_FILES = [os.path.join(REPO_ROOT, "speech.txt"), os.path.join(REPO_ROOT, "speech1.txt")]
+
+
+def text2emotion_dominant(text):
+    """
+    Dominant emotion(s) of a sentence according to text2emotion.
+
+    :param text: Sentence text
+    :return: List of emotions, or ["Neutral"]
+    """
+    emotions = te.get_emotion(text)
+    if not any(emotions.values()):
+        return ["Neutral"]
+    max_value = max(emotions.values())
+    return [emotion for emotion, score in emotions.items() if score == max_value and score > 0]
+
+
+def compare(texts):
+    """
+    Score sentences with both engines and measure their agreement.
+
+    :param texts: List of sentence strings
+    :return: Dict with sentence count, agreement rates and timings
+    """
+    lexicon = emotion_lexicon()
+
+    start = time.perf_counter()
+    preprocessed = preprocess_sentences([{"sentence": text} for text in texts])
+    engine_results = lexicon.dominant_emotions([sentence.tokens for sentence in preprocessed])
+    engine_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference_results = [text2emotion_dominant(text) for text in texts]
+    text2emotion_seconds = time.perf_counter() - start
+
+    matches = sum(set(a) == set(b) for a, b in zip(engine_results, reference_results))
+    per_emotion = {
+        emotion: sum(
+            (emotion in a) == (emotion in b) for a, b in zip(engine_results, reference_results)
+        ) / max(len(texts), 1)
+        for emotion in EMOTIONS + ("Neutral",)
+    }
+    return {
+        "sentences": len(texts),
+        "agreement": matches / max(len(texts), 1),
+        "per_emotion_agreement": per_emotion,
+        "engine_seconds": engine_seconds,
+        "text2emotion_seconds": text2emotion_seconds,
+    }
+
+
+def main(argv=None):
+    """Run the benchmark on the given files and print the report."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("files", nargs="*", default=DEFAULT_FILES)
+    args = parser.parse_args(argv)
+
+    nltk.download("punkt", quiet=True)
+    for path in args.files:
+        with open(path, "r", encoding="utf-8") as f:
+            texts = sent_tokenize(f.read())
+        report = compare(texts)
+        print(f"{os.path.basename(path)}: {report['sentences']} sentences")
+        print(f"  dominant emotion agreement: {report['agreement']:.1%}")
+        for emotion, rate in report["per_emotion_agreement"].items():
+            print(f"    {emotion:<8} {rate:.1%}")
+        speedup = report["text2emotion_seconds"] / max(report["engine_seconds"], 1e-9)
+        print(
+            f"  engine: {report['engine_seconds']:.3f}s  "
+            f"text2emotion: {report['text2emotion_seconds']:.3f}s  ({speedup:.0f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
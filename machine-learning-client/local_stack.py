@@ -0,0 +1,138 @@
+"""
+Web app and worker in one process on an embedded SQLite job store, without
+MongoDB or Docker, e.g. to try the app locally or to measure the end-to-end
+latency of submissions. The worker drains the queue in a background thread and
+the web app is served from the main thread; both share the database at
+SQLITE_PATH (in memory by default).
+
+Usage:
+    python local_stack.py serve [--port 5000]
+    python local_stack.py benchmark [--requests 20] [--text speech.txt]
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WEB_APP_DIR = os.path.join(HERE, "..", "web-app")
+SHARED_DIR = os.path.join(HERE, "..", "shared")
+POLL_SECONDS = 0.05
+
+
+def load_web_app():
+    """
+    Import the web app next to this worker, with the job store both share on
+    the path. Its directory goes last, so this client's modules come first.
+
+    :return: The web app module
+    """
+    for directory in (SHARED_DIR, WEB_APP_DIR):
+        if directory not in sys.path:
+            sys.path.append(directory)
+    spec = importlib.util.spec_from_file_location("web_app", os.path.join(WEB_APP_DIR, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def start_worker():
+    """
+    Run the worker's watch loop in a daemon thread.
+
+    :return: The thread
+    """
+    import app as worker  # pylint: disable=import-outside-toplevel
+
+    worker.ensure_indexes()
+    thread = threading.Thread(target=worker.run_watch_mode, name="worker", daemon=True)
+    thread.start()
+    return thread
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile.
+
+    :param values: Non-empty list of numbers
+    :param fraction: Percentile as a fraction, e.g. 0.95
+    :return: The value
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def run_benchmark(web_app, requests, text, timeout=600):
+    """
+    Submit unique copies of a text one after another and wait for each result.
+
+    :param web_app: The web app module
+    :param requests: Number of submissions
+    :param text: Text submitted, made unique per request so none is deduplicated
+    :param timeout: Seconds to wait for one result
+    :return: Dict with the latencies and the throughput
+    """
+    client = web_app.app.test_client()
+    latencies = []
+    started = time.monotonic()
+    for index in range(requests):
+        submitted = time.monotonic()
+        response = client.post("/checkSentiment", json={"sentence": f"{text} Run {index}."})
+        if response.status_code != 200:
+            raise RuntimeError(f"Submission refused with {response.status_code}: {response.get_json()}")
+        request_id = response.get_json()["request_id"]
+        while True:
+            response = client.get(f"/get_analysis?request_id={request_id}")
+            if response.status_code != 202:
+                break
+            if time.monotonic() - submitted > timeout:
+                raise RuntimeError(f"No result for {request_id} after {timeout}s")
+            time.sleep(POLL_SECONDS)
+        if response.status_code != 200:
+            raise RuntimeError(f"Analysis failed with {response.status_code}: {response.get_json()}")
+        latencies.append(time.monotonic() - submitted)
+    seconds = time.monotonic() - started
+    return {
+        "requests": requests,
+        "p50_seconds": percentile(latencies, 0.5),
+        "p95_seconds": percentile(latencies, 0.95),
+        "requests_per_second": requests / seconds,
+    }
+
+
+def main(argv=None):
+    """Serve the web app or benchmark it, with the worker running alongside."""
+    parser = argparse.ArgumentParser(description="Run the web app and a worker on SQLite.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="serve the web app")
+    serve.add_argument("--port", type=int, default=5000)
+    benchmark = commands.add_parser("benchmark", help="measure the end-to-end latency")
+    benchmark.add_argument("--requests", type=int, default=20)
+    benchmark.add_argument("--text", default=os.path.join(HERE, "..", "speech.txt"),
+                           help="file whose text is submitted")
+    args = parser.parse_args(argv)
+
+    # both services pick their job store when they are imported
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ.setdefault("SQLITE_PATH", ":memory:")
+    web_app = load_web_app()
+    start_worker()
+    if args.command == "serve":
+        web_app.app.run(host="0.0.0.0", port=args.port, threaded=True)
+        return 0
+
+    with open(args.text, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    result = run_benchmark(web_app, args.requests, text)
+    print(
+        f"{result['requests']} requests: p50 {result['p50_seconds']:.2f}s, "
+        f"p95 {result['p95_seconds']:.2f}s, {result['requests_per_second']:.2f} requests/sec"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+Per-stage instrumentation of document processing and the worker's metrics endpoint.
+StageTimer records wall time, CPU time and sentence/token counts of every stage of
+one document; the result is stored on the document under "diagnostics". The worker
+folds those into WorkerMetrics, which serves counters, throughput and per-stage
+latency percentiles as JSON over HTTP (GET /metrics).
+"""
+
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+class StageTimer:
+    """
+    Collects the timings of the stages of one document. Stages may run on other
+    threads: each stage's CPU time is that of its own thread, the total is the
+    process's CPU time.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+
+    @contextmanager
+    def stage(self, name, **counts):
+        """
+        Time a stage. Counts (e.g. sentences=, tokens=) are stored with it and can
+        also be set on the yielded dict while the stage runs.
+
+        :param name: Stage name
+        :return: Context manager yielding the stage record
+        """
+        record = dict(counts)
+        wall_started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall_started
+            record["cpu_seconds"] = time.thread_time() - cpu_started
+            self.stages[name] = record
+
+    def result(self):
+        """
+        Diagnostics of the document so far.
+
+        :return: Dict with the stages and the total wall and CPU time
+        """
+        return {
+            "stages": self.stages,
+            "wall_seconds": time.perf_counter() - self._started,
+            "cpu_seconds": time.process_time() - self._cpu_started,
+        }
+
+
+def format_timings(diagnostics):
+    """
+    One-line summary of a document's stage timings for the worker log.
+
+    :param diagnostics: Diagnostics stored on the document
+    :return: e.g. "1.92s (preprocessing 0.12s, ner 1.40s, ...)"
+    """
+    if not diagnostics:
+        return "no timings"
+    stages = ", ".join(
+        f"{name} {stage['wall_seconds']:.2f}s" for name, stage in diagnostics["stages"].items()
+    )
+    return f"{diagnostics['wall_seconds']:.2f}s ({stages})"
+
+
+class WorkerMetrics:
+    """
+    Thread-safe counters and latency samples of one worker.
+
+    :param queue_depth: Optional callable returning a dict of queue sizes
+    :param window_seconds: Window over which documents/sec is computed
+    :param max_samples: Latency samples kept per stage for the percentiles
+    """
+
+    def __init__(self, queue_depth=None, window_seconds=60, max_samples=2048):
+        self.queue_depth = queue_depth
+        self.window_seconds = window_seconds
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._counters = defaultdict(int)
+        self._completed = deque()
+        self._samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+
+    def record_document(self, document):
+        """
+        Count a finished document and sample the timings of its stages.
+
+        :param document: Processed or failed document
+        """
+        diagnostics = document.get("diagnostics") or {}
+        now = time.time()
+        with self._lock:
+            self._counters[f"documents_{document.get('overall_status', 'processed')}"] += 1
+            self._completed.append(now)
+            if "wall_seconds" in diagnostics:
+                self._samples["document"].append(diagnostics["wall_seconds"])
+            stages = diagnostics.get("stages", {})
+            for name, stage in stages.items():
+                self._samples[name].append(stage["wall_seconds"])
+            self._counters["sentences"] += stages.get("preprocessing", {}).get("sentences", 0)
+            self._counters["tokens"] += stages.get("preprocessing", {}).get("tokens", 0)
+            # counted per document, so lookups in pool processes are included
+            self._counters["sentence_cache_hits"] += stages.get("sentence_cache", {}).get("hits", 0)
+            self._counters["sentence_cache_misses"] += stages.get("sentence_cache", {}).get("misses", 0)
+
+    def record_failure(self):
+        """Count a document whose processing raised."""
+        with self._lock:
+            self._counters["documents_failed"] += 1
+
+    def snapshot(self):
+        """
+        Aggregated metrics.
+
+        :return: Dict of counters, throughput, sentence cache hit rate, queue depth
+                 and stage latency percentiles
+        """
+        now = time.time()
+        with self._lock:
+            while self._completed and self._completed[0] < now - self.window_seconds:
+                self._completed.popleft()
+            window = min(self.window_seconds, max(now - self._started, 1e-9))
+            latencies = {
+                name: {
+                    "count": len(samples),
+                    **{
+                        f"p{q}": float(value)
+                        for q, value in zip(PERCENTILES, np.percentile(list(samples), PERCENTILES))
+                    },
+                }
+                for name, samples in self._samples.items()
+                if samples
+            }
+            lookups = self._counters["sentence_cache_hits"] + self._counters["sentence_cache_misses"]
+            snapshot = {
+                "uptime_seconds": now - self._started,
+                "counters": dict(self._counters),
+                "sentence_cache_hit_rate": self._counters["sentence_cache_hits"] / lookups if lookups else 0.0,
+                "documents_per_second": len(self._completed) / window,
+                "latency_seconds": latencies,
+            }
+        if self.queue_depth is not None:
+            try:
+                snapshot["queue_depth"] = self.queue_depth()
+            except Exception as e:  # pylint: disable=broad-except
+                snapshot["queue_depth"] = {"error": str(e)}
+        return snapshot
+
+
+def serve_metrics(metrics, port, host="0.0.0.0"):
+    """
+    Serve the metrics as JSON on GET /metrics from a background thread.
+
+    :param metrics: WorkerMetrics
+    :param port: Port to listen on
+    :param host: Interface to listen on
+    :return: The running server
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """Request handler for the metrics endpoint."""
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Return the metrics snapshot."""
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = json.dumps(metrics.snapshot()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            """Keep scrapes out of the worker log."""
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
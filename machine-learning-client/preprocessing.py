@@ -0,0 +1,91 @@
+"""
+Shared text preprocessing for the analyses in app.py.
+Each sentence is tokenized and lemmatized once per document, and topic
+modeling, summarization and emotion detection all read from the result.
+"""
+
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+from nltk.tokenize import word_tokenize
+
+# tokens: lowercased word tokens
+# lemmas: WordNet (noun) lemma of each token
+PreprocessedSentence = namedtuple("PreprocessedSentence", ["tokens", "lemmas"])
+
+# same rule sumy's Tokenizer uses to tell words from punctuation and numbers
+WORD_PATTERN = re.compile(r"^[^\W\d_](?:[^\W\d_]|['-])*$", re.UNICODE)
+
+_lemmatizer = WordNetLemmatizer()
+
+
+@lru_cache(maxsize=None)
+def english_stopwords():
+    """
+    Load the English stopword list once as a set.
+
+    :return: frozenset of stopwords
+    """
+    return frozenset(stopwords.words("english"))
+
+
+@lru_cache(maxsize=65536)
+def lemmatize(token, pos="n"):
+    """
+    Lemmatize a token, caching the result across sentences and documents.
+
+    :param token: Lowercased token
+    :param pos: WordNet part of speech
+    :return: Lemma
+    """
+    return _lemmatizer.lemmatize(token, pos)
+
+
+def preprocess_sentence(text):
+    """
+    Tokenize and lemmatize a single sentence.
+
+    :param text: Sentence text
+    :return: PreprocessedSentence
+    """
+    tokens = word_tokenize(text.lower())
+    return PreprocessedSentence(tokens, [lemmatize(token) for token in tokens])
+
+
+def preprocess_sentences(sentences):
+    """
+    Preprocess every sentence of a document.
+
+    :param sentences: List of sentence entries
+    :return: List of PreprocessedSentence, one per sentence entry
+    """
+    return [preprocess_sentence(sentence_entry["sentence"]) for sentence_entry in sentences]
+
+
+def topic_tokens(preprocessed):
+    """
+    Alphanumeric lemmas that are not stopwords, as used for topic modeling.
+
+    :param preprocessed: PreprocessedSentence
+    :return: List of lemmas
+    """
+    stop_words = english_stopwords()
+    return [
+        lemma
+        for token, lemma in zip(preprocessed.tokens, preprocessed.lemmas)
+        if token.isalnum() and lemma not in stop_words
+    ]
+
+
+def summary_words(preprocessed):
+    """
+    Word tokens (no punctuation or numbers), as used for summarization.
+
+    :param preprocessed: PreprocessedSentence
+    :return: Tuple of tokens
+    """
+    return tuple(token for token in preprocessed.tokens if WORD_PATTERN.match(token))
+
@@ -0,0 +1,88 @@
+"""
+Shortest-job-first ordering of the pending documents, with aging. Every
+document gets a priority time: its submission timestamp pushed back by an
+estimated cost that grows with its sentence and character counts, capped at
+max_delay_seconds. Workers claim the document with the earliest priority time,
+so small submissions overtake large ones, but only those submitted before the
+large one's priority time; once that time has passed nothing new can overtake
+it, which bounds its wait to max_delay_seconds plus the work already ahead.
+
+Only the window_size oldest claimable documents, read in timestamp order from
+the (overall_status, timestamp) index, are ranked by priority time, so a claim
+does not sort the whole queue. A small document behind more than window_size
+older ones waits until it is in the window.
+"""
+
+
+class JobCostModel:
+    """
+    Estimated cost of a document, as a delay in seconds added to its timestamp.
+
+    :param seconds_per_sentence: Delay per sentence
+    :param seconds_per_char: Delay per character of the submitted text
+    :param max_delay_seconds: Upper bound of the delay, i.e. of how long newer
+                              submissions can overtake a document
+    :param window_size: Oldest claimable documents ranked per claim
+    """
+
+    def __init__(self, seconds_per_sentence=0.05, seconds_per_char=0.0, max_delay_seconds=600.0,
+                 window_size=1000):
+        self.seconds_per_sentence = seconds_per_sentence
+        self.seconds_per_char = seconds_per_char
+        self.max_delay_seconds = max_delay_seconds
+        self.window_size = window_size
+
+    def cost_seconds(self, sentence_count, char_count):
+        """
+        Delay of a document with the given size.
+
+        :param sentence_count: Number of sentences
+        :param char_count: Number of characters
+        :return: float
+        """
+        cost = self.seconds_per_sentence * sentence_count + self.seconds_per_char * char_count
+        return min(self.max_delay_seconds, cost)
+
+    def priority_expression(self):
+        """
+        MongoDB aggregation expression of a document's priority time. Documents
+        submitted before the sizes were recorded fall back to counting their
+        sentence entries.
+
+        :return: Expression evaluating to a date
+        """
+        sentence_count = {
+            "$ifNull": ["$sentence_count", {"$size": {"$ifNull": ["$sentences", []]}}]
+        }
+        char_count = {"$ifNull": ["$char_count", 0]}
+        cost_seconds = {
+            "$min": [
+                self.max_delay_seconds,
+                {
+                    "$add": [
+                        {"$multiply": [self.seconds_per_sentence, sentence_count]},
+                        {"$multiply": [self.seconds_per_char, char_count]},
+                    ]
+                },
+            ]
+        }
+        # adding a number to a date adds milliseconds
+        return {"$add": ["$timestamp", {"$multiply": [1000, cost_seconds]}]}
+
+    def claim_pipeline(self, claimable, limit):
+        """
+        Aggregation pipeline returning the ids of the claimable documents to
+        try first, ranked within the window of the oldest ones.
+
+        :param claimable: Query matching the documents a worker may claim
+        :param limit: Number of candidates returned
+        :return: List of pipeline stages
+        """
+        return [
+            {"$match": claimable},
+            {"$sort": {"timestamp": 1}},
+            {"$limit": self.window_size},
+            {"$project": {"priority": self.priority_expression()}},
+            {"$sort": {"priority": 1, "_id": 1}},
+            {"$limit": limit},
+        ]
@@ -27,6 +27,8 @@ document = {
     "sentences": [],
     "overall_status": "pending",
     "timestamp": datetime.now(),
+    "sentence_count": len(sentences),
+    "char_count": len(speech_text),
 }
 
 for sentence in sentences:
@@ -0,0 +1,131 @@
+"""
+Cross-document cache of per-sentence results (sentiment, emotions, entities).
+Sentences are keyed by a hash of their normalized text and the analyzer version.
+Lookups go to an in-process LRU first and then to an optional MongoDB collection
+shared by every worker.
+"""
+
+import hashlib
+import re
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+CACHED_FIELDS = ("analysis", "emotions", "entities")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def sentence_key(text, version):
+    """
+    Cache key of a sentence. Only whitespace is normalized, since case and
+    punctuation change VADER scores and entities.
+
+    :param text: Sentence text
+    :param version: Analyzer version
+    :return: Hex digest
+    """
+    normalized = _WHITESPACE.sub(" ", text).strip()
+    return hashlib.blake2b(f"{version}\0{normalized}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+class SentenceCache:
+    """
+    Two-tier memo cache of sentence results.
+
+    :param version: Analyzer version, part of every key
+    :param max_size: Number of sentences kept in the in-process LRU
+    :param collection: Optional MongoDB collection used as the persistent tier
+    """
+
+    def __init__(self, version, max_size=10000, collection=None):
+        self.version = version
+        self.max_size = max_size
+        self.collection = collection
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remember(self, key, result):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_many(self, texts):
+        """
+        Look up several sentences at once.
+
+        :param texts: List of sentence texts
+        :return: Dict of text to cached result for every text found
+        """
+        found, missing = {}, {}
+        for text in set(texts):
+            key = sentence_key(text, self.version)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                found[text] = self._entries[key]
+            else:
+                missing[key] = text
+
+        if missing and self.collection is not None:
+            try:
+                for stored in self.collection.find({"_id": {"$in": list(missing)}}):
+                    result = {field: stored[field] for field in CACHED_FIELDS}
+                    self._remember(stored["_id"], result)
+                    found[missing.pop(stored["_id"])] = result
+                    self.persistent_hits += 1
+            except PyMongoError as e:
+                print(f"Sentence cache lookup failed: {e}")
+
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found
+
+    def put_many(self, results):
+        """
+        Store freshly computed sentence results.
+
+        :param results: Dict of text to result with the CACHED_FIELDS
+        """
+        requests = []
+        for text, result in results.items():
+            key = sentence_key(text, self.version)
+            self._remember(key, result)
+            requests.append(UpdateOne(
+                {"_id": key},
+                {"$setOnInsert": {**result, "version": self.version, "created_at": datetime.now()}},
+                upsert=True,
+            ))
+
+        if requests and self.collection is not None:
+            try:
+                self.collection.bulk_write(requests, ordered=False)
+            except PyMongoError as e:
+                print(f"Sentence cache write failed: {e}")
+
+    def clear(self):
+        """Drop the in-process tier and reset the statistics."""
+        self._entries.clear()
+        self.hits = self.persistent_hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Cache statistics.
+
+        :return: Dict with hits, misses, hit rate, evictions and size
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
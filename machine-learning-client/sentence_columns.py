@@ -0,0 +1,232 @@
+"""
+Columnar store for the per-sentence results of one document. The four VADER
+scores of every sentence live in one float array, its dominant emotions in one
+bitmask code (see emotion.emotion_labels) and its entities as ids into a table
+of distinct (text, label) pairs, instead of a dict, a list and a list of dicts
+per sentence. The stages fill the arrays directly; the results are converted to
+the Mongo/JSON shape of the sentence entries only when they are written out
+(to_entries) or read in (from_entries, set_row).
+"""
+
+import numpy as np
+
+from emotion import EMOTION_LABELS, emotion_code, emotion_labels
+
+SCORE_FIELDS = ("neg", "neu", "pos", "compound")
+COMPOUND = SCORE_FIELDS.index("compound")
+# bins of the stored compound score histogram, over the whole score range
+COMPOUND_BINS = 20
+# VADER's usual thresholds of positive and negative sentences
+POSITIVE_THRESHOLD = 0.05
+NEGATIVE_THRESHOLD = -0.05
+
+
+class EntityTable:
+    """
+    Interned (text, label) pairs of named entities.
+    """
+
+    def __init__(self):
+        self.entities = []
+        self._ids = {}
+
+    def __len__(self):
+        return len(self.entities)
+
+    def intern(self, text, label):
+        """
+        Id of an entity, added to the table if it is new.
+
+        :param text: Entity text
+        :param label: Entity label
+        :return: int
+        """
+        key = (text, label)
+        entity_id = self._ids.get(key)
+        if entity_id is None:
+            entity_id = self._ids[key] = len(self.entities)
+            self.entities.append(key)
+        return entity_id
+
+    def to_dicts(self, entity_ids):
+        """
+        Entities in the stored shape.
+
+        :param entity_ids: Sequence of ids
+        :return: List of {"text", "label"} dicts
+        """
+        return [
+            {"text": text, "label": label}
+            for text, label in (self.entities[entity_id] for entity_id in entity_ids)
+        ]
+
+
+class SentenceColumns:
+    """
+    Results of the sentences of one document, one row per sentence.
+
+    :param size: Number of sentences
+    :param entity_table: Optional EntityTable shared with other columns
+    """
+
+    def __init__(self, size, entity_table=None):
+        self.scores = np.zeros((size, len(SCORE_FIELDS)))
+        self.analysed = np.zeros(size, dtype=bool)
+        # 0 while emotion detection has not run on the sentence
+        self.emotions = np.zeros(size, dtype=np.uint8)
+        # tuple of entity ids per sentence, None while NER has not run on it
+        self.entities = [None] * size
+        self.entity_table = entity_table if entity_table is not None else EntityTable()
+
+    def __len__(self):
+        return len(self.analysed)
+
+    def set_scores(self, indices, scores):
+        """
+        Store sentiment scores.
+
+        :param indices: Sentence indices
+        :param scores: Array of shape (len(indices), 4) in SCORE_FIELDS order
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        self.scores[indices] = scores
+        self.analysed[indices] = True
+
+    def set_row(self, index, fields):
+        """
+        Store the results of one sentence given in the stored shape, e.g. a
+        sentence cache entry.
+
+        :param index: Sentence index
+        :param fields: Dict with optional "analysis", "emotions" and "entities"
+        """
+        analysis = fields.get("analysis")
+        if analysis is not None:
+            self.scores[index] = [analysis.get(field, 0.0) for field in SCORE_FIELDS]
+            self.analysed[index] = True
+        self.emotions[index] = emotion_code(fields.get("emotions"))
+        entities = fields.get("entities")
+        if entities is not None:
+            self.entities[index] = tuple(
+                self.entity_table.intern(entity["text"], entity["label"]) for entity in entities
+            )
+
+    def row(self, index, fields=("analysis", "emotions", "entities")):
+        """
+        Results of one sentence in the stored shape.
+
+        :param index: Sentence index
+        :param fields: Fields to include
+        :return: Dict of field to value, None for results not computed yet
+        """
+        row = {}
+        if "analysis" in fields:
+            row["analysis"] = (
+                dict(zip(SCORE_FIELDS, self.scores[index].tolist())) if self.analysed[index] else None
+            )
+        if "emotions" in fields:
+            row["emotions"] = emotion_labels(self.emotions[index]) if self.emotions[index] else None
+        if "entities" in fields:
+            entity_ids = self.entities[index]
+            row["entities"] = self.entity_table.to_dicts(entity_ids) if entity_ids is not None else None
+        return row
+
+    def take(self, indices):
+        """
+        Columns with the given rows, e.g. to copy the results of each distinct
+        sentence to its repeats.
+
+        :param indices: Row index for every row of the result
+        :return: SentenceColumns sharing this entity table
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        columns = SentenceColumns(0, self.entity_table)
+        columns.scores = self.scores[indices]
+        columns.analysed = self.analysed[indices]
+        columns.emotions = self.emotions[indices]
+        columns.entities = [self.entities[index] for index in indices.tolist()]
+        return columns
+
+    def compound(self):
+        """
+        Compound score per sentence, 0 for sentences without scores.
+
+        :return: float array
+        """
+        return np.where(self.analysed, self.scores[:, COMPOUND], 0.0)
+
+    def emotion_counts(self):
+        """
+        Number of sentences with each emotion among their dominant ones.
+
+        :return: Dict of emotion name to count, for emotions that occur
+        """
+        bits = (self.emotions[:, None] >> np.arange(len(EMOTION_LABELS), dtype=np.uint8)) & 1
+        counts = bits.sum(axis=0)
+        return {label: int(count) for label, count in zip(EMOTION_LABELS, counts) if count}
+
+    def aggregates(self):
+        """
+        Document-level aggregates of the results, stored once so that readers do
+        not walk the sentences: emotion counts and intensity (share of sentences
+        with each emotion), a histogram of the compound scores and their summary
+        statistics. Only sentences with scores count towards the scores.
+
+        :return: JSON-serializable dict
+        """
+        size = len(self)
+        counts = self.emotion_counts()
+        scores = self.scores[self.analysed, COMPOUND]
+        histogram, edges = np.histogram(scores, bins=COMPOUND_BINS, range=(-1.0, 1.0))
+        compound = {"count": int(len(scores))}
+        if len(scores):
+            compound.update({
+                "mean": float(scores.mean()),
+                "std": float(scores.std()),
+                "min": float(scores.min()),
+                "median": float(np.median(scores)),
+                "max": float(scores.max()),
+                "positive": int((scores >= POSITIVE_THRESHOLD).sum()),
+                "neutral": int(((scores > NEGATIVE_THRESHOLD) & (scores < POSITIVE_THRESHOLD)).sum()),
+                "negative": int((scores <= NEGATIVE_THRESHOLD).sum()),
+            })
+        return {
+            "sentences": size,
+            "emotion_counts": counts,
+            "emotion_intensity": {label: count / size for label, count in counts.items()} if size else {},
+            "compound_histogram": {"edges": edges.tolist(), "counts": histogram.tolist()},
+            "compound_stats": compound,
+        }
+
+    def to_entries(self, sentences, fields=("analysis", "emotions", "entities"), status=None):
+        """
+        Sentence entries in the stored shape, with the results merged in.
+        Results that are not computed yet are left out.
+
+        :param sentences: The document's sentence entries, one per row
+        :param fields: Result fields to include
+        :param status: Optional status set on every entry
+        :return: New list of sentence entries
+        """
+        extra = {"status": status} if status else {}
+        return [
+            {
+                **sentence_entry,
+                **{field: value for field, value in self.row(index, fields).items() if value is not None},
+                **extra,
+            }
+            for index, sentence_entry in enumerate(sentences)
+        ]
+
+    @classmethod
+    def from_entries(cls, sentences):
+        """
+        Columns of sentence entries in the stored shape.
+
+        :param sentences: List of sentence entries
+        :return: SentenceColumns
+        """
+        columns = cls(len(sentences))
+        for index, sentence_entry in enumerate(sentences):
+            columns.set_row(index, sentence_entry)
+        return columns
@@ -0,0 +1,132 @@
+"""
+Small DAG scheduler for the analyses of one document. Each stage declares the
+values it reads and the values it produces; a stage starts as soon as all of its
+inputs exist, so stages that do not depend on each other (e.g. NER, summary and
+topics) run concurrently on a thread pool. The heavy loops of the stages (spaCy,
+NumPy/SciPy, gensim) release the GIL, so threads overlap them without copying the
+document into other processes.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class Stage:
+    """
+    One step of a StageGraph.
+
+    :param name: Stage name
+    :param function: Callable taking the inputs as keyword arguments; returns the
+                     output, or a tuple with one value per output
+    :param inputs: Names of the values the stage reads
+    :param outputs: Names of the values the stage produces
+    """
+
+    def __init__(self, name, function, inputs=(), outputs=()):
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+
+    def run(self, values):
+        """
+        Run the stage on the values produced so far.
+
+        :param values: Dict of value name to value
+        :return: Dict of the stage's outputs
+        :raises: ValueError if the function returns the wrong number of outputs
+        """
+        result = self.function(**{name: values[name] for name in self.inputs})
+        if len(self.outputs) == 1:
+            return {self.outputs[0]: result}
+        result = tuple(result) if self.outputs else ()
+        if len(result) != len(self.outputs):
+            raise ValueError(
+                f"Stage {self.name} returned {len(result)} values for outputs {self.outputs}"
+            )
+        return dict(zip(self.outputs, result))
+
+
+class StageGraph:
+    """
+    Stages wired together by the names of their inputs and outputs.
+
+    :param stages: List of Stage
+    :param inputs: Names of the values given to run()
+    :raises: ValueError if a value is produced twice, never produced, or the
+             stages depend on each other in a cycle
+    """
+
+    def __init__(self, stages, inputs=()):
+        self.inputs = tuple(inputs)
+        producers = {name: None for name in self.inputs}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in producers:
+                    raise ValueError(f"Value {output} is produced more than once")
+                producers[output] = stage.name
+        for stage in stages:
+            unknown = [name for name in stage.inputs if name not in producers]
+            if unknown:
+                raise ValueError(f"Stage {stage.name} reads values nothing produces: {unknown}")
+
+        # topological order, stable with respect to the declaration order
+        self.order = []
+        available = set(self.inputs)
+        remaining = list(stages)
+        while remaining:
+            ready = [stage for stage in remaining if available.issuperset(stage.inputs)]
+            if not ready:
+                raise ValueError(f"Stages form a cycle: {[stage.name for stage in remaining]}")
+            for stage in ready:
+                self.order.append(stage)
+                available.update(stage.outputs)
+                remaining.remove(stage)
+
+    def run(self, values, executor=None, on_complete=None):
+        """
+        Run every stage once its inputs are available.
+
+        :param values: Dict with the graph's inputs
+        :param executor: Optional Executor running independent stages concurrently;
+                         without one the stages run one by one in this thread
+        :param on_complete: Optional callback(stage_name, values) called in this
+                            thread after each stage
+        :return: Dict of every input and output value
+        :raises: Whatever a stage raised, once the stages already running are done
+        """
+        values = dict(values)
+        missing = [name for name in self.inputs if name not in values]
+        if missing:
+            raise ValueError(f"Missing graph inputs: {missing}")
+
+        if executor is None:
+            for stage in self.order:
+                values.update(stage.run(values))
+                if on_complete:
+                    on_complete(stage.name, values)
+            return values
+
+        pending = list(self.order)
+        running = {}
+        error = None
+        while running or (pending and error is None):
+            if error is None:
+                for stage in [stage for stage in pending if all(name in values for name in stage.inputs)]:
+                    pending.remove(stage)
+                    running[executor.submit(stage.run, values)] = stage
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    outputs = future.result()
+                except Exception as e:  # pylint: disable=broad-except
+                    # let the running stages finish so none outlives the document
+                    error = error or e
+                    continue
+                if error is None:
+                    values.update(outputs)
+                    if on_complete:
+                        on_complete(stage.name, values)
+        if error is not None:
+            raise error
+        return values
@@ -0,0 +1,191 @@
+"""
+Built-in LexRank summarizer working directly on the stored sentences.
+It follows sumy's LexRankSummarizer (per-sentence tf normalized by the most
+frequent term, idf over sentences, idf-modified cosine, thresholded similarity
+graph, power iteration), but builds a sparse TF-IDF matrix and computes every
+pairwise similarity with one sparse product instead of a Python double loop.
+
+Since the similarity graph is quadratic in the sentence count, long documents are
+summarized hierarchically: windows of sentences are summarized, then the window
+summaries, until one window is left. The window size is derived from a memory
+ceiling, and a time budget bounds how long a single document can take.
+"""
+
+import math
+import time
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+THRESHOLD = 0.1
+EPSILON = 0.1
+MAX_ITERATIONS = 1000
+
+# documents above this many sentences are summarized hierarchically
+HIERARCHICAL_THRESHOLD = 2000
+# ceiling for the similarity graph of one window, which bounds the window size
+MEMORY_LIMIT_BYTES = 256 * 1024 * 1024
+# similarity product, thresholded copy and transition matrix: ~3 CSR entries
+# (8-byte value + 8-byte index) per sentence pair
+BYTES_PER_SENTENCE_PAIR = 48
+
+
+def tfidf_matrix(words_by_sentence):
+    """
+    Sparse TF-IDF matrix of the sentences, with rows normalized to unit length.
+
+    :param words_by_sentence: List of word sequences, one per sentence
+    :return: CSR matrix of shape (sentences, vocabulary)
+    """
+    vocabulary = {}
+    rows, cols, values = [], [], []
+    for row, words in enumerate(words_by_sentence):
+        counts = Counter(word.lower() for word in words)
+        if not counts:
+            continue
+        max_count = max(counts.values())
+        for word, count in counts.items():
+            rows.append(row)
+            cols.append(vocabulary.setdefault(word, len(vocabulary)))
+            values.append(count / max_count)
+
+    sentence_count = len(words_by_sentence)
+    cols = np.array(cols, dtype=np.int64)
+    # every (row, col) pair is unique, so column counts are document frequencies
+    idf = np.log(sentence_count / (1 + np.bincount(cols, minlength=len(vocabulary))))
+    matrix = sparse.csr_matrix(
+        (np.array(values) * idf[cols], (np.array(rows, dtype=np.int64), cols)),
+        shape=(sentence_count, len(vocabulary)),
+    )
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return sparse.diags(inverse_norms) @ matrix
+
+
+def lexrank_scores(words_by_sentence, threshold=THRESHOLD, epsilon=EPSILON):
+    """
+    LexRank centrality of each sentence.
+
+    :param words_by_sentence: List of word sequences, one per sentence
+    :param threshold: Cosine similarity above which two sentences are linked
+    :param epsilon: Convergence tolerance of the power iteration
+    :return: Array of scores, one per sentence
+    """
+    sentence_count = len(words_by_sentence)
+    if not sentence_count:
+        return np.zeros(0)
+    vectors = tfidf_matrix(words_by_sentence)
+    similarity = (vectors @ vectors.T).tocsr()
+    similarity.data = (similarity.data > threshold).astype(float)
+    similarity.eliminate_zeros()
+    degrees = np.asarray(similarity.sum(axis=1)).ravel()
+    degrees[degrees == 0] = 1
+    transition_transposed = (sparse.diags(1.0 / degrees) @ similarity).T.tocsr()
+
+    scores = np.full(sentence_count, 1.0 / sentence_count)
+    for _ in range(MAX_ITERATIONS):
+        next_scores = transition_transposed @ scores
+        norm = np.linalg.norm(next_scores)
+        if norm == 0:
+            return next_scores
+        next_scores /= norm
+        change = np.linalg.norm(next_scores - scores)
+        scores = next_scores
+        if change <= epsilon:
+            break
+    return scores
+
+
+def best_sentences(words_by_sentence, sentence_count):
+    """
+    Pick the most central sentences of a single LexRank graph, in document order.
+
+    :param words_by_sentence: List of word sequences, one per sentence
+    :param sentence_count: Number of sentences to pick
+    :return: List of positions in words_by_sentence
+    """
+    scores = lexrank_scores(words_by_sentence)
+    # stable sort keeps earlier sentences first among equal scores, like sumy
+    best = np.argsort(-scores, kind="stable")[:sentence_count]
+    return sorted(int(index) for index in best)
+
+
+def max_window_size(memory_limit_bytes=MEMORY_LIMIT_BYTES):
+    """
+    Largest number of sentences whose similarity graph fits in the memory ceiling.
+
+    :param memory_limit_bytes: Memory ceiling for one window
+    :return: Number of sentences
+    """
+    return max(2, math.isqrt(memory_limit_bytes // BYTES_PER_SENTENCE_PAIR))
+
+
+def evenly_spaced(indices, count):
+    """
+    Positional fallback for windows left when the time budget runs out.
+
+    :param indices: Candidate sentence indices
+    :param count: Number of sentences to keep
+    :return: List of indices spread over the window
+    """
+    count = min(count, len(indices))
+    step = len(indices) / count
+    return [indices[int(step * position)] for position in range(count)]
+
+
+def hierarchical_summarize(words_by_sentence, sentence_count, window_size, deadline=None):
+    """
+    Summarize windows of sentences, then the window summaries, until the
+    candidates fit in one window.
+
+    :param words_by_sentence: List of word sequences, one per sentence
+    :param sentence_count: Number of sentences in the summary
+    :param window_size: Sentences ranked together in one LexRank graph, at least 2
+    :param deadline: time.monotonic() value after which windows are no longer ranked
+    :return: List of sentence indices, in document order
+    :raises: ValueError if window_size is below 2, which would never shrink
+    """
+    if window_size < 2:
+        raise ValueError(f"window_size must be at least 2, got {window_size}")
+    # each window keeps at most half of its sentences, so every level shrinks
+    per_window = max(1, min(sentence_count, window_size // 2))
+    candidates = list(range(len(words_by_sentence)))
+    while len(candidates) > window_size:
+        kept = []
+        for start in range(0, len(candidates), window_size):
+            window = candidates[start:start + window_size]
+            if deadline is not None and time.monotonic() > deadline:
+                kept.extend(evenly_spaced(window, per_window))
+                continue
+            picks = best_sentences([words_by_sentence[index] for index in window], per_window)
+            kept.extend(window[pick] for pick in picks)
+        candidates = kept
+    picks = best_sentences([words_by_sentence[index] for index in candidates], sentence_count)
+    return [candidates[pick] for pick in picks]
+
+
+def summarize(
+    words_by_sentence,
+    sentence_count=5,
+    threshold=HIERARCHICAL_THRESHOLD,
+    memory_limit_bytes=MEMORY_LIMIT_BYTES,
+    time_budget=None,
+):
+    """
+    Pick the most central sentences, in document order. Documents above the
+    threshold, or too large for the memory ceiling, are summarized hierarchically.
+
+    :param words_by_sentence: List of word sequences, one per sentence
+    :param sentence_count: Number of sentences in the summary
+    :param threshold: Sentence count above which the hierarchical mode is used
+    :param memory_limit_bytes: Memory ceiling for one similarity graph
+    :param time_budget: Seconds after which remaining windows are sampled instead of ranked
+    :return: List of sentence indices
+    """
+    # a window must hold two sentences to keep fewer than it ranks
+    window_size = max(2, min(threshold, max_window_size(memory_limit_bytes)))
+    if len(words_by_sentence) <= window_size:
+        return best_sentences(words_by_sentence, sentence_count)
+    deadline = time.monotonic() + time_budget if time_budget else None
+    return hierarchical_summarize(words_by_sentence, sentence_count, window_size, deadline)
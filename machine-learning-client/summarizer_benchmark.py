@@ -0,0 +1,93 @@
+"""
+Speed and agreement benchmark between the built-in LexRank summarizer and sumy.
+The sentences of the given files (speech.txt and speech1.txt by default) are
+repeated up to the requested size, summarized by both, and the script reports
+whether the same sentences were picked and how long each one took.
+
+Usage: python summarizer_benchmark.py [--sentences 1000] [file ...]
+"""
+
+import argparse
+import os
+import time
+
+import nltk
+from nltk.tokenize import sent_tokenize
+from sumy.models.dom import ObjectDocumentModel, Paragraph, Sentence
+from sumy.summarizers.lex_rank import LexRankSummarizer
+
+from preprocessing import preprocess_sentences, summary_words
+from summarizer import summarize
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_FILES = [os.path.join(REPO_ROOT, "speech.txt"), os.path.join(REPO_ROOT, "speech1.txt")]
+
+
+class IndexTokenizer:
+    """Tokenizer handing sumy the same words as the built-in summarizer, by sentence index."""
+
+    language = "english"
+
+    def __init__(self, words_by_sentence):
+        self._words_by_sentence = words_by_sentence
+
+    def to_words(self, sentence):
+        """Return the words of the sentence with this index."""
+        return self._words_by_sentence[int(sentence)]
+
+
+def compare(texts, sentence_count=5):
+    """
+    Summarize sentences with both summarizers.
+
+    :param texts: List of sentence strings
+    :param sentence_count: Number of sentences in the summary
+    :return: Dict with sentence count, whether the picks agree and timings
+    """
+    words = [summary_words(tokens) for tokens in preprocess_sentences([{"sentence": text} for text in texts])]
+
+    start = time.perf_counter()
+    engine_indices = summarize(words, sentence_count)
+    engine_seconds = time.perf_counter() - start
+
+    # sentences are passed as their index so duplicated texts stay distinct
+    document = ObjectDocumentModel([
+        Paragraph([Sentence(str(index), IndexTokenizer(words)) for index in range(len(texts))])
+    ])
+    start = time.perf_counter()
+    sumy_indices = [int(str(sentence)) for sentence in LexRankSummarizer()(document, sentence_count)]
+    sumy_seconds = time.perf_counter() - start
+
+    return {
+        "sentences": len(texts),
+        "same_summary": engine_indices == sumy_indices,
+        "engine_seconds": engine_seconds,
+        "sumy_seconds": sumy_seconds,
+    }
+
+
+def main(argv=None):
+    """Run the benchmark on the given files and print the report."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("files", nargs="*", default=DEFAULT_FILES)
+    parser.add_argument("--sentences", type=int, default=1000, help="sentences per input, 0 keeps the file size")
+    args = parser.parse_args(argv)
+
+    nltk.download("punkt", quiet=True)
+    for path in args.files:
+        with open(path, "r", encoding="utf-8") as f:
+            texts = sent_tokenize(f.read())
+        if args.sentences:
+            texts = (texts * (args.sentences // len(texts) + 1))[:args.sentences]
+        report = compare(texts)
+        speedup = report["sumy_seconds"] / max(report["engine_seconds"], 1e-9)
+        print(f"{os.path.basename(path)}: {report['sentences']} sentences")
+        print(f"  same summary as sumy: {report['same_summary']}")
+        print(
+            f"  engine: {report['engine_seconds']:.3f}s  "
+            f"sumy: {report['sumy_seconds']:.3f}s  ({speedup:.0f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
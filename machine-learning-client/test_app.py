@@ -2,7 +2,12 @@
 Unit tests for the app's main functionality.
 """
 
+import copy
 import os
+import subprocess
+import sys
+import threading
+import time
 from unittest.mock import patch, MagicMock
 import pytest
 import nltk
@@ -10,16 +15,39 @@ from bson import ObjectId
 from datetime import datetime
 
 from app import (
-    perform_sentiment_analysis,
     perform_topic_modeling,
-    perform_emotion_detection,
+    sentiment_stage,
+    emotion_stage,
     perform_text_summarization,
     perform_sentiment_trend_analysis,
     perform_overall_emotion_detection,
     process_document,
     perform_ner,
+    annotate_sentences,
+    sentence_cache,
     update_document_in_db,
+    document_sentences,
+    claim_next_document,
+    renew_lease,
+    process_claimed_document,
+    drain_queue,
+    run_poll_mode,
+    run_watch_mode,
+    ProcessPoolWorker,
+    progress_publisher,
+    publish_stages,
+    ensure_indexes,
+    ANALYZER_VERSION,
 )
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from emotion import emotion_code
+from metrics import StageTimer
+from preprocessing import preprocess_sentences
+from sentence_columns import SentenceColumns
+from topic_model import GlobalTopicModel
+from concurrent.futures.process import BrokenProcessPool
+from pymongo.errors import OperationFailure
 
 def test_perform_ner():
     """Test the NER function."""
@@ -37,10 +65,12 @@ def test_perform_ner():
     ]
 
 @pytest.fixture(autouse=True)
-def setup_test_env():
-    """Set up testing environment variable."""
+def setup_test_env(tmp_path):
+    """Set up testing environment variable and a global topic model in a temporary directory."""
     os.environ["TESTING"] = "true"
-    yield
+    sentence_cache.clear()
+    with patch("app.global_topic_model", GlobalTopicModel(str(tmp_path / "topic_model"))):
+        yield
     del os.environ["TESTING"]
 
 
@@ -110,17 +140,16 @@ def sample_sentences_large_fixture():
     ] * 4  # Creates 20 items
 
 
-def test_perform_sentiment_analysis(
+def test_sentiment_stage(
     sample_sentences_small_fixture,
 ):  # pylint: disable=W0621
-    """Test the sentiment analysis function."""
-    result = perform_sentiment_analysis(sample_sentences_small_fixture)
-    assert len(result) == 2, f"Expected 2 results, got {len(result)}"
-    assert result[0]["status"] == "processed"
-    assert "compound" in result[0]["analysis"]
-    assert "neg" in result[0]["analysis"]
-    assert "neu" in result[0]["analysis"]
-    assert "pos" in result[0]["analysis"]
+    """Test that the sentiment stage scores the sentences missing from the cache."""
+    columns = SentenceColumns(len(sample_sentences_small_fixture))
+    timer = StageTimer()
+    assert sentiment_stage(sample_sentences_small_fixture, columns, [0, 1], timer) == [0, 1]
+    assert columns.analysed.all()
+    assert set(columns.row(0, ["analysis"])["analysis"]) == {"neg", "neu", "pos", "compound"}
+    assert timer.stages["sentiment"]["sentences"] == 2
 
 
 def test_perform_topic_modeling(
@@ -145,7 +174,7 @@ def test_perform_topic_modeling(
         ]
         mock_lda_model.return_value = mock_lda
 
-        with patch("app.CoherenceModel", side_effect=Exception("Should not be called")):
+        with patch("diagnostics.CoherenceModel", side_effect=Exception("Should not be called")):
             topics = perform_topic_modeling(
                 sample_sentences_large_fixture, num_topics=2
             )
@@ -156,14 +185,17 @@ def test_perform_topic_modeling(
             ), "Each topic should be a tuple"
 
 
-def test_perform_emotion_detection(
+def test_emotion_stage(
     sample_sentences_small_fixture,
 ):  # pylint: disable=W0621
-    """Test the emotion detection function."""
-    result = perform_emotion_detection(sample_sentences_small_fixture)
-    assert len(result) == 2, f"Expected 2 results, got {len(result)}"
-    assert "emotions" in result[0], "Missing 'emotions' key in the first result"
-    assert isinstance(result[0]["emotions"], list), "'emotions' should be a list"
+    """Test that the emotion stage detects the emotions of the scored sentences."""
+    columns = SentenceColumns(len(sample_sentences_small_fixture))
+    timer = StageTimer()
+    scored = sentiment_stage(sample_sentences_small_fixture, columns, [0, 1], timer)
+    preprocessed = preprocess_sentences(sample_sentences_small_fixture)
+    assert emotion_stage(scored, columns, preprocessed, timer) == [0, 1]
+    emotions = columns.row(0, ["emotions"])["emotions"]
+    assert isinstance(emotions, list) and emotions, "'emotions' should be a non-empty list"
 
 
 def test_perform_text_summarization(
@@ -175,6 +207,18 @@ def test_perform_text_summarization(
     assert len(summary) > 0, "Summary should not be empty"
 
 
+def test_perform_text_summarization_returns_indices(sample_sentences_large_fixture):
+    """Test that the summary sentences are reported by their index."""
+    summary, indices = perform_text_summarization(
+        sample_sentences_large_fixture, sentence_count=2, return_indices=True
+    )
+    assert len(indices) == 2
+    assert indices == sorted(indices)
+    assert summary == " ".join(
+        sample_sentences_large_fixture[index]["sentence"] for index in indices
+    )
+
+
 def test_perform_sentiment_trend_analysis(
     sample_sentences_small_fixture,
 ):  # pylint: disable=W0621
@@ -209,11 +253,7 @@ def test_process_document(sample_sentences_large_fixture):  # pylint: disable=W0
         "overall_status": "pending",
         "timestamp": "2024-11-13T04:00:00",
     }
-    with patch("app.perform_sentiment_analysis") as mock_sentiment, patch(
-        "app.perform_topic_modeling"
-    ) as mock_topic_modeling, patch(
-        "app.perform_emotion_detection"
-    ) as mock_emotion_detection, patch(
+    with patch("app.perform_topic_modeling") as mock_topic_modeling, patch(
         "app.perform_text_summarization"
     ) as mock_summary, patch(
         "app.perform_sentiment_trend_analysis"
@@ -221,10 +261,8 @@ def test_process_document(sample_sentences_large_fixture):  # pylint: disable=W0
         "app.perform_overall_emotion_detection"
     ) as mock_overall_emotion:
 
-        mock_sentiment.return_value = sample_sentences_large_fixture
         mock_topic_modeling.return_value = ["Topic1", "Topic2"]
-        mock_emotion_detection.return_value = sample_sentences_large_fixture
-        mock_summary.return_value = "This is a summary."
+        mock_summary.return_value = ("This is a summary.", [0])
         mock_sentiment_trend.return_value = [
             {"sentence_index": 0, "compound": 0.5},
             {"sentence_index": 1, "compound": -0.5},
@@ -248,6 +286,49 @@ def test_process_document(sample_sentences_large_fixture):  # pylint: disable=W0
         assert (
             "overall_emotions" in processed_document
         ), "Missing 'overall_emotions' in the processed document"
+        # sentiment and emotions run on every sentence, into the columns
+        columns = processed_document["sentence_columns"]
+        assert columns.analysed.all() and columns.emotions.all()
+        aggregates = processed_document["aggregates"]
+        assert aggregates["sentences"] == len(sample_document["sentences"])
+        assert aggregates["compound_stats"]["count"] == len(sample_document["sentences"])
+
+# run in a fresh interpreter, so no corpus has been loaded by earlier tests
+CONCURRENT_FIRST_DOCUMENT = """
+from nltk.corpus import stopwords, wordnet
+from nltk.corpus.util import LazyCorpusLoader
+import app
+assert app.stage_executor is not None
+assert not isinstance(stopwords, LazyCorpusLoader)
+assert not isinstance(wordnet, LazyCorpusLoader)
+sentences = [{"sentence": f"The {word} team won the game.", "status": "pending", "analysis": None}
+             for word in ("happy", "angry", "tired", "proud") * 10]
+document = app.process_document({"_id": "1", "request_id": "r1", "sentences": sentences})
+assert document["overall_status"] == "processed", document
+"""
+
+
+def test_first_document_runs_stages_concurrently_in_a_fresh_process():
+    """Test that the corpora are loaded before the stage threads first share them."""
+    env = {
+        **os.environ,
+        # the modules this interpreter imports, e.g. the shared job store
+        "PYTHONPATH": os.pathsep.join(sys.path),
+        "STAGE_THREADS": "4",
+        "TOPIC_MODEL_DIR": "",
+        "SENTENCE_CACHE_PERSIST": "",
+    }
+    result = subprocess.run(
+        [sys.executable, "-c", CONCURRENT_FIRST_DOCUMENT],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=300,
+        check=False,
+    )
+    assert result.returncode == 0, result.stderr
+
 
 def test_update_document_in_db():
     """Test updating a document in the database."""
@@ -276,6 +357,7 @@ def test_update_document_in_db():
                 "summary": sample_document["summary"],
                 "sentiment_trend": sample_document["sentiment_trend"],
                 "overall_emotions": sample_document["overall_emotions"],
+                "analyzer_version": ANALYZER_VERSION,
                 "timestamp": sample_document["timestamp"],
             }}
         )
@@ -340,16 +422,83 @@ def test_update_document_in_db_processed():
                 "summary": sample_document["summary"],
                 "sentiment_trend": sample_document["sentiment_trend"],
                 "overall_emotions": sample_document["overall_emotions"],
+                "analyzer_version": ANALYZER_VERSION,
                 "timestamp": sample_document["timestamp"],
             }}
         )           
 
+def test_update_document_in_db_converts_sentence_columns():
+    """Test that columnar results are written in the stored sentence shape."""
+    sentences = [{"sentence": "I am happy.", "status": "processing", "analysis": None}]
+    columns = SentenceColumns(1)
+    columns.set_scores([0], np.array([[0.0, 0.4, 0.6, 0.57]]))
+    columns.emotions[0] = emotion_code(["Happy"])
+    columns.entities[0] = ()
+    sample_document = {
+        "_id": ObjectId("507f1f77bcf86cd799439011"),
+        "sentences": sentences,
+        "sentence_columns": columns,
+        "overall_status": "processed",
+        "timestamp": datetime.now(),
+    }
+
+    with patch("app.texts_collection.update_one") as mock_update:
+        update_document_in_db(sample_document)
+
+    written = mock_update.call_args.args[1]["$set"]
+    assert written["sentences"] == [{
+        "sentence": "I am happy.",
+        "status": "processed",
+        "analysis": {"neg": 0.0, "neu": 0.4, "pos": 0.6, "compound": 0.57},
+        "emotions": ["Happy"],
+        "entities": [],
+    }]
+    assert "sentence_columns" not in written
+
+
+
+def test_update_document_in_db_writes_chunks():
+    """Test that a chunked document's results are written chunk by chunk."""
+    sentences = [
+        {"sentence": f"Sentence {index}.", "status": "processing", "analysis": None} for index in range(3)
+    ]
+    columns = SentenceColumns(3)
+    columns.set_scores([0, 1, 2], np.array([[0.0, 1.0, 0.0, float(index)] for index in range(3)]))
+    sample_document = {
+        "_id": ObjectId("507f1f77bcf86cd799439011"),
+        "request_id": "r1",
+        "chunk_size": 2,
+        "chunk_count": 2,
+        "sentences": sentences,
+        "sentence_columns": columns,
+        "overall_status": "processed",
+        "timestamp": datetime.now(),
+    }
+
+    with patch("app.job_store.write_chunks") as mock_chunks, patch(
+        "app.texts_collection.update_one"
+    ) as mock_update:
+        update_document_in_db(sample_document)
+
+    request_id, chunks = mock_chunks.call_args.args
+    chunks = list(chunks)
+    assert request_id == "r1"
+    assert [index for index, _ in chunks] == [0, 1]
+    assert [len(chunk) for _, chunk in chunks] == [2, 1]
+    assert chunks[1][1][0]["sentence"] == "Sentence 2."
+    assert chunks[1][1][0]["analysis"]["compound"] == 2.0
+    assert chunks[1][1][0]["status"] == "processed"
+    written = mock_update.call_args.args[1]["$set"]
+    assert "sentences" not in written
+    assert written["overall_status"] == "processed"
+
+
 def test_perform_topic_modeling_empty_sentences():
     """Test topic modeling with empty sentences."""
     result = perform_topic_modeling([], num_topics=5)
     assert result == [], "Expected an empty list when empty sentences are provided."
 
-def test_perform_sentiment_analysis_neutral():
+def test_sentiment_stage_neutral():
     """Test sentiment analysis with a neutral sentence."""
     sample_sentences = [
         {
@@ -358,9 +507,9 @@ def test_perform_sentiment_analysis_neutral():
             "analysis": None,
         }
     ]
-    result = perform_sentiment_analysis(sample_sentences)
-    assert result[0]["analysis"]["compound"] == 0.0  # Assuming neutral compound score
-    assert result[0]["status"] == "processed"
+    columns = SentenceColumns(1)
+    sentiment_stage(sample_sentences, columns, [0], StageTimer())
+    assert columns.row(0, ["analysis"])["analysis"]["compound"] == 0.0  # Assuming neutral compound score
 
 def test_perform_topic_modeling_valid_data(sample_sentences_large_fixture):
     """Test topic modeling with valid data."""
@@ -428,3 +577,579 @@ def test_perform_ner_no_entities():
     assert "entities" in result[0]
     assert result[0]["entities"] == []
     assert result[1]["entities"] == []
+
+
+def test_claim_next_document():
+    """Test that claiming flips a pending or expired document to processing."""
+    with patch("app.texts_collection.aggregate", return_value=[{"_id": "1234567890"}]), patch(
+        "app.texts_collection.find_one_and_update"
+    ) as mock_claim:
+        mock_claim.return_value = {"_id": "1234567890", "overall_status": "processing"}
+        document = claim_next_document(worker_id="worker-1", lease_seconds=60)
+
+        assert document["overall_status"] == "processing"
+        query, update = mock_claim.call_args.args
+        assert query["_id"] == "1234567890"
+        assert {"overall_status": "pending"} in query["$or"]
+        assert update["$set"]["overall_status"] == "processing"
+        assert update["$set"]["worker_id"] == "worker-1"
+        lease = update["$set"]["lease_expires_at"] - update["$set"]["claimed_at"]
+        assert lease.total_seconds() == 60
+        assert update["$inc"] == {"attempts": 1}
+
+
+
+def test_claim_next_document_loads_chunks():
+    """Test that the sentences of a claimed chunked document are read from its chunks."""
+    chunked = {"_id": "1", "request_id": "r1", "chunk_size": 1, "chunk_count": 2, "overall_status": "processing"}
+    with patch("app.job_store.claim", return_value=chunked), patch(
+        "app.job_store.iter_chunks", return_value=iter([[{"sentence": "One."}], [{"sentence": "Two."}]])
+    ):
+        document = claim_next_document(worker_id="worker-1")
+    assert document["sentences"] == [{"sentence": "One."}, {"sentence": "Two."}]
+
+
+def test_claim_next_document_empty_queue():
+    """Test that claiming returns None when nothing is pending."""
+    with patch("app.texts_collection.aggregate", return_value=[]), patch(
+        "app.texts_collection.find_one_and_update"
+    ) as mock_claim:
+        assert claim_next_document(worker_id="worker-1") is None
+        mock_claim.assert_not_called()
+
+
+def test_claim_next_document_skips_candidates_claimed_elsewhere():
+    """Test that a candidate another worker claimed first is skipped."""
+    claimed = {"_id": "b", "overall_status": "processing"}
+    with patch(
+        "app.texts_collection.aggregate", return_value=[{"_id": "a"}, {"_id": "b"}]
+    ) as mock_candidates, patch(
+        "app.texts_collection.find_one_and_update", side_effect=[None, claimed]
+    ) as mock_claim:
+        assert claim_next_document(worker_id="worker-1") == claimed
+        assert [call.args[0]["_id"] for call in mock_claim.call_args_list] == ["a", "b"]
+        pipeline = mock_candidates.call_args.args[0]
+        assert pipeline[-2] == {"$sort": {"priority": 1, "_id": 1}}
+
+
+def test_ensure_indexes():
+    """Test that identical submissions, sentence chunks and diagnostics are looked up by index."""
+    with patch("app.texts_collection.create_index") as mock_create, patch(
+        "app.job_store.chunks.create_index"
+    ) as mock_create_chunks, patch("app.job_store.diagnostics.create_index") as mock_create_diagnostics:
+        ensure_indexes()
+        mock_create.assert_any_call([("content_hash", 1), ("analyzer_version", 1)])
+        mock_create.assert_any_call(
+            [("topic_coherence", 1)], partialFilterExpression={"topic_coherence": {"$type": "number"}}
+        )
+        mock_create_chunks.assert_called_once_with([("request_id", 1), ("chunk", 1)], unique=True)
+        mock_create_diagnostics.assert_called_once_with([("model_version", -1)])
+
+
+def test_renew_lease():
+    """Test that a lease is only renewed for the worker holding it."""
+    with patch("app.texts_collection.update_one") as mock_update:
+        mock_update.return_value.modified_count = 1
+        assert renew_lease({"_id": "1234567890"}, worker_id="worker-1")
+        query = mock_update.call_args.args[0]
+        assert query["worker_id"] == "worker-1"
+        assert query["overall_status"] == "processing"
+
+
+def test_update_document_in_db_checks_lease(sample_document_processed):
+    """Test that results are only written by the worker holding the lease."""
+    sample_document_processed["worker_id"] = "worker-1"
+    with patch("app.texts_collection.update_one") as mock_update:
+        update_document_in_db(sample_document_processed)
+        query = mock_update.call_args.args[0]
+        assert query == {"_id": sample_document_processed["_id"], "worker_id": "worker-1"}
+
+
+def test_process_claimed_document_gives_up():
+    """Test that a document claimed too many times is marked as an error."""
+    document = {
+        "_id": "1234567890",
+        "request_id": "unique_request_id",
+        "sentences": [{"sentence": "I am happy."}],
+        "overall_status": "processing",
+        "worker_id": "worker-1",
+        "attempts": 10,
+    }
+    with patch("app.process_document") as mock_process, patch(
+        "app.update_document_in_db"
+    ) as mock_update:
+        process_claimed_document(document, worker_id="worker-1")
+        mock_process.assert_not_called()
+        written = mock_update.call_args.args[0]
+        assert written["overall_status"] == "error"
+
+
+def test_process_claimed_document_failure_keeps_draining():
+    """Test that a failing document is handed back to the queue and draining goes on."""
+    documents = [{"_id": "1", "request_id": "a", "attempts": 1}, {"_id": "2", "request_id": "b", "attempts": 1}]
+    with patch("app.claim_next_document", side_effect=documents + [None]), patch(
+        "app.process_document", side_effect=[ValueError("no terms"), {**documents[1], "overall_status": "processed"}]
+    ), patch("app.LeaseHeartbeat"), patch("app.release_lease") as mock_release, patch(
+        "app.update_document_in_db"
+    ) as mock_update, patch("app.worker_metrics") as mock_metrics:
+        assert drain_queue(worker_id="worker-1") == 2
+
+    mock_release.assert_called_once_with(documents[0], "worker-1")
+    mock_metrics.record_failure.assert_called_once()
+    assert [call.args[0]["request_id"] for call in mock_update.call_args_list] == ["b"]
+
+
+def test_drain_queue():
+    """Test that draining processes documents until the queue is empty."""
+    documents = [{"request_id": "a"}, {"request_id": "b"}, None]
+    with patch("app.claim_next_document", side_effect=documents), patch(
+        "app.process_claimed_document"
+    ) as mock_process:
+        assert drain_queue(worker_id="worker-1") == 2
+        assert mock_process.call_count == 2
+
+
+def test_run_poll_mode_backs_off():
+    """Test that idle polling doubles the delay up to the maximum."""
+    with patch("app.drain_queue", return_value=0), patch(
+        "app.POLL_MIN_SECONDS", 0.5
+    ), patch("app.POLL_MAX_SECONDS", 2), patch(
+        "app.time.sleep", side_effect=[None, None, None, StopIteration]
+    ) as mock_sleep:
+        with pytest.raises(StopIteration):
+            run_poll_mode(worker_id="worker-1")
+        delays = [call.args[0] for call in mock_sleep.call_args_list]
+        assert delays == [0.5, 1, 2, 2]
+
+
+def watched(stream):
+    """Change stream mock used as a context manager."""
+    context = MagicMock()
+    context.__enter__.return_value = stream
+    return context
+
+
+def test_run_watch_mode_drains_on_insert():
+    """Test that the watcher drains the backlog at startup and on each insert."""
+    stream = MagicMock()
+    type(stream).alive = property(MagicMock(side_effect=[True, False]))
+    stream.try_next.return_value = {"operationType": "insert"}
+    # the closed stream is opened again, then change streams go away
+    with patch(
+        "app.texts_collection.watch", side_effect=[watched(stream), OperationFailure("stepped down")]
+    ) as mock_watch, patch("app.drain_queue") as mock_drain, patch("app.run_poll_mode"), patch(
+        "app.POLL_MIN_SECONDS", 0
+    ):
+        run_watch_mode(worker_id="worker-1")
+        assert mock_drain.call_count == 2
+        assert mock_watch.call_count == 2
+
+
+def test_run_watch_mode_reopens_failed_stream():
+    """Test that a stream failing to resume is opened again and the backlog drained."""
+    failed = MagicMock()
+    failed.alive = True
+    failed.try_next.side_effect = OperationFailure("resume failed")
+    with patch(
+        "app.texts_collection.watch",
+        side_effect=[watched(failed), watched(MagicMock(alive=False)), OperationFailure("stepped down")],
+    ), patch("app.drain_queue") as mock_drain, patch("app.run_poll_mode"), patch("app.POLL_MIN_SECONDS", 0):
+        run_watch_mode(worker_id="worker-1")
+        assert mock_drain.call_count == 2
+
+
+def test_run_watch_mode_processing_errors_do_not_fall_back():
+    """Test that a failure while draining is not taken for missing change streams."""
+    stream = MagicMock(alive=True)
+    with patch("app.texts_collection.watch", return_value=watched(stream)), patch(
+        "app.drain_queue", side_effect=OperationFailure("write conflict")
+    ), patch("app.run_poll_mode") as mock_poll:
+        with pytest.raises(OperationFailure):
+            run_watch_mode(worker_id="worker-1")
+        mock_poll.assert_not_called()
+
+
+def test_run_watch_mode_falls_back_to_polling():
+    """Test that a standalone server without change streams falls back to polling."""
+    with patch(
+        "app.texts_collection.watch", side_effect=OperationFailure("not a replica set")
+    ), patch("app.run_poll_mode") as mock_poll:
+        run_watch_mode(worker_id="worker-1")
+        mock_poll.assert_called_once_with("worker-1", None)
+
+
+def test_process_pool_worker_drain():
+    """Test that the pool keeps its processes busy and writes results from the parent."""
+    documents = [
+        {"_id": str(i), "request_id": f"request_{i}", "attempts": 1} for i in range(3)
+    ]
+    with patch.object(
+        ProcessPoolWorker, "_start_executor", return_value=ThreadPoolExecutor(2)
+    ), patch("app.claim_next_document", side_effect=documents + [None]), patch(
+        "app.process_document", side_effect=lambda doc: {**doc, "overall_status": "processed"}
+    ), patch("app.LeaseHeartbeat"), patch("app.update_document_in_db") as mock_update:
+        pool = ProcessPoolWorker(2, worker_id="worker-1")
+        pool.drain()
+        while pool.in_flight:
+            pool.collect(block=True)
+        pool.close()
+
+        written = [call.args[0]["request_id"] for call in mock_update.call_args_list]
+        assert sorted(written) == ["request_0", "request_1", "request_2"]
+
+
+def test_process_pool_worker_restarts_broken_pool():
+    """Test that a crashed pool process is replaced and its document requeued."""
+    broken = Future()
+    broken.set_exception(BrokenProcessPool("child died"))
+    executor = MagicMock()
+    executor.submit.return_value = broken
+    with patch.object(
+        ProcessPoolWorker, "_start_executor", return_value=executor
+    ) as mock_start, patch("app.LeaseHeartbeat"), patch(
+        "app.release_lease"
+    ) as mock_release, patch("app.update_document_in_db") as mock_update:
+        pool = ProcessPoolWorker(1, worker_id="worker-1")
+        document = {"_id": "1", "request_id": "request_1", "attempts": 1}
+        pool.submit(document)
+        assert pool.collect() == 1
+
+        mock_release.assert_called_once_with(document, "worker-1")
+        mock_update.assert_not_called()
+        assert mock_start.call_count == 2
+        assert not pool.in_flight
+
+
+def test_process_pool_worker_publishes_progress_of_in_flight_documents():
+    """Test that partial results sent by the pool processes are published by the parent."""
+    executor = MagicMock()
+    executor.submit.return_value = Future()
+    with patch.object(ProcessPoolWorker, "_start_executor", return_value=executor), patch(
+        "app.LeaseHeartbeat"
+    ), patch("app.release_lease"), patch("app.PROGRESSIVE_MIN_SENTENCES", 1), patch(
+        "app.publish_stages"
+    ) as mock_publish:
+        pool = ProcessPoolWorker(1, worker_id="worker-1")
+        document = {"_id": "1", "request_id": "r1", "worker_id": "worker-1", "sentences": [{}], "attempts": 1}
+        pool.submit(document)
+        pool.progress.put(("unknown", ["summary"], {"summary": "Stale."}))
+        pool.progress.put(("1", ["summary"], {"summary": "Short."}))
+        for _ in range(100):
+            if pool.progress.empty() and mock_publish.called:
+                break
+            time.sleep(0.05)
+        pool.close()
+
+    mock_publish.assert_called_once_with(document, ["summary"], {"summary": "Short."})
+
+
+def test_progress_publisher_in_pool_process_sends_to_parent():
+    """Test that a pool process hands its partial results to the parent instead of writing them."""
+    document = {"_id": "1", "worker_id": "w1", "sentences": [{}]}
+    with patch("app.PROGRESSIVE_MIN_SENTENCES", 1), patch("app.pool_progress") as mock_progress, patch(
+        "app.publish_stages"
+    ) as mock_publish:
+        progress_publisher(document)(["summary"], {"summary": "Short."})
+    mock_progress.put.assert_called_once_with(("1", ["summary"], {"summary": "Short."}))
+    mock_publish.assert_not_called()
+
+
+def _mock_doc(*entities):
+    """Build a fake spaCy doc with the given (text, label) entities."""
+    doc = MagicMock()
+    doc.ents = []
+    for text, label in entities:
+        ent = MagicMock()
+        ent.text = text
+        ent.label_ = label
+        doc.ents.append(ent)
+    return doc
+
+
+def test_perform_ner_uses_one_batched_stream():
+    """Test that NER runs all sentences through a single nlp.pipe call."""
+    sample_sentences = [{"sentence": "Paris is nice."}, {"sentence": "No entities."}]
+    with patch("app.nlp") as mock_nlp:
+        mock_nlp.pipe.return_value = iter([_mock_doc(("Paris", "GPE")), _mock_doc()])
+        result = perform_ner(sample_sentences)
+
+        mock_nlp.pipe.assert_called_once()
+        mock_nlp.assert_not_called()
+        assert result[0]["entities"] == [{"text": "Paris", "label": "GPE"}]
+        assert result[1]["entities"] == []
+
+
+def no_entities(texts, _entity_table):
+    """Stand-in for NER finding no entities."""
+    return [()] * len(texts)
+
+
+def test_process_document_preprocesses_once(sample_sentences_large_fixture):
+    """Test that the document is preprocessed once and shared by every analysis."""
+    sample_document = {
+        "_id": "1234567890",
+        "request_id": "unique_request_id",
+        "sentences": sample_sentences_large_fixture,
+        "overall_status": "pending",
+    }
+    with patch("app.preprocess_sentences") as mock_preprocess, patch(
+        "app.perform_topic_modeling"
+    ) as mock_topics, patch("app.emotion_lexicon") as mock_lexicon, patch(
+        "app.perform_text_summarization"
+    ) as mock_summary, patch("app.extract_entities", side_effect=no_entities), patch.object(
+        sentence_cache, "get_many", return_value={}
+    ):
+        mock_lexicon.return_value.dominant_codes.side_effect = lambda token_lists: np.ones(len(token_lists))
+        mock_summary.return_value = ("This is a summary.", [0])
+        process_document(sample_document)
+
+        mock_preprocess.assert_called_once()
+        shared = mock_preprocess.return_value
+        assert mock_lexicon.return_value.dominant_codes.call_args.args[0][0] is shared[0].tokens
+        assert mock_topics.call_args.kwargs["preprocessed"] is shared
+        assert mock_summary.call_args.kwargs["preprocessed"] is shared
+
+
+def test_process_document_keeps_results_in_columns(sample_sentences_large_fixture):
+    """Test that results stay in columns until the document is written."""
+    sample_document = {
+        "_id": "1234567890",
+        "request_id": "unique_request_id",
+        "sentences": sample_sentences_large_fixture,
+        "overall_status": "pending",
+    }
+    original = copy.deepcopy(sample_sentences_large_fixture)
+    with patch("app.extract_entities", side_effect=no_entities), patch(
+        "app.perform_topic_modeling", return_value=[]
+    ):
+        processed_document = process_document(sample_document)
+
+    columns = processed_document["sentence_columns"]
+    assert isinstance(columns, SentenceColumns)
+    assert columns.scores.shape == (len(sample_sentences_large_fixture), 4)
+    assert processed_document["sentences"] == original
+
+    stored = document_sentences(processed_document)
+    assert [entry["sentence"] for entry in stored] == [
+        entry["sentence"] for entry in sample_sentences_large_fixture
+    ]
+    assert all(entry["status"] == "processed" and entry["entities"] == [] for entry in stored)
+    assert all(set(entry["analysis"]) == {"neg", "neu", "pos", "compound"} for entry in stored)
+    assert all(entry["emotions"] for entry in stored)
+    assert [point["compound"] for point in processed_document["sentiment_trend"]] == [
+        entry["analysis"]["compound"] for entry in stored
+    ]
+
+
+def test_annotate_sentences_uses_sentence_cache():
+    """Test that sentences seen before skip sentiment, emotion and NER."""
+    sample_sentences = [
+        {"sentence": "Thank you.", "status": "pending", "analysis": None},
+        {"sentence": "Thank you.", "status": "pending", "analysis": None},
+    ]
+    preprocessed = [MagicMock(), MagicMock()]
+
+    def scores(texts):
+        return np.tile([0.0, 0.6, 0.4, 0.4], (len(texts), 1))
+
+    with patch("app.score_sentiments", side_effect=scores) as mock_sentiment, patch(
+        "app.emotion_lexicon"
+    ) as mock_lexicon, patch("app.extract_entities", side_effect=no_entities):
+        mock_lexicon.return_value.dominant_codes.side_effect = lambda token_lists: np.full(
+            len(token_lists), emotion_code(["Happy"])
+        )
+        first = annotate_sentences(sample_sentences, preprocessed)
+        # duplicates within a document are only analysed once
+        assert mock_sentiment.call_args.args[0] == ["Thank you."]
+        second = annotate_sentences(sample_sentences, preprocessed)
+
+        assert mock_sentiment.call_count == 1
+        assert first == second
+        assert second[1]["analysis"]["compound"] == 0.4
+        assert second[1]["emotions"] == ["Happy"]
+        assert second[1]["status"] == "processed"
+        assert sentence_cache.stats()["hits"] == 1
+
+
+def test_perform_topic_modeling_uses_global_model(sample_sentences_large_fixture):
+    """Test that topics come from the global model and the document is fed into it."""
+    topic_model = MagicMock()
+    topic_model.infer.return_value = [(3, '0.100*"climate" + 0.050*"change"')]
+    with patch("app.models.LdaModel") as mock_lda:
+        topics = perform_topic_modeling(
+            sample_sentences_large_fixture, num_topics=2, topic_model=topic_model
+        )
+
+    assert topics == [(3, '0.100*"climate" + 0.050*"change"')]
+    mock_lda.assert_not_called()
+    texts = topic_model.observe.call_args.args[0]
+    assert len(texts) == len(sample_sentences_large_fixture)
+    assert topic_model.infer.call_args.kwargs["num_topics"] == 2
+
+
+def test_perform_topic_modeling_falls_back_without_global_topics(sample_sentences_large_fixture):
+    """Test that a per-document LDA is trained while the global model has no topics."""
+    topic_model = MagicMock()
+    topic_model.infer.return_value = None
+    topics = perform_topic_modeling(
+        sample_sentences_large_fixture, num_topics=2, topic_model=topic_model
+    )
+
+    assert len(topics) == 2
+    topic_model.observe.assert_called_once()
+
+
+def test_perform_topic_modeling_skips_coherence(sample_sentences_large_fixture):
+    """Test that coherence is left to the diagnostics job outside of tests too."""
+    del os.environ["TESTING"]
+    try:
+        with patch("diagnostics.CoherenceModel") as mock_coherence:
+            perform_topic_modeling(sample_sentences_large_fixture, num_topics=2)
+        mock_coherence.assert_not_called()
+    finally:
+        os.environ["TESTING"] = "true"
+
+
+def test_process_document_records_stage_diagnostics(sample_sentences_large_fixture):
+    """Test that every stage's timings are stored on the document."""
+    sample_document = {
+        "_id": "1234567890",
+        "request_id": "unique_request_id",
+        "sentences": sample_sentences_large_fixture,
+        "overall_status": "pending",
+    }
+    with patch("app.extract_entities", side_effect=no_entities), patch(
+        "app.perform_topic_modeling", return_value=[]
+    ):
+        processed_document = process_document(sample_document)
+
+    diagnostics = processed_document["diagnostics"]
+    assert set(diagnostics["stages"]) == {
+        "preprocessing", "sentence_cache", "sentiment", "emotion", "ner",
+        "topics", "summary", "trend",
+    }
+    preprocessing = diagnostics["stages"]["preprocessing"]
+    assert preprocessing["sentences"] == len(sample_sentences_large_fixture)
+    assert preprocessing["tokens"] > 0
+    assert all(stage["wall_seconds"] >= 0 for stage in diagnostics["stages"].values())
+    assert diagnostics["wall_seconds"] >= diagnostics["stages"]["summary"]["wall_seconds"]
+
+
+def test_process_claimed_document_records_metrics():
+    """Test that finished documents are counted and stored with their diagnostics."""
+    document = {"_id": "1", "request_id": "r1", "attempts": 1, "worker_id": "w1"}
+    updated_document = {
+        **document,
+        "overall_status": "processed",
+        "timestamp": datetime.now(),
+        "diagnostics": {"wall_seconds": 0.5, "cpu_seconds": 0.4, "stages": {}},
+    }
+    with patch("app.process_document", return_value=updated_document), patch(
+        "app.texts_collection.update_one"
+    ) as mock_update, patch("app.worker_metrics") as mock_metrics, patch("app.LeaseHeartbeat"):
+        process_claimed_document(document, "w1")
+
+    mock_metrics.record_document.assert_called_once_with(updated_document)
+    written = mock_update.call_args.args[1]["$set"]
+    assert written["diagnostics"] == updated_document["diagnostics"]
+
+
+def test_process_document_runs_independent_stages_concurrently(sample_sentences_large_fixture):
+    """Test that NER, summary and topics overlap instead of running one after another."""
+    sample_document = {
+        "_id": "1234567890",
+        "request_id": "unique_request_id",
+        "sentences": sample_sentences_large_fixture,
+        "overall_status": "pending",
+    }
+    # each of the three stages waits until the other two have started
+    barrier = threading.Barrier(3, timeout=10)
+
+    def wait_for_others(function):
+        def run(*args, **kwargs):
+            barrier.wait()
+            return function(*args, **kwargs)
+        return run
+
+    with ThreadPoolExecutor(4) as executor, patch("app.stage_executor", executor), patch.object(
+        sentence_cache, "get_many", return_value={}
+    ), patch(
+        "app.extract_entities", side_effect=wait_for_others(no_entities)
+    ), patch(
+        "app.perform_text_summarization", side_effect=wait_for_others(lambda *_a, **_k: ("Summary.", [0]))
+    ), patch(
+        "app.perform_topic_modeling", side_effect=wait_for_others(lambda *_a, **_k: ["Topic1"])
+    ):
+        processed_document = process_document(sample_document)
+
+    assert processed_document["topics"] == ["Topic1"]
+    assert processed_document["summary"] == "Summary."
+
+
+def test_progress_publisher_skips_unclaimed_and_small_documents():
+    """Test that only claimed documents large enough publish partial results."""
+    sentences = [{"sentence": f"Sentence {i}."} for i in range(3)]
+    with patch("app.publish_stages") as mock_publish, patch("app.PROGRESSIVE_MIN_SENTENCES", 3):
+        progress_publisher({"_id": "1", "sentences": sentences})(["sentiment"], {})
+        progress_publisher({"_id": "1", "worker_id": "w1", "sentences": sentences[:2]})(["sentiment"], {})
+        mock_publish.assert_not_called()
+
+        progress_publisher({"_id": "1", "worker_id": "w1", "sentences": sentences})(["sentiment"], {})
+        mock_publish.assert_called_once()
+
+
+def test_publish_stages_checks_lease():
+    """Test that partial results are only written by the lease holder."""
+    with patch("app.texts_collection.update_one") as mock_update:
+        publish_stages({"_id": "1", "worker_id": "w1"}, ["summary"], {"summary": "Short."})
+    mock_update.assert_called_once_with(
+        {"_id": "1", "worker_id": "w1"},
+        {"$set": {"summary": "Short."}, "$addToSet": {"completed_stages": {"$each": ["summary"]}}},
+    )
+
+
+
+def test_publish_stages_writes_chunked_sentences():
+    """Test that partial sentence results of a chunked document go to its chunks."""
+    document = {
+        "_id": "1", "request_id": "r1", "worker_id": "w1", "attempts": 2, "chunk_size": 2, "chunk_count": 2,
+    }
+    sentences = [{"sentence": f"Sentence {index}."} for index in range(3)]
+    with patch("app.job_store.write_chunks") as mock_chunks, patch(
+        "app.texts_collection.update_one"
+    ) as mock_update:
+        publish_stages(document, ["sentiment"], {"sentences": sentences, "sentiment_trend": []})
+    assert list(mock_chunks.call_args.args[1]) == [(0, sentences[:2]), (1, sentences[2:])]
+    # the chunks are fenced by the claim, like the document by the lease
+    assert mock_chunks.call_args.kwargs == {"attempt": 2}
+    assert mock_update.call_args.args[1]["$set"] == {"sentiment_trend": []}
+
+
+def test_process_document_publishes_stages_when_ready(sample_sentences_large_fixture):
+    """Test that each group of results is published as soon as it is ready."""
+    sample_document = {
+        "_id": "1234567890",
+        "request_id": "unique_request_id",
+        "worker_id": "worker-1",
+        "sentences": sample_sentences_large_fixture,
+        "overall_status": "processing",
+    }
+    with patch("app.publish_stages") as mock_publish, patch(
+        "app.PROGRESSIVE_MIN_SENTENCES", 1
+    ), patch("app.extract_entities", side_effect=no_entities), patch(
+        "app.perform_topic_modeling", return_value=[]
+    ):
+        processed_document = process_document(sample_document)
+
+    published = [call.args[1] for call in mock_publish.call_args_list]
+    # the summary runs concurrently, so only the sentence results have a fixed order
+    sentence_stages = [stages for stages in published if stages != ["summary"]]
+    assert sentence_stages == [["sentiment"], ["emotions"], ["sentiment", "emotions", "entities"]]
+    assert ["summary"] in published
+    sentiment_fields = mock_publish.call_args_list[published.index(["sentiment"])].args[2]
+    assert "sentiment_trend" in sentiment_fields
+    assert all(entry["analysis"] is not None for entry in sentiment_fields["sentences"])
+    assert "overall_emotions" in mock_publish.call_args_list[published.index(["emotions"])].args[2]
+    assert processed_document["completed_stages"] == [
+        "sentiment", "emotions", "entities", "summary", "topics"
+    ]
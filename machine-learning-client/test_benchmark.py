@@ -0,0 +1,90 @@
+"""
+Unit tests for the benchmark harness.
+"""
+
+from unittest.mock import MagicMock, patch
+
+from benchmark import (
+    STAGES,
+    compare_with_baseline,
+    main,
+    pending_sentences,
+    run_benchmarks,
+    synthetic_sentences,
+)
+
+SOURCE = ["The economy is growing fast.", "We will build new roads and bridges.", "Thank you."]
+
+
+def test_synthetic_sentences_are_reproducible():
+    """Test that a synthetic corpus is the same on every run."""
+    first = synthetic_sentences(SOURCE, 50)
+    assert first == synthetic_sentences(SOURCE, 50)
+    assert len(first) == 50
+    assert all(sentence.endswith(".") for sentence in first)
+    assert synthetic_sentences(SOURCE, 50, seed=1) != first
+
+
+def test_compare_with_baseline():
+    """Test that only stages beyond tolerance and noise floor are regressions."""
+    baseline = [
+        {"corpus": "speech", "stage": "ner", "seconds": 1.0, "peak_memory_mb": 10.0},
+        {"corpus": "speech", "stage": "summary", "seconds": 0.01, "peak_memory_mb": 1.0},
+        {"corpus": "speech", "stage": "topics", "seconds": 1.0, "peak_memory_mb": 10.0},
+    ]
+    results = [
+        {"corpus": "speech", "stage": "ner", "seconds": 2.0, "peak_memory_mb": 10.0},
+        # 3x slower, but below the noise floor
+        {"corpus": "speech", "stage": "summary", "seconds": 0.03, "peak_memory_mb": 1.0},
+        {"corpus": "speech", "stage": "topics", "seconds": 1.1, "peak_memory_mb": 40.0},
+        {"corpus": "new-corpus", "stage": "ner", "seconds": 9.0, "peak_memory_mb": 1.0},
+    ]
+    regressions = compare_with_baseline(results, baseline)
+    assert regressions == [
+        "speech/ner: 1.000s -> 2.000s",
+        "speech/topics: 10.0 MB -> 40.0 MB",
+    ]
+
+
+def test_compare_with_baseline_scales_by_machine_speed():
+    """Test that baseline timings are scaled by the calibration ratio."""
+    baseline = [{"corpus": "speech", "stage": "ner", "seconds": 1.0, "peak_memory_mb": None}]
+    results = [{"corpus": "speech", "stage": "ner", "seconds": 2.0, "peak_memory_mb": None}]
+    assert not compare_with_baseline(results, baseline, speed=2.0)
+    assert compare_with_baseline(results, baseline, speed=1.5) == ["speech/ner: 1.500s -> 2.000s"]
+
+
+def test_missing_baseline_fails(tmp_path):
+    """Test that a run without a baseline to compare against is an error."""
+    with patch("benchmark.import_app"), patch("benchmark.load_corpora", return_value={}), \
+            patch("benchmark.run_benchmarks", return_value=[]), patch("benchmark.calibrate", return_value=0.1):
+        code = main(["--output", str(tmp_path / "results.json"), "--baseline", str(tmp_path / "missing.json")])
+    assert code == 1
+
+
+def test_run_benchmarks_limits_stages_to_their_corpora():
+    """Test that a stage limited to some corpora is skipped on the others."""
+    app = MagicMock()
+    app.preprocess_sentences.side_effect = lambda sentences: [MagicMock() for _ in sentences]
+    results = run_benchmarks(
+        app, {"tiny": SOURCE, "large": SOURCE * 2}, ["sentiment", "process_document"], memory=True,
+        stage_corpora={"process_document": ["large"]},
+    )
+
+    assert [(record["corpus"], record["stage"]) for record in results] == [
+        ("tiny", "sentiment"), ("large", "sentiment"), ("large", "process_document"),
+    ]
+    assert results[-1]["peak_memory_mb"] is not None
+
+
+def test_run_benchmarks_records_every_stage():
+    """Test that every stage is run and measured on every corpus."""
+    app = MagicMock()
+    app.preprocess_sentences.side_effect = lambda sentences: [MagicMock() for _ in sentences]
+    results = run_benchmarks(app, {"tiny": SOURCE}, memory=True)
+
+    assert [record["stage"] for record in results] == list(STAGES)
+    assert all(record["sentences"] == 3 for record in results)
+    assert all(record["seconds"] >= 0 for record in results)
+    assert all(record["peak_memory_mb"] is not None for record in results)
+    assert app.process_document.call_args.args[0]["sentences"] == pending_sentences(SOURCE)
@@ -0,0 +1,98 @@
+"""
+Unit tests for the offline bulk analysis.
+"""
+
+import io
+import json
+from unittest.mock import patch
+
+from bulk import completed_request_ids, iter_json_array, read_documents, run_bulk
+
+
+def fake_process_document(document):
+    """Processed copy of a document without running the models."""
+    if document["request_id"] == "broken":
+        raise ValueError("model failed")
+    return {
+        **document,
+        "sentences": [{**entry, "status": "processed"} for entry in document["sentences"]],
+        "overall_status": "processed",
+        "summary": " ".join(entry["sentence"] for entry in document["sentences"]),
+    }
+
+
+def read_output(path):
+    """Records of a JSONL output file."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_iter_json_array_decodes_items_across_chunks():
+    """Test that items split across read chunks are decoded one by one."""
+    items = [{"request_id": str(index), "sentences": [{"sentence": "Hi, there. [x]"}]} for index in range(5)]
+    text = json.dumps(items, indent=2)
+    assert list(iter_json_array(io.StringIO(text), chunk_size=7)) == items
+    assert not list(iter_json_array(io.StringIO(" [ ] ")))
+
+
+def test_read_documents_by_input_kind(tmp_path):
+    """Test the JSONL, directory and export inputs."""
+    jsonl = tmp_path / "texts.jsonl"
+    jsonl.write_text(
+        json.dumps({"request_id": "a", "text": "I am happy. I am sad."}) + "\n\n"
+        + json.dumps({"sentences": ["One."]}) + "\n",
+        encoding="utf-8",
+    )
+    documents = list(read_documents(str(jsonl)))
+    assert [document["request_id"] for document in documents] == ["a", "texts.jsonl:3"]
+    assert [entry["sentence"] for entry in documents[0]["sentences"]] == ["I am happy.", "I am sad."]
+    assert documents[0]["sentences"][0] == {"sentence": "I am happy.", "status": "pending", "analysis": None}
+
+    directory = tmp_path / "speeches"
+    (directory / "nested").mkdir(parents=True)
+    (directory / "one.txt").write_text("First speech.", encoding="utf-8")
+    (directory / "nested" / "two.txt").write_text("Second speech.", encoding="utf-8")
+    (directory / "notes.md").write_text("Not a text.", encoding="utf-8")
+    assert [document["request_id"] for document in read_documents(str(directory))] == [
+        "one.txt", "nested/two.txt"
+    ]
+
+    export = tmp_path / "export.json"
+    export.write_text(json.dumps([{"request_id": "r1", "sentences": [{"sentence": "Stored."}]}]), encoding="utf-8")
+    (document,) = read_documents(str(export))
+    assert document["request_id"] == "r1"
+    assert document["sentences"] == [{"sentence": "Stored.", "status": "pending", "analysis": None}]
+
+
+def test_run_bulk_writes_results_and_resumes(tmp_path):
+    """Test that results are appended and processed documents are skipped on a rerun."""
+    output = tmp_path / "results.jsonl"
+    documents = [
+        {"request_id": "a", "sentences": [{"sentence": "I am happy.", "status": "pending", "analysis": None}]},
+        {"request_id": "broken", "sentences": [{"sentence": "Oops.", "status": "pending", "analysis": None}]},
+    ]
+    with patch("bulk.process_document", side_effect=fake_process_document) as mock_process:
+        run = run_bulk(documents, str(output))
+        assert (run.documents, run.sentences, run.errors) == (2, 2, 1)
+        records = read_output(output)
+        assert records[0]["overall_status"] == "processed"
+        assert records[0]["summary"] == "I am happy."
+        assert records[1] == {
+            "request_id": "broken",
+            "overall_status": "error",
+            "error_message": "model failed",
+            "sentences": documents[1]["sentences"],
+        }
+
+        # an interrupted write leaves a partial line behind
+        with open(output, "a", encoding="utf-8") as f:
+            f.write('{"request_id": "c", "overall_sta')
+        mock_process.reset_mock()
+        run = run_bulk(documents, str(output))
+        assert [call.args[0]["request_id"] for call in mock_process.call_args_list] == ["broken"]
+        assert [record["request_id"] for record in read_output(output)] == ["a", "broken", "broken"]
+
+
+def test_completed_request_ids_without_output(tmp_path):
+    """Test that a first run starts from scratch."""
+    assert completed_request_ids(str(tmp_path / "missing.jsonl")) == set()
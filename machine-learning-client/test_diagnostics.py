@@ -0,0 +1,128 @@
+"""
+Unit tests for the background model-quality diagnostics.
+"""
+
+from unittest.mock import MagicMock, patch
+
+from diagnostics import (
+    topic_words,
+    topic_coherence,
+    document_coherence,
+    score_documents,
+    model_diagnostics,
+    record_model_diagnostics,
+    run_diagnostics_once,
+)
+from pymongo.errors import PyMongoError
+from topic_model import GlobalTopicModel
+
+SPORTS = ["football", "match", "goal", "team", "player", "coach"]
+WEATHER = ["rain", "storm", "cloud", "forecast", "wind", "temperature"]
+TEXTS = [
+    [words[i % 6], words[(i + 1) % 6], words[(i + 2) % 6]]
+    for i, words in ((i, SPORTS if i % 2 else WEATHER) for i in range(40))
+]
+
+
+def trained_model(directory):
+    """Global topic model bootstrapped on two separated themes."""
+    topic_model = GlobalTopicModel(str(directory), num_topics=2, bootstrap_size=20, passes=2)
+    topic_model.observe(TEXTS)
+    topic_model.flush()
+    return topic_model
+
+
+def test_topic_words():
+    """Test that top words are read back from print_topics strings."""
+    topics = [(0, '0.100*"climate" + 0.050*"change"'), (1, "")]
+    assert topic_words(topics) == [["climate", "change"]]
+
+
+def test_topic_coherence():
+    """Test that coherence is computed for topics found in the texts."""
+    score = topic_coherence([SPORTS[:3], WEATHER[:3]], TEXTS, coherence="u_mass")
+    assert isinstance(score, float)
+
+
+def test_topic_coherence_unknown_words():
+    """Test that topics without known words get no score."""
+    assert topic_coherence([["quantum", "physics"]], TEXTS) is None
+
+
+def test_document_coherence_without_sentences():
+    """Test that an empty document gets no score."""
+    assert document_coherence({"sentences": [], "topics": [(0, '0.1*"a"')]}) is None
+
+
+def test_score_documents():
+    """Test that processed documents without a score are scored once."""
+    collection = MagicMock()
+    collection.find.return_value = [
+        {"_id": 1, "request_id": "r1", "sentences": [{"sentence": "Goal."}], "topics": []}
+    ]
+    with patch("diagnostics.document_coherence", return_value=0.42):
+        assert score_documents(collection) == 1
+
+    query = collection.find.call_args.args[0]
+    assert query["topic_coherence"] == {"$exists": False}
+    collection.update_one.assert_called_once_with(
+        {"_id": 1, "topic_coherence": {"$exists": False}},
+        {"$set": {"topic_coherence": 0.42}},
+    )
+
+
+def test_score_documents_reads_chunked_sentences():
+    """Test that chunked documents are scored on their chunks' sentences."""
+    collection = MagicMock()
+    collection.find.return_value = [
+        {"_id": 1, "request_id": "r1", "chunk_count": 2, "topics": []},
+        {"_id": 2, "request_id": "r2", "sentences": [], "topics": []},
+    ]
+    collection.database["text_chunks"].find.return_value.sort.return_value = [
+        {"sentences": [{"sentence": "Goal."}]},
+        {"sentences": [{"sentence": "Rain."}]},
+    ]
+    with patch("diagnostics.document_coherence", return_value=0.42) as mock_coherence:
+        assert score_documents(collection) == 1
+
+    assert mock_coherence.call_args.args[0]["sentences"] == [{"sentence": "Goal."}, {"sentence": "Rain."}]
+    # the document without sentences is left for a later pass, not scored as None
+    collection.update_one.assert_called_once()
+    assert collection.update_one.call_args.args[0]["_id"] == 1
+
+
+def test_model_diagnostics(tmp_path):
+    """Test the metrics computed for the global topic model."""
+    record = model_diagnostics(trained_model(tmp_path))
+
+    assert record["model_version"] == 1
+    assert record["num_topics"] == 2
+    assert record["sample_sentences"] == 40
+    assert isinstance(record["log_perplexity"], float)
+    assert 0 < record["topic_diversity"] <= 1
+    assert len(record["topics"]) == 2
+
+
+def test_model_diagnostics_without_model(tmp_path):
+    """Test that there is nothing to evaluate before the first model."""
+    assert model_diagnostics(GlobalTopicModel(str(tmp_path))) is None
+
+
+def test_record_model_diagnostics_once_per_version(tmp_path):
+    """Test that each model version is evaluated only once."""
+    topic_model = trained_model(tmp_path)
+    collection = MagicMock()
+    collection.find_one.return_value = None
+    assert record_model_diagnostics(topic_model, collection)["model_version"] == 1
+    collection.update_one.assert_called_once()
+
+    collection.find_one.return_value = {"model_version": 1}
+    assert record_model_diagnostics(topic_model, collection) is None
+    collection.update_one.assert_called_once()
+
+
+def test_run_diagnostics_once_survives_database_errors():
+    """Test that a failing pass is reported instead of raised."""
+    texts_collection = MagicMock()
+    texts_collection.find.side_effect = PyMongoError("down")
+    run_diagnostics_once(texts_collection, MagicMock())
@@ -0,0 +1,70 @@
+"""
+Unit tests for the built-in emotion engine.
+"""
+
+import numpy as np
+
+from emotion import (
+    EMOTIONS,
+    EmotionLexicon,
+    emotion_code,
+    emotion_labels,
+    emotion_lexicon,
+    load_text2emotion_tables,
+)
+
+
+def make_lexicon():
+    """Small lexicon with one word per emotion."""
+    return EmotionLexicon(
+        words={"joy": "Happy", "rage": "Angry", "shock": "Surprise", "grief": "Sad", "dread": "Fear"},
+        negations={"not sad": "Happy"},
+        shortcuts={"lol": "joy"},
+        emojis={"\U0001F600": "Happy"},
+        stop_words=frozenset({"the", "not"}),
+    )
+
+
+def test_load_text2emotion_tables():
+    """Test that the lexicon tables are read from the text2emotion source."""
+    tables = load_text2emotion_tables()
+    assert set(tables) == {"df", "emoj", "d", "shortcuts"}
+    assert len(tables["df"]["Word"]) > 1000
+
+
+def test_emotion_lexicon_is_compiled_once():
+    """Test that the text2emotion lexicon is compiled once per process."""
+    assert emotion_lexicon() is emotion_lexicon()
+    assert set(emotion_lexicon().index.values()) <= set(range(len(EMOTIONS)))
+
+
+def test_score_normalizes_rows():
+    """Test that each sentence's scores sum to one like text2emotion."""
+    scores = make_lexicon().score([["joy", "joy", "rage"], ["the"]])
+    assert scores.shape == (2, 5)
+    assert np.allclose(scores[0], [0.67, 0.33, 0, 0, 0])
+    assert not scores[1].any()
+
+
+def test_dominant_emotions():
+    """Test dominant emotion semantics, including ties and Neutral."""
+    result = make_lexicon().dominant_emotions([["joy"], ["grief", "dread"], ["nothing", "here"], []])
+    assert result == [["Happy"], ["Sad", "Fear"], ["Neutral"], ["Neutral"]]
+
+
+def test_dominant_codes_round_trip():
+    """Test that dominant emotions are encoded as one small code per sentence."""
+    codes = make_lexicon().dominant_codes([["joy"], ["grief", "dread"], []])
+    assert codes.dtype == np.uint8
+    assert [emotion_labels(code) for code in codes] == [["Happy"], ["Sad", "Fear"], ["Neutral"]]
+    assert emotion_code(["Fear", "Sad"]) == codes[1]
+    assert emotion_code(None) == 0
+    assert emotion_labels(0) == []
+
+
+def test_negation_shortcut_and_emoji_rules():
+    """Test that negations, contractions, shortcuts and emojis are applied."""
+    lexicon = make_lexicon()
+    assert lexicon.expand(["i", "am", "n't", "sad"]) == ["i", "am", "happy"]
+    assert lexicon.expand(["lol"]) == ["joy"]
+    assert lexicon.expand(["\U0001F600"]) == ["happy"]
@@ -0,0 +1,289 @@
+"""
+Unit tests for the job stores.
+"""
+
+import threading
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from job_store import ChangeStreamsUnavailable, MongoJobStore, SQLiteJobStore, load_sentences, open_job_store
+from scheduling import JobCostModel
+
+COST_MODEL = JobCostModel(seconds_per_sentence=1, max_delay_seconds=600)
+
+
+def pending(request_id, sentence_count=1, submitted=None, **fields):
+    """Pending document as the web app stores it."""
+    return {
+        "request_id": request_id,
+        "sentences": [{"sentence": f"Sentence {index}.", "status": "pending", "analysis": None}
+                      for index in range(sentence_count)],
+        "overall_status": "pending",
+        "timestamp": submitted or datetime.now(),
+        "sentence_count": sentence_count,
+        "char_count": 12 * sentence_count,
+        **fields,
+    }
+
+
+def test_sqlite_store_enqueue_and_fetch():
+    """Test that documents come back as they were stored, datetimes included."""
+    store = SQLiteJobStore()
+    document = pending("r1", content_hash="abc", analyzer_version="1")
+    document_id = store.enqueue(document)
+
+    assert document["_id"] == document_id
+    assert store.fetch("r1") == document
+    assert store.fetch("missing") is None
+    assert store.find_duplicate("abc", "1") == {"_id": document_id, "request_id": "r1"}
+    assert store.find_duplicate("abc", "2") is None
+
+
+
+def test_sqlite_store_chunked_layout():
+    """Test that large documents keep their sentences in chunks read in order."""
+    store = SQLiteJobStore()
+    document = pending("r1", sentence_count=5)
+    sentences = document["sentences"]
+    store.enqueue(document, chunk_size=2)
+
+    stored = store.fetch("r1")
+    assert "sentences" not in stored
+    assert (stored["chunk_size"], stored["chunk_count"], stored["sentence_count"]) == (2, 3, 5)
+    assert list(store.iter_chunks(stored)) == [sentences[:2], sentences[2:4], sentences[4:]]
+    assert load_sentences(store, {**stored, "request_id": "alias", "alias_of": "r1"}) == sentences
+
+    store.write_chunks("r1", [(1, [{"sentence": "Rewritten."}])])
+    assert load_sentences(store, stored)[2:] == [{"sentence": "Rewritten."}, sentences[4]]
+
+    small = pending("r2", sentence_count=2)
+    store.enqueue(small, chunk_size=2)
+    assert list(store.iter_chunks(store.fetch("r2"))) == [small["sentences"]]
+
+
+def test_sqlite_store_chunk_writes_are_fenced_by_the_claim():
+    """Test that a worker that lost its lease cannot overwrite a later claim's chunks."""
+    store = SQLiteJobStore()
+    store.enqueue(pending("r1", sentence_count=4), chunk_size=2)
+    stored = store.fetch("r1")
+    final = [{"sentence": "Final."}]
+    partial = [{"sentence": "Partial."}]
+
+    assert store.write_chunks("r1", [(0, final), (1, final)], attempt=2) == 2
+    assert store.write_chunks("r1", [(0, partial), (1, partial)], attempt=1) == 0
+    assert load_sentences(store, stored) == final + final
+    assert store.write_chunks("r1", [(1, partial)], attempt=3) == 1
+    assert load_sentences(store, stored) == final + partial
+
+
+def test_mongo_store_chunk_writes_are_fenced_by_the_claim():
+    """Test the fencing filter, and that a chunk held by a later claim is skipped."""
+    chunks = MagicMock()
+    chunks.update_one.side_effect = [MagicMock(), DuplicateKeyError("E11000")]
+    written = MongoJobStore(MagicMock(), chunks).write_chunks(
+        "r1", [(0, ["a"]), (1, ["b"])], attempt=2
+    )
+
+    assert written == 1
+    query, update = chunks.update_one.call_args_list[0].args
+    assert query == {"request_id": "r1", "chunk": 0, "attempt": {"$not": {"$gt": 2}}}
+    assert update == {"$set": {"sentences": ["a"], "attempt": 2}}
+    assert chunks.update_one.call_args_list[0].kwargs == {"upsert": True}
+
+
+def test_sqlite_store_claims_small_documents_first():
+    """Test that claims follow the cost model and skip claimed documents."""
+    store = SQLiteJobStore()
+    submitted = datetime.now() - timedelta(seconds=30)
+    store.enqueue(pending("large", sentence_count=100, submitted=submitted))
+    store.enqueue(pending("small", sentence_count=1, submitted=submitted + timedelta(seconds=5)))
+
+    first = store.claim("w1", 60, COST_MODEL)
+    assert first["request_id"] == "small"
+    assert first["overall_status"] == "processing"
+    assert first["worker_id"] == "w1"
+    assert first["attempts"] == 1
+    assert first["lease_expires_at"] - first["claimed_at"] == timedelta(seconds=60)
+    assert store.claim("w2", 60, COST_MODEL)["request_id"] == "large"
+    assert store.claim("w3", 60, COST_MODEL) is None
+    assert store.queue_depth() == {"pending": 0, "processing": 2}
+
+
+def test_sqlite_store_ranks_only_the_oldest_window():
+    """Test that documents behind the window are not ranked until they are in it."""
+    store = SQLiteJobStore()
+    submitted = datetime.now() - timedelta(seconds=30)
+    store.enqueue(pending("large", sentence_count=100, submitted=submitted))
+    store.enqueue(pending("small", sentence_count=1, submitted=submitted + timedelta(seconds=5)))
+    model = JobCostModel(seconds_per_sentence=1, max_delay_seconds=600, window_size=1)
+
+    assert store.claim("w1", 60, model)["request_id"] == "large"
+    assert store.claim("w2", 60, model)["request_id"] == "small"
+
+
+def test_sqlite_store_expired_leases_are_claimed_again():
+    """Test that a document whose lease expired goes to the next worker."""
+    store = SQLiteJobStore()
+    store.enqueue(pending("r1"))
+    document = store.claim("w1", -1, COST_MODEL)
+
+    reclaimed = store.claim("w2", 60, COST_MODEL)
+    assert reclaimed["_id"] == document["_id"]
+    assert reclaimed["attempts"] == 2
+    assert not store.renew_lease(document["_id"], "w1", 60)
+    assert store.renew_lease(document["_id"], "w2", 60)
+
+
+def test_sqlite_store_writes_only_under_the_lease():
+    """Test partial and final writes, release and the lease checks."""
+    store = SQLiteJobStore()
+    store.enqueue(pending("r1"))
+    document = store.claim("w1", 60, COST_MODEL)
+
+    store.publish(document["_id"], "w1", ["sentiment"], {"sentiment_trend": [0.5]})
+    store.publish(document["_id"], "w1", ["sentiment", "summary"], {"summary": "Short."})
+    store.publish(document["_id"], "w2", ["topics"], {"topics": ["lost"]})
+    stored = store.fetch("r1")
+    assert stored["completed_stages"] == ["sentiment", "summary"]
+    assert stored["summary"] == "Short."
+    assert "topics" not in stored
+
+    assert not store.write_results(document["_id"], {"overall_status": "processed"}, worker_id="w2")
+    store.release(document["_id"], "w1")
+    stored = store.fetch("r1")
+    assert stored["overall_status"] == "pending"
+    assert "worker_id" not in stored
+
+    assert store.write_results(document["_id"], {"overall_status": "error"})
+    assert store.fetch("r1")["overall_status"] == "error"
+
+
+def test_sqlite_store_queue_stats():
+    """Test the backlog and throughput counts used by admission control."""
+    store = SQLiteJobStore()
+    store.enqueue(pending("waiting", sentence_count=3))
+    store.enqueue({**pending("done", sentence_count=5), "overall_status": "processed"})
+    store.enqueue({
+        **pending("old", sentence_count=7),
+        "overall_status": "processed",
+        "timestamp": datetime.now() - timedelta(hours=1),
+    })
+
+    assert store.queue_stats(datetime.now() - timedelta(minutes=5)) == {
+        "pending_documents": 1,
+        "pending_sentences": 3,
+        "processed_documents": 1,
+        "processed_sentences": 5,
+    }
+
+
+def test_sqlite_store_notifies_pending_inserts():
+    """Test that an in-memory store wakes watchers on inserts."""
+    store = SQLiteJobStore()
+    store.enqueue(pending("before"))
+    with store.watch_pending() as stream:
+        # only inserts after the stream was opened are reported
+        stream.timeout = 0.01
+        assert stream.try_next() is None
+        inserter = threading.Timer(0.05, lambda: store.enqueue(pending("r1")))
+        inserter.start()
+        stream.timeout = 5
+        assert stream.try_next() == {"operationType": "insert"}
+        inserter.join()
+
+
+def test_sqlite_file_store_is_polled(tmp_path):
+    """Test that a database file shared between processes has no change stream."""
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    store.enqueue(pending("r1"))
+    assert SQLiteJobStore(str(tmp_path / "jobs.sqlite3")).fetch("r1")["request_id"] == "r1"
+    with pytest.raises(ChangeStreamsUnavailable):
+        store.watch_pending()
+
+
+def test_mongo_store_queue_stats_reads_one_aggregation():
+    """Test that backlog and throughput come from one aggregation."""
+    collection = MagicMock()
+    collection.aggregate.return_value = iter([{
+        "pending": [{"_id": None, "documents": 3, "sentences": 40}],
+        "processed": [{"_id": None, "documents": 60, "sentences": 600}],
+    }])
+    assert MongoJobStore(collection).queue_stats(datetime.now()) == {
+        "pending_documents": 3,
+        "pending_sentences": 40,
+        "processed_documents": 60,
+        "processed_sentences": 600,
+    }
+
+    collection.aggregate.return_value = iter([{"pending": [], "processed": []}])
+    assert MongoJobStore(collection).queue_stats(datetime.now())["pending_documents"] == 0
+
+
+
+def test_sqlite_store_model_quality_summary():
+    """Test that the coherence of scored documents is summarized."""
+    store = SQLiteJobStore()
+    assert store.model_quality_summary()["document_coherence"]["documents"] == 0
+    store.enqueue(pending("r1", topic_coherence=0.2))
+    store.enqueue(pending("r2", topic_coherence=0.6))
+    store.enqueue(pending("r3", topic_coherence=None))
+    store.enqueue(pending("r4"))
+
+    assert store.model_quality_summary() == {
+        "topic_models": [],
+        "document_coherence": {
+            "documents": 2, "mean_coherence": pytest.approx(0.4), "min_coherence": 0.2, "max_coherence": 0.6,
+        },
+    }
+
+
+def test_mongo_store_model_quality_summary():
+    """Test that diagnostics and document coherence are read from their collections."""
+    collection = MagicMock()
+    diagnostics = MagicMock()
+    diagnostics.find.return_value.sort.return_value.limit.return_value = [{"model_version": 3}]
+    collection.aggregate.return_value = iter([])
+
+    summary = MongoJobStore(collection, diagnostics=diagnostics).model_quality_summary(limit=1)
+
+    assert summary == {
+        "topic_models": [{"model_version": 3}],
+        "document_coherence": {"documents": 0, "mean_coherence": None, "min_coherence": None, "max_coherence": None},
+    }
+    diagnostics.find.return_value.sort.return_value.limit.assert_called_once_with(1)
+
+
+def test_mongo_store_without_change_streams():
+    """Test that a server refusing change streams is reported like any other store."""
+    collection = MagicMock()
+    collection.watch.side_effect = OperationFailure("not a replica set")
+    with pytest.raises(ChangeStreamsUnavailable):
+        MongoJobStore(collection).watch_pending()
+
+
+def test_mongo_store_writes_chunks_before_the_document():
+    """Test that a worker cannot claim a chunked document before its chunks exist."""
+    collection = MagicMock()
+    calls = []
+    collection.insert_one.side_effect = lambda document: calls.append("document") or MagicMock()
+    chunks = MagicMock()
+    chunks.update_one.side_effect = lambda query, update, upsert: calls.append(query["chunk"])
+    document = pending("r1", sentence_count=3)
+
+    MongoJobStore(collection, chunks).enqueue(document, chunk_size=2)
+
+    assert calls == [0, 1, "document"]
+    assert document["chunk_count"] == 2
+    assert "sentences" not in collection.insert_one.call_args.args[0]
+
+
+def test_open_job_store():
+    """Test the backend selection and that SQLite stores are shared per path."""
+    collection = MagicMock()
+    assert open_job_store("mongo", collection).collection is collection
+    assert open_job_store("sqlite", path=":memory:") is open_job_store("sqlite", path=":memory:")
+    with pytest.raises(ValueError, match="Unknown storage backend"):
+        open_job_store("redis")
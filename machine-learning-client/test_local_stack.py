@@ -0,0 +1,51 @@
+"""
+Unit tests for the single-process local stack.
+"""
+
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from local_stack import percentile, run_benchmark
+
+
+def response(status_code, payload):
+    """Test client response with a JSON payload."""
+    return SimpleNamespace(status_code=status_code, get_json=lambda: payload)
+
+
+def test_percentile_nearest_rank():
+    """Test the nearest-rank percentiles of the latencies."""
+    values = [0.4, 0.1, 0.3, 0.2]
+    assert percentile(values, 0.5) == 0.2
+    assert percentile(values, 0.95) == 0.4
+    assert percentile([1.5], 0.95) == 1.5
+
+
+def test_run_benchmark_waits_for_each_result():
+    """Test that unique texts are submitted and polled until they are processed."""
+    client = MagicMock()
+    client.post.side_effect = [response(200, {"request_id": "r0"}), response(200, {"request_id": "r1"})]
+    client.get.side_effect = [
+        response(202, {}), response(200, {}),
+        response(200, {}),
+    ]
+    web_app = SimpleNamespace(app=SimpleNamespace(test_client=lambda: client))
+
+    result = run_benchmark(web_app, 2, "I am happy.")
+
+    assert result["requests"] == 2
+    assert result["p50_seconds"] <= result["p95_seconds"]
+    texts = [call.kwargs["json"]["sentence"] for call in client.post.call_args_list]
+    assert texts == ["I am happy. Run 0.", "I am happy. Run 1."]
+    assert client.get.call_count == 3
+
+
+def test_run_benchmark_reports_refused_submissions():
+    """Test that a refused submission stops the benchmark."""
+    client = MagicMock()
+    client.post.return_value = response(429, {"error": "Busy", "retry_after": 5})
+    web_app = SimpleNamespace(app=SimpleNamespace(test_client=lambda: client))
+    with pytest.raises(RuntimeError, match="429"):
+        run_benchmark(web_app, 1, "Text.")
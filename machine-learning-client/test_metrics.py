@@ -0,0 +1,124 @@
+"""
+Unit tests for the per-stage instrumentation and the metrics endpoint.
+"""
+
+import json
+import time
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from metrics import StageTimer, WorkerMetrics, format_timings, serve_metrics
+
+
+def make_document(wall_seconds, status="processed"):
+    """Document with the diagnostics of two stages."""
+    return {
+        "overall_status": status,
+        "diagnostics": {
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": wall_seconds,
+            "stages": {
+                "preprocessing": {"wall_seconds": wall_seconds / 2, "sentences": 3, "tokens": 20},
+                "ner": {"wall_seconds": wall_seconds / 2, "sentences": 3},
+            },
+        },
+    }
+
+
+def test_stage_timer_records_stages():
+    """Test that each stage records its timings and counts."""
+    timer = StageTimer()
+    with timer.stage("preprocessing", sentences=2) as stage:
+        time.sleep(0.01)
+        stage["tokens"] = 7
+    result = timer.result()
+
+    record = result["stages"]["preprocessing"]
+    assert record["sentences"] == 2
+    assert record["tokens"] == 7
+    assert record["wall_seconds"] >= 0.01
+    assert record["cpu_seconds"] >= 0
+    assert result["wall_seconds"] >= record["wall_seconds"]
+
+
+def test_stage_timer_records_failed_stage():
+    """Test that a stage that raises is still timed."""
+    timer = StageTimer()
+    with pytest.raises(ValueError):
+        with timer.stage("topics"):
+            raise ValueError("no terms")
+    assert "topics" in timer.result()["stages"]
+
+
+def test_format_timings():
+    """Test the log line of a document's timings."""
+    assert format_timings(make_document(1.0)["diagnostics"]) == (
+        "1.00s (preprocessing 0.50s, ner 0.50s)"
+    )
+    assert format_timings(None) == "no timings"
+
+
+def test_worker_metrics_snapshot():
+    """Test counters, throughput and latency percentiles."""
+    metrics = WorkerMetrics(queue_depth=lambda: {"pending": 4, "processing": 1})
+    for wall_seconds in range(1, 101):
+        document = make_document(float(wall_seconds))
+        document["diagnostics"]["stages"]["sentence_cache"] = {"wall_seconds": 0.0, "hits": 1, "misses": 2}
+        metrics.record_document(document)
+    metrics.record_document({"overall_status": "error"})
+    metrics.record_failure()
+    snapshot = metrics.snapshot()
+
+    assert snapshot["counters"]["documents_processed"] == 100
+    assert snapshot["counters"]["documents_error"] == 1
+    assert snapshot["counters"]["documents_failed"] == 1
+    assert snapshot["counters"]["sentences"] == 300
+    assert snapshot["counters"]["tokens"] == 2000
+    assert snapshot["counters"]["sentence_cache_hits"] == 100
+    assert snapshot["counters"]["sentence_cache_misses"] == 200
+    assert snapshot["sentence_cache_hit_rate"] == pytest.approx(1 / 3)
+    assert snapshot["documents_per_second"] > 0
+    assert snapshot["queue_depth"] == {"pending": 4, "processing": 1}
+    document = snapshot["latency_seconds"]["document"]
+    assert document["count"] == 100
+    assert document["p50"] == pytest.approx(50.5)
+    assert document["p95"] <= document["p99"] <= 100
+    assert snapshot["latency_seconds"]["ner"]["p50"] == pytest.approx(25.25)
+
+
+def test_worker_metrics_keeps_bounded_samples():
+    """Test that only the most recent latency samples are kept."""
+    metrics = WorkerMetrics(max_samples=10)
+    for wall_seconds in range(100):
+        metrics.record_document(make_document(float(wall_seconds)))
+    assert metrics.snapshot()["latency_seconds"]["document"]["count"] == 10
+
+
+def test_worker_metrics_queue_depth_error():
+    """Test that a failing queue depth query does not break the snapshot."""
+
+    def failing_queue_depth():
+        raise RuntimeError("database down")
+
+    snapshot = WorkerMetrics(queue_depth=failing_queue_depth).snapshot()
+    assert snapshot["queue_depth"] == {"error": "database down"}
+
+
+def test_serve_metrics():
+    """Test the HTTP endpoint."""
+    metrics = WorkerMetrics()
+    metrics.record_document(make_document(1.0))
+    server = serve_metrics(metrics, 0, host="127.0.0.1")
+    port = server.server_address[1]
+    try:
+        with urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            assert response.status == 200
+            body = json.loads(response.read())
+        assert body["counters"]["documents_processed"] == 1
+        with pytest.raises(HTTPError):
+            urlopen(f"http://127.0.0.1:{port}/other", timeout=5)
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,62 @@
+"""
+Unit tests for the shared preprocessing stage.
+"""
+
+from unittest.mock import patch
+
+from preprocessing import (
+    PreprocessedSentence,
+    english_stopwords,
+    lemmatize,
+    preprocess_sentence,
+    preprocess_sentences,
+    topic_tokens,
+    summary_words,
+)
+
+
+def test_preprocess_sentence():
+    """Test that a sentence is tokenized and lemmatized in one pass."""
+    result = preprocess_sentence("The cats are happy.")
+    assert isinstance(result, PreprocessedSentence)
+    assert result.tokens[:2] == ["the", "cats"]
+    assert len(result.tokens) == len(result.lemmas)
+
+
+def test_preprocess_sentences():
+    """Test that every sentence entry is preprocessed in order."""
+    result = preprocess_sentences([{"sentence": "One."}, {"sentence": "Two words."}])
+    assert len(result) == 2
+    assert result[1].tokens[0] == "two"
+
+
+def test_english_stopwords_is_cached_set():
+    """Test that the stopword list is loaded once as a set."""
+    assert isinstance(english_stopwords(), frozenset)
+    assert english_stopwords() is english_stopwords()
+
+
+def test_lemmatize_is_cached():
+    """Test that repeated lemmas are served from the cache."""
+    lemmatize.cache_clear()
+    with patch("preprocessing._lemmatizer") as mock_lemmatizer:
+        mock_lemmatizer.lemmatize.return_value = "cat"
+        assert lemmatize("cats") == "cat"
+        assert lemmatize("cats") == "cat"
+        mock_lemmatizer.lemmatize.assert_called_once_with("cats", "n")
+    lemmatize.cache_clear()
+
+
+def test_topic_tokens():
+    """Test that topic tokens drop punctuation and stopwords."""
+    preprocessed = PreprocessedSentence(["the", "cats", "ran", "."], ["the", "cat", "ran", "."])
+    assert topic_tokens(preprocessed) == ["cat", "ran"]
+
+
+def test_summary_words():
+    """Test that summary words drop punctuation and numbers."""
+    preprocessed = PreprocessedSentence(
+        ["it", "cost", "42", "dollars", "!"], ["it", "cost", "42", "dollar", "!"]
+    )
+    assert summary_words(preprocessed) == ("it", "cost", "dollars")
+
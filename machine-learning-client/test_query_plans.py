@@ -0,0 +1,158 @@
+"""
+Query plan checks of the job stores: every query a store issues while
+documents go through the queue is explained, and none may scan a whole
+collection or table. The MongoDB checks need a server at MONGO_TEST_URI; its
+database is created and dropped by the test.
+"""
+
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+
+from diagnostics import score_documents
+from job_store import MongoJobStore, SQLiteJobStore, load_sentences
+from scheduling import JobCostModel
+
+MONGO_TEST_URI = os.getenv("MONGO_TEST_URI")
+# commands that read or select documents, and so have a plan
+EXPLAINED_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+# fields of a recorded command that are not part of its query
+SESSION_FIELDS = {"lsid", "txnNumber", "readConcern", "writeConcern", "autocommit", "startTransaction"}
+# SQLite statements without a plan worth checking
+UNEXPLAINED_STATEMENTS = ("BEGIN", "COMMIT", "ROLLBACK", "INSERT", "PRAGMA", "CREATE")
+
+
+def pending(request_id, sentence_count=3):
+    """Pending document as the web app stores it."""
+    return {
+        "request_id": request_id,
+        "sentences": [{"sentence": f"Sentence {index}.", "status": "pending", "analysis": None}
+                      for index in range(sentence_count)],
+        "overall_status": "pending",
+        "timestamp": datetime.now(),
+        "sentence_count": sentence_count,
+        "char_count": 12 * sentence_count,
+        "content_hash": f"hash-{request_id}",
+        "analyzer_version": "1",
+    }
+
+
+def run_queue(store):
+    """Take documents through every queue operation of the web app and the worker."""
+    store.ensure_indexes()
+    store.enqueue(pending("embedded"))
+    store.enqueue(pending("chunked", sentence_count=5), chunk_size=2)
+    store.fetch("embedded", {"request_id": 1, "overall_status": 1})
+    store.find_duplicate("hash-embedded", "1")
+    store.queue_stats(datetime.now() - timedelta(minutes=5))
+    store.queue_depth()
+
+    document = store.claim("w1", 60, JobCostModel())
+    store.renew_lease(document["_id"], "w1", 60)
+    load_sentences(store, document)
+    store.publish(document["_id"], "w1", ["summary"], {"summary": "Short."})
+    store.write_results(document["_id"], {"overall_status": "processed", "topic_coherence": 0.4}, worker_id="w1")
+    list(store.iter_chunks(store.fetch("chunked"), ["emotions"]))
+    store.model_quality_summary()
+    other = store.claim("w2", 60, JobCostModel())
+    store.release(other["_id"], "w2")
+    other = store.claim("w3", 60, JobCostModel())
+    store.write_results(other["_id"], {"overall_status": "processed"}, worker_id="w3")
+    if isinstance(store, MongoJobStore):
+        # the diagnostics job scores the chunked document; it runs on MongoDB only
+        score_documents(store.collection)
+
+
+def collection_scans(explain, winning=False):
+    """
+    COLLSCAN stages of the winning plans anywhere in an explain output.
+
+    :param explain: Explain output or a part of it
+    :param winning: Whether explain is inside a winning plan
+    :return: List of COLLSCAN stages
+    """
+    if isinstance(explain, dict):
+        found = [explain] if winning and explain.get("stage") == "COLLSCAN" else []
+        return found + [
+            scan
+            for key, value in explain.items()
+            if key != "rejectedPlans"
+            for scan in collection_scans(value, winning or key == "winningPlan")
+        ]
+    if isinstance(explain, list):
+        return [scan for value in explain for scan in collection_scans(value, winning)]
+    return []
+
+
+def test_sqlite_queries_use_indexes():
+    """Test that no query of the SQLite store scans a table."""
+    store = SQLiteJobStore()
+    statements = []
+    store._connection.set_trace_callback(statements.append)  # pylint: disable=protected-access
+    run_queue(store)
+    store._connection.set_trace_callback(None)  # pylint: disable=protected-access
+
+    explained = 0
+    for statement in dict.fromkeys(statements):
+        if statement.split()[0].upper() in UNEXPLAINED_STATEMENTS:
+            continue
+        plan = [row[3] for row in store._connection.execute(f"EXPLAIN QUERY PLAN {statement}")]  # pylint: disable=protected-access
+        assert not [step for step in plan if re.match(r"SCAN (texts|text_chunks)\b", step)], (statement, plan)
+        explained += 1
+    assert explained >= 10
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """Records the commands sent to the test database."""
+
+    def __init__(self, database):
+        self.database = database
+        self.commands = []
+
+    def started(self, event):
+        if event.database_name == self.database and event.command_name in EXPLAINED_COMMANDS:
+            self.commands.append(event.command)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+@pytest.fixture
+def mongo_database():
+    """Scratch database on the test server, recording the commands sent to it."""
+    if not MONGO_TEST_URI:
+        pytest.skip("set MONGO_TEST_URI to check the MongoDB query plans")
+    name = f"query_plans_{uuid.uuid4().hex[:8]}"
+    recorder = CommandRecorder(name)
+    client = MongoClient(MONGO_TEST_URI, serverSelectionTimeoutMS=2000, event_listeners=[recorder])
+    try:
+        client.admin.command("ping")
+    except PyMongoError as e:
+        pytest.skip(f"MongoDB at MONGO_TEST_URI is not reachable: {e}")
+    yield client[name], recorder
+    client.drop_database(name)
+    client.close()
+
+
+def test_mongo_queries_use_indexes(mongo_database):
+    """Test that no query of the MongoDB store scans a collection."""
+    database, recorder = mongo_database
+    run_queue(MongoJobStore(database["texts"]))
+
+    commands = list(recorder.commands)
+    assert commands
+    for command in commands:
+        query = {
+            key: value for key, value in command.items()
+            if not key.startswith("$") and key not in SESSION_FIELDS
+        }
+        plan = database.command("explain", query, verbosity="queryPlanner")
+        assert not collection_scans(plan), query
@@ -0,0 +1,81 @@
+"""
+Unit tests for the shortest-job-first ordering of pending documents.
+"""
+
+from datetime import datetime, timedelta
+
+from scheduling import JobCostModel
+
+SUBMITTED = datetime(2024, 11, 13, 4, 0, 0)
+
+
+def evaluate(expression, document):
+    """Evaluate the few aggregation operators the priority expression uses."""
+    if isinstance(expression, str) and expression.startswith("$"):
+        return document.get(expression[1:])
+    if not isinstance(expression, dict):
+        return expression
+    (operator, arguments), = expression.items()
+    if not isinstance(arguments, list):
+        arguments = [arguments]
+    values = [evaluate(argument, document) for argument in arguments]
+    if operator == "$ifNull":
+        return values[0] if values[0] is not None else values[1]
+    if operator == "$size":
+        return len(values[0])
+    if operator == "$min":
+        return min(values)
+    if operator == "$multiply":
+        return values[0] * values[1]
+    if operator == "$add":
+        if isinstance(values[0], datetime):
+            return values[0] + timedelta(milliseconds=sum(values[1:]))
+        return sum(values)
+    raise ValueError(operator)
+
+
+def priority(model, document):
+    """Priority time of a document as MongoDB would compute it."""
+    return evaluate(model.priority_expression(), document)
+
+
+def test_cost_seconds_is_capped():
+    """Test that the cost grows with the size up to the maximum delay."""
+    model = JobCostModel(seconds_per_sentence=0.1, seconds_per_char=0.01, max_delay_seconds=60)
+    assert model.cost_seconds(10, 100) == 2.0
+    assert model.cost_seconds(30000, 1000000) == 60
+
+
+def test_small_documents_overtake_large_ones():
+    """Test that a later small submission is claimed before an earlier large one."""
+    model = JobCostModel(seconds_per_sentence=0.05, max_delay_seconds=600)
+    large = {"timestamp": SUBMITTED, "sentence_count": 30000, "char_count": 2000000}
+    small = {"timestamp": SUBMITTED + timedelta(minutes=1), "sentence_count": 1, "char_count": 40}
+    assert priority(model, small) < priority(model, large)
+    assert priority(model, large) == SUBMITTED + timedelta(seconds=600)
+
+
+def test_aging_bounds_the_wait_of_large_documents():
+    """Test that nothing submitted after a document's maximum delay overtakes it."""
+    model = JobCostModel(seconds_per_sentence=0.05, max_delay_seconds=600)
+    large = {"timestamp": SUBMITTED, "sentence_count": 30000}
+    late = {"timestamp": SUBMITTED + timedelta(seconds=601), "sentence_count": 1}
+    assert priority(model, large) < priority(model, late)
+
+
+def test_documents_without_sizes_count_their_sentences():
+    """Test the fallback for documents submitted before sizes were recorded."""
+    model = JobCostModel(seconds_per_sentence=1, seconds_per_char=1)
+    legacy = {"timestamp": SUBMITTED, "sentences": [{"sentence": "A."}, {"sentence": "B."}]}
+    assert priority(model, legacy) == SUBMITTED + timedelta(seconds=2)
+
+
+def test_claim_pipeline_sorts_by_priority():
+    """Test that the pipeline returns the earliest priority times of the oldest documents first."""
+    model = JobCostModel(window_size=100)
+    pipeline = model.claim_pipeline({"overall_status": "pending"}, 3)
+    assert pipeline[0] == {"$match": {"overall_status": "pending"}}
+    # the window is read in index order before anything is computed or sorted
+    assert pipeline[1:3] == [{"$sort": {"timestamp": 1}}, {"$limit": 100}]
+    assert pipeline[3] == {"$project": {"priority": model.priority_expression()}}
+    assert pipeline[4:] == [{"$sort": {"priority": 1, "_id": 1}}, {"$limit": 3}]
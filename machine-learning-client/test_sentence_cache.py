@@ -0,0 +1,68 @@
+"""
+Unit tests for the cross-document sentence cache.
+"""
+
+from unittest.mock import MagicMock
+
+from pymongo.errors import PyMongoError
+
+from sentence_cache import SentenceCache, sentence_key
+
+RESULT = {"analysis": {"compound": 0.5}, "emotions": ["Happy"], "entities": []}
+
+
+def test_sentence_key_normalizes_whitespace_only():
+    """Test that keys ignore whitespace but not case or the analyzer version."""
+    assert sentence_key("Thank  you. ", "1") == sentence_key("Thank you.", "1")
+    assert sentence_key("THANK YOU.", "1") != sentence_key("Thank you.", "1")
+    assert sentence_key("Thank you.", "2") != sentence_key("Thank you.", "1")
+
+
+def test_get_many_hits_and_misses():
+    """Test that stored sentences are found and counted."""
+    cache = SentenceCache("1")
+    cache.put_many({"Thank you.": RESULT})
+    found = cache.get_many(["Thank you.", "Hello."])
+    assert found == {"Thank you.": RESULT}
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+def test_lru_eviction():
+    """Test that the least recently used sentence is evicted first."""
+    cache = SentenceCache("1", max_size=2)
+    cache.put_many({"a": RESULT, "b": RESULT})
+    cache.get_many(["a"])
+    cache.put_many({"c": RESULT})
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 2
+
+
+def test_persistent_tier():
+    """Test that misses are looked up in and written to the Mongo collection."""
+    collection = MagicMock()
+    collection.find.return_value = [{"_id": sentence_key("Hello.", "1"), **RESULT}]
+    cache = SentenceCache("1", collection=collection)
+
+    assert cache.get_many(["Hello."]) == {"Hello.": RESULT}
+    assert cache.stats()["persistent_hits"] == 1
+    # promoted into the in-process tier
+    assert cache.get_many(["Hello."]) == {"Hello.": RESULT}
+    collection.find.assert_called_once()
+
+    cache.put_many({"Bye.": RESULT})
+    collection.bulk_write.assert_called_once()
+
+
+def test_persistent_tier_errors_are_not_fatal():
+    """Test that a failing Mongo tier degrades to cache misses."""
+    collection = MagicMock()
+    collection.find.side_effect = PyMongoError("down")
+    collection.bulk_write.side_effect = PyMongoError("down")
+    cache = SentenceCache("1", collection=collection)
+    assert cache.get_many(["Hello."]) == {}
+    cache.put_many({"Hello.": RESULT})
+    assert cache.get_many(["Hello."]) == {"Hello.": RESULT}
@@ -0,0 +1,109 @@
+"""
+Unit tests for the columnar per-sentence results.
+"""
+
+import numpy as np
+
+from emotion import emotion_code
+from sentence_columns import EntityTable, SentenceColumns
+
+ENTRIES = [
+    {
+        "sentence": "Obama visited Paris.",
+        "status": "processed",
+        "analysis": {"neg": 0.0, "neu": 0.8, "pos": 0.2, "compound": 0.34},
+        "emotions": ["Happy", "Surprise"],
+        "entities": [{"text": "Obama", "label": "PERSON"}, {"text": "Paris", "label": "GPE"}],
+    },
+    {
+        "sentence": "Paris was cold.",
+        "status": "processed",
+        "analysis": {"neg": 0.3, "neu": 0.7, "pos": 0.0, "compound": -0.2},
+        "emotions": ["Neutral"],
+        "entities": [{"text": "Paris", "label": "GPE"}],
+    },
+    {"sentence": "Not analysed yet.", "status": "pending", "analysis": None},
+]
+
+
+def test_entity_table_interns_entities():
+    """Test that each distinct entity is stored once."""
+    table = EntityTable()
+    assert table.intern("Paris", "GPE") == table.intern("Paris", "GPE") == 0
+    assert table.intern("Paris", "PERSON") == 1
+    assert len(table) == 2
+    assert table.to_dicts((1, 0)) == [
+        {"text": "Paris", "label": "PERSON"}, {"text": "Paris", "label": "GPE"}
+    ]
+
+
+def test_sentence_columns_round_trip():
+    """Test that entries converted to columns and back are unchanged."""
+    columns = SentenceColumns.from_entries(ENTRIES)
+
+    assert columns.scores.dtype == np.float64
+    assert columns.emotions.tolist() == [emotion_code(["Happy", "Surprise"]), emotion_code(["Neutral"]), 0]
+    assert columns.entities == [(0, 1), (1,), None]
+    assert len(columns.entity_table) == 2
+    assert columns.to_entries(ENTRIES) == ENTRIES
+
+
+def test_sentence_columns_aggregates():
+    """Test the compound scores and emotion counts computed on the arrays."""
+    columns = SentenceColumns.from_entries(ENTRIES)
+    assert columns.compound().tolist() == [0.34, -0.2, 0.0]
+    assert columns.emotion_counts() == {"Happy": 1, "Surprise": 1, "Neutral": 1}
+
+
+
+def test_sentence_columns_document_aggregates():
+    """Test the aggregates stored on processed documents."""
+    aggregates = SentenceColumns.from_entries(ENTRIES).aggregates()
+
+    assert aggregates["sentences"] == 3
+    assert aggregates["emotion_counts"] == {"Happy": 1, "Surprise": 1, "Neutral": 1}
+    assert aggregates["emotion_intensity"] == {"Happy": 1 / 3, "Surprise": 1 / 3, "Neutral": 1 / 3}
+    histogram = aggregates["compound_histogram"]
+    assert histogram["edges"][0] == -1.0 and histogram["edges"][-1] == 1.0
+    assert len(histogram["edges"]) == len(histogram["counts"]) + 1
+    # the sentence without scores is not counted
+    assert sum(histogram["counts"]) == 2
+    filled = [index for index, count in enumerate(histogram["counts"]) if count]
+    assert [histogram["edges"][index] - 1e-9 <= score <= histogram["edges"][index + 1] + 1e-9
+            for index, score in zip(filled, [-0.2, 0.34])] == [True, True]
+    stats = aggregates["compound_stats"]
+    assert stats["count"] == 2
+    assert np.isclose(stats["mean"], 0.07)
+    assert (stats["min"], stats["max"]) == (-0.2, 0.34)
+    assert (stats["positive"], stats["neutral"], stats["negative"]) == (1, 0, 1)
+
+
+def test_sentence_columns_aggregates_without_sentences():
+    """Test that an empty document has empty aggregates."""
+    aggregates = SentenceColumns(0).aggregates()
+    assert aggregates["emotion_intensity"] == {}
+    assert aggregates["compound_stats"] == {"count": 0}
+    assert sum(aggregates["compound_histogram"]["counts"]) == 0
+
+
+def test_sentence_columns_fill_and_take():
+    """Test that stages fill rows and repeats are copied from the first occurrence."""
+    columns = SentenceColumns(2)
+    columns.set_scores([1], np.array([[0.1, 0.5, 0.4, 0.3]]))
+    columns.emotions[1] = emotion_code(["Fear"])
+    columns.entities[1] = (columns.entity_table.intern("Rome", "GPE"),)
+
+    repeated = columns.take([1, 0, 1])
+    sentences = [{"sentence": "A."}, {"sentence": "B."}, {"sentence": "A."}]
+    entries = repeated.to_entries(sentences, status="processed")
+    assert entries[0] == entries[2] == {
+        "sentence": "A.",
+        "status": "processed",
+        "analysis": {"neg": 0.1, "neu": 0.5, "pos": 0.4, "compound": 0.3},
+        "emotions": ["Fear"],
+        "entities": [{"text": "Rome", "label": "GPE"}],
+    }
+    assert entries[1] == {"sentence": "B.", "status": "processed"}
+    assert repeated.to_entries(sentences, fields=["analysis"])[0] == {
+        "sentence": "A.", "analysis": {"neg": 0.1, "neu": 0.5, "pos": 0.4, "compound": 0.3}
+    }
@@ -0,0 +1,95 @@
+"""
+Unit tests for the document stage scheduler.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from stage_graph import Stage, StageGraph
+
+
+def make_graph(barrier=None, fail=None):
+    """Diamond graph: a -> (b, c) -> d, where b and c can wait on each other."""
+
+    def branch(name):
+        def run(a):
+            if barrier is not None:
+                barrier.wait()
+            if name == fail:
+                raise RuntimeError(f"{name} failed")
+            return f"{name}({a})"
+        return run
+
+    return StageGraph([
+        Stage("a", lambda text: text.upper(), ["text"], ["a"]),
+        Stage("b", branch("b"), ["a"], ["b"]),
+        Stage("c", branch("c"), ["a"], ["c", "c_length"]),
+        Stage("d", lambda b, c: f"{b}+{c}", ["b", "c"], ["d"]),
+    ], inputs=["text"])
+
+
+def test_stage_graph_runs_in_dependency_order():
+    """Test that every stage sees its inputs, with and without an executor."""
+    graph = StageGraph([
+        Stage("d", lambda b, c: b + c, ["b", "c"], ["d"]),
+        Stage("b", lambda a: a * 2, ["a"], ["b"]),
+        Stage("c", lambda a: (a * 3, "three"), ["a"], ["c", "label"]),
+    ], inputs=["a"])
+    assert [stage.name for stage in graph.order] == ["b", "c", "d"]
+
+    completed = []
+    values = graph.run({"a": 1}, on_complete=lambda name, _values: completed.append(name))
+    assert values == {"a": 1, "b": 2, "c": 3, "label": "three", "d": 5}
+    assert completed == ["b", "c", "d"]
+    with ThreadPoolExecutor(2) as executor:
+        assert graph.run({"a": 1}, executor=executor) == values
+
+
+def test_stage_graph_runs_independent_stages_concurrently():
+    """Test that stages without a dependency between them overlap."""
+    # b and c both wait until the other one has started
+    barrier = threading.Barrier(2, timeout=5)
+    graph = StageGraph([
+        Stage("a", lambda text: text.upper(), ["text"], ["a"]),
+        Stage("b", lambda a: barrier.wait() is not None and a, ["a"], ["b"]),
+        Stage("c", lambda a: barrier.wait() is not None and a, ["a"], ["c"]),
+    ], inputs=["text"])
+    with ThreadPoolExecutor(2) as executor:
+        values = graph.run({"text": "x"}, executor=executor)
+    assert values["b"] == values["c"] == "X"
+
+
+def test_stage_graph_validates_stages():
+    """Test that impossible graphs are rejected up front."""
+    with pytest.raises(ValueError, match="more than once"):
+        StageGraph([Stage("a", len, ["x"], ["y"]), Stage("b", len, ["x"], ["y"])], inputs=["x"])
+    with pytest.raises(ValueError, match="nothing produces"):
+        StageGraph([Stage("a", len, ["z"], ["y"])], inputs=["x"])
+    with pytest.raises(ValueError, match="cycle"):
+        StageGraph([Stage("a", len, ["b"], ["a"]), Stage("b", len, ["a"], ["b"])])
+    with pytest.raises(ValueError, match="Missing graph inputs"):
+        StageGraph([Stage("a", len, ["x"], ["y"])], inputs=["x"]).run({})
+
+
+def test_stage_graph_checks_output_count():
+    """Test that a stage returning the wrong number of outputs fails."""
+    graph = StageGraph([Stage("a", lambda x: (x,), ["x"], ["y", "z"])], inputs=["x"])
+    with pytest.raises(ValueError, match="returned 1 values"):
+        graph.run({"x": 1})
+
+
+def test_stage_graph_raises_after_running_stages_finish():
+    """Test that a failing stage stops the graph once the other running stages are done."""
+    finished = []
+    graph = StageGraph([
+        Stage("fails", lambda x: 1 / 0, ["x"], ["y"]),
+        Stage("slow", lambda x: time.sleep(0.05) or finished.append("slow"), ["x"], ["z"]),
+        Stage("after", lambda y, z: finished.append("after"), ["y", "z"], ["w"]),
+    ], inputs=["x"])
+    with ThreadPoolExecutor(2) as executor:
+        with pytest.raises(ZeroDivisionError):
+            graph.run({"x": 1}, executor=executor)
+    assert finished == ["slow"]
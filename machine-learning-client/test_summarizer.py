@@ -0,0 +1,152 @@
+"""
+Unit tests for the built-in sparse LexRank summarizer.
+"""
+
+import time
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from sumy.models.dom import ObjectDocumentModel, Paragraph, Sentence
+from sumy.summarizers.lex_rank import LexRankSummarizer
+
+from summarizer import (
+    best_sentences,
+    evenly_spaced,
+    hierarchical_summarize,
+    lexrank_scores,
+    max_window_size,
+    summarize,
+    tfidf_matrix,
+)
+
+WORDS = [
+    ("the", "economy", "is", "growing"),
+    ("jobs", "and", "the", "economy", "are", "growing", "fast"),
+    ("we", "will", "build", "new", "roads"),
+    ("the", "roads", "and", "bridges", "need", "work"),
+    ("thank", "you"),
+    ("the", "economy", "needs", "new", "jobs"),
+]
+
+
+class WordListTokenizer:
+    """Tokenizer serving the word lists above to sumy."""
+
+    language = "english"
+
+    def to_words(self, sentence):
+        """Return the words of a sentence."""
+        return WORDS[int(sentence)]
+
+
+def sumy_scores():
+    """Scores of the same sentences according to sumy's LexRank."""
+    summarizer = LexRankSummarizer()
+    document = ObjectDocumentModel([
+        Paragraph([Sentence(str(index), WordListTokenizer()) for index in range(len(WORDS))])
+    ])
+    words = [summarizer._to_words_set(sentence) for sentence in document.sentences]  # pylint: disable=W0212
+    matrix = summarizer._create_matrix(  # pylint: disable=W0212
+        words, summarizer.threshold,
+        summarizer._compute_tf(words), summarizer._compute_idf(words),  # pylint: disable=W0212
+    )
+    return summarizer.power_method(matrix, summarizer.epsilon)
+
+
+def test_tfidf_matrix_rows_are_normalized():
+    """Test that every sentence with weighted words is a unit vector."""
+    matrix = tfidf_matrix(WORDS)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    assert matrix.shape[0] == len(WORDS)
+    assert np.allclose(norms[norms > 0], 1.0)
+
+
+def test_lexrank_scores_match_sumy():
+    """Test that the scores are the ones sumy computes with dense matrices."""
+    assert np.allclose(lexrank_scores(WORDS), sumy_scores())
+
+
+def test_summarize_returns_indices_in_document_order():
+    """Test that the most central sentences are returned in document order."""
+    indices = summarize(WORDS, sentence_count=2)
+    scores = lexrank_scores(WORDS)
+    assert len(indices) == 2
+    assert indices == sorted(indices)
+    assert min(scores[indices]) >= max(np.delete(scores, indices))
+
+
+def test_summarize_short_and_empty_inputs():
+    """Test documents with fewer sentences than requested, or no words at all."""
+    assert summarize(WORDS[:2], sentence_count=5) == [0, 1]
+    assert summarize([(), ()], sentence_count=1) == [0]
+    assert summarize([], sentence_count=3) == []
+
+
+def test_max_window_size_follows_memory_limit():
+    """Test that a larger memory ceiling allows larger windows."""
+    assert max_window_size(1024 * 1024) < max_window_size(64 * 1024 * 1024)
+    assert max_window_size(0) == 2
+
+
+def test_summarize_switches_to_hierarchical_mode():
+    """Test that long documents are summarized window by window."""
+    words = WORDS * 50
+    with patch("summarizer.hierarchical_summarize", return_value=[0]) as mock_hierarchical:
+        assert summarize(words, sentence_count=2, threshold=len(words)) != [0]
+        mock_hierarchical.assert_not_called()
+        assert summarize(words, sentence_count=2, threshold=100) == [0]
+        assert mock_hierarchical.call_args.args[2] == 100
+
+
+def test_hierarchical_summarize_bounds_window_size():
+    """Test that no LexRank graph is larger than a window."""
+    words = WORDS * 50
+    sizes = []
+
+    def record_size(window_words, count):
+        sizes.append(len(window_words))
+        return best_sentences(window_words, count)
+
+    with patch("summarizer.best_sentences", side_effect=record_size):
+        indices = hierarchical_summarize(words, 5, window_size=40)
+
+    assert max(sizes) <= 40
+    assert len(indices) == 5
+    assert indices == sorted(indices)
+    assert len(set(indices)) == 5
+
+
+@pytest.mark.parametrize("options", [
+    {"threshold": 0},
+    {"threshold": 1},
+    {"memory_limit_bytes": 1},
+])
+def test_summarize_with_tiny_windows(options):
+    """Test that thresholds and memory limits below two sentences still finish."""
+    indices = summarize(WORDS * 5, sentence_count=3, **options)
+    assert indices and indices == sorted(indices)
+    assert len(set(indices)) == len(indices) <= 3
+
+
+def test_hierarchical_summarize_rejects_windows_that_cannot_shrink():
+    """Test that a window of one sentence is refused instead of looping."""
+    with pytest.raises(ValueError):
+        hierarchical_summarize(WORDS, 3, window_size=1)
+
+
+def test_hierarchical_summarize_respects_time_budget():
+    """Test that windows are sampled instead of ranked once the deadline has passed."""
+    words = WORDS * 50
+    with patch("summarizer.best_sentences", wraps=best_sentences) as mock_best:
+        indices = hierarchical_summarize(words, 3, window_size=40, deadline=time.monotonic() - 1)
+
+    # only the final round of sampled candidates is ranked
+    assert mock_best.call_count == 1
+    assert len(indices) == 3
+
+
+def test_evenly_spaced():
+    """Test the positional fallback."""
+    assert evenly_spaced([10, 11, 12, 13], 2) == [10, 12]
+    assert evenly_spaced([10, 11], 5) == [10, 11]
@@ -0,0 +1,127 @@
+"""
+Unit tests for the persistent global topic model.
+"""
+
+import json
+import os
+import time
+
+from topic_model import GlobalTopicModel, main
+
+SPORTS = ["football", "match", "goal", "team", "player", "coach"]
+WEATHER = ["rain", "storm", "cloud", "forecast", "wind", "temperature"]
+
+
+def make_texts(count):
+    """Alternate short token lists from two clearly separated themes."""
+    return [
+        [words[i % 6], words[(i + 1) % 6], words[(i + 2) % 6]]
+        for i, words in ((i, SPORTS if i % 2 else WEATHER) for i in range(count))
+    ]
+
+
+def make_model(directory, **kwargs):
+    """Small model that trains quickly."""
+    options = {"num_topics": 2, "batch_size": 10, "bootstrap_size": 20, "passes": 2}
+    options.update(kwargs)
+    return GlobalTopicModel(str(directory), **options)
+
+
+def observed(model, texts):
+    """Observe sentences and wait until they are folded into the model."""
+    model.observe(texts)
+    model.flush()
+    return model
+
+
+def test_infer_without_model(tmp_path):
+    """Test that inference reports no topics before the first model is trained."""
+    model = make_model(tmp_path)
+    assert model.infer([["goal", "team"]]) is None
+
+
+def test_observe_bootstraps_after_enough_sentences(tmp_path):
+    """Test that the first model is trained in the background once the bootstrap size is reached."""
+    model = make_model(tmp_path)
+    model.observe(make_texts(10))
+    assert model.lda is None
+    assert not os.listdir(tmp_path)
+    model.observe(make_texts(10))
+
+    deadline = time.monotonic() + 30
+    while not model.refresh() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert model.version == 1
+    topics = model.infer([["goal", "team", "player"]], num_topics=2)
+    assert len(topics) == 2
+    topic_id, topic = topics[0]
+    assert isinstance(topic_id, int)
+    assert "*" in topic and "+" in topic
+
+
+def test_infer_unknown_words(tmp_path):
+    """Test that a document with no known word gets no topics."""
+    model = observed(make_model(tmp_path), make_texts(20))
+    assert model.infer([["quantum"]]) is None
+
+
+def test_observe_updates_in_mini_batches(tmp_path):
+    """Test that later documents update the saved model instead of retraining it."""
+    model = observed(make_model(tmp_path), make_texts(20))
+    trained_at = model._meta["trained_at"]  # pylint: disable=W0212
+    model.observe(make_texts(9))
+    assert model.refresh() and model.version == 1
+
+    observed(model, make_texts(1))
+    assert model.version == 2
+    assert model._meta["trained_at"] == trained_at  # pylint: disable=W0212
+    assert {"dictionary", "lda"} <= set(os.listdir(tmp_path / "model-2"))
+
+
+def test_other_processes_pick_up_new_versions(tmp_path):
+    """Test that a model saved by one worker is loaded by another."""
+    writer = make_model(tmp_path)
+    reader = make_model(tmp_path)
+    observed(writer, make_texts(20))
+
+    assert reader.infer([["rain", "storm"]]) is not None
+    assert reader.version == writer.version
+
+
+def test_old_versions_are_removed(tmp_path):
+    """Test that only the current and previous model versions are kept."""
+    model = observed(make_model(tmp_path), make_texts(40))
+    observed(model, make_texts(10))
+
+    versions = sorted(name for name in os.listdir(tmp_path) if name.startswith("model-"))
+    assert versions == [f"model-{model.version - 1}", f"model-{model.version}"]
+
+
+def test_retained_corpus_is_bounded(tmp_path):
+    """Test that only the most recent sentences are kept for retraining."""
+    model = observed(make_model(tmp_path, corpus_size=25), make_texts(20))
+    observed(model, make_texts(10))
+
+    with open(tmp_path / "corpus.jsonl", encoding="utf-8") as f:
+        assert len(f.readlines()) == 25
+
+
+def test_scheduled_retrain(tmp_path):
+    """Test that an overdue model is retrained from the corpus on the next flush."""
+    model = observed(make_model(tmp_path, retrain_seconds=1), make_texts(20))
+    meta_path = tmp_path / "meta.json"
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    meta["trained_at"] -= 10
+    meta_path.write_text(json.dumps(meta), encoding="utf-8")
+
+    observed(model, make_texts(10))
+    assert model._meta["trained_at"] > meta["trained_at"]  # pylint: disable=W0212
+
+
+def test_retrain_command(tmp_path):
+    """Test the retrain command line entry point."""
+    observed(make_model(tmp_path), make_texts(20))
+
+    main(["retrain", "--directory", str(tmp_path)])
+    assert make_model(tmp_path).refresh()
+    assert json.loads((tmp_path / "meta.json").read_text(encoding="utf-8"))["version"] == 2
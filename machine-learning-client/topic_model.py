@@ -0,0 +1,315 @@
+"""
+Persistent topic model shared by every document, replacing a fresh LDA per document.
+The model and its vocabulary live on disk and are updated online in mini-batches
+as documents are processed; per-document topics come from inference against it.
+The updates, corpus compaction and scheduled retrains run in a background
+thread, never while a document waits for its topics. A retrain/compaction pass
+rebuilds the vocabulary and the model from the retained corpus, either on a
+schedule or from the command line:
+
+    python topic_model.py retrain [--directory topic_model]
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from gensim import corpora, models
+
+
+class GlobalTopicModel:
+    """
+    Online LDA model stored in a directory shared by every worker process.
+    Writers serialize on a file lock; readers pick up new versions through
+    meta.json, which is replaced atomically after each save. Observed sentences
+    are folded in by a background thread working on a model of its own, so
+    inference never reads a model while it is being updated.
+
+    :param directory: Directory holding the model versions and retained corpus
+    :param num_topics: Number of topics in the global model
+    :param batch_size: Sentences buffered before an online update
+    :param bootstrap_size: Sentences needed to train the first model
+    :param corpus_size: Sentences retained on disk for retraining
+    :param vocab_size: Maximum vocabulary size kept on retrain
+    :param retrain_seconds: Retrain from the retained corpus this often (0 disables)
+    :param passes: Passes over the corpus when (re)training
+    """
+
+    def __init__(
+        self,
+        directory,
+        num_topics=20,
+        batch_size=2000,
+        bootstrap_size=500,
+        corpus_size=50000,
+        vocab_size=20000,
+        retrain_seconds=86400,
+        passes=5,
+    ):
+        self.directory = directory
+        self.num_topics = num_topics
+        self.batch_size = batch_size
+        self.bootstrap_size = bootstrap_size
+        self.corpus_size = corpus_size
+        self.vocab_size = vocab_size
+        self.retrain_seconds = retrain_seconds
+        self.passes = passes
+        self.lda = None
+        self.dictionary = None
+        self.version = None
+        self._meta = None
+        self._pending = []
+        # guards the loaded model, so inference sees a dictionary and LDA of one version
+        self._model_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        # one update at a time, so flush() returns once every queued sentence is in
+        self._update_lock = threading.Lock()
+        self._batch_full = threading.Event()
+        self._updates = None
+        self._writer = None
+
+    def _path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    @contextmanager
+    def _lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(".lock"), "a", encoding="utf-8") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_meta(self):
+        try:
+            with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def refresh(self):
+        """
+        Load the latest saved model if another process has saved a newer one.
+
+        :return: True if a model is loaded
+        """
+        meta = self._read_meta()
+        if meta and meta["version"] != self.version:
+            model_dir = self._path(meta["model"])
+            dictionary = corpora.Dictionary.load(os.path.join(model_dir, "dictionary"))
+            lda = models.LdaModel.load(os.path.join(model_dir, "lda"))
+            with self._model_lock:
+                self.dictionary, self.lda = dictionary, lda
+                self.version = meta["version"]
+                self._meta = meta
+        return self.lda is not None
+
+    def infer(self, texts, num_topics=5):
+        """
+        Infer the topics of a document from the global model.
+
+        :param texts: Token lists of the document's sentences
+        :param num_topics: Number of topics to return
+        :return: List of (topic_id, topic string) in the print_topics format,
+                 or None if there is no model yet or no known word in the document
+        """
+        if not self.refresh():
+            return None
+        with self._model_lock:
+            dictionary, lda = self.dictionary, self.lda
+        bow = dictionary.doc2bow([token for tokens in texts for token in tokens])
+        if not bow:
+            return None
+        distribution = sorted(
+            lda.get_document_topics(bow, minimum_probability=0.0),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        return [
+            (int(topic_id), lda.print_topic(topic_id, topn=4))
+            for topic_id, _ in distribution[:num_topics]
+        ]
+
+    def observe(self, texts):
+        """
+        Queue a document's sentences for the model. Once a mini-batch is full
+        the background thread folds the queue in (see flush); the document does
+        not wait for it.
+
+        :param texts: Token lists of the document's sentences
+        """
+        with self._pending_lock:
+            self._pending.extend(tokens for tokens in texts if tokens)
+            if not self._batch_ready():
+                return
+            if self._updates is None:
+                self._updates = threading.Thread(target=self._run_updates, name="topic-model", daemon=True)
+                self._updates.start()
+        self._batch_full.set()
+
+    def _batch_ready(self):
+        # called with _pending_lock held
+        threshold = self.batch_size if self.lda is not None else self.bootstrap_size
+        return len(self._pending) >= threshold
+
+    def _run_updates(self):
+        while True:
+            self._batch_full.wait()
+            self._batch_full.clear()
+            # a flush since the batch filled up may have taken it, and the
+            # texts queued after that are not a whole batch yet
+            with self._pending_lock:
+                if not self._batch_ready():
+                    continue
+            try:
+                self.flush()
+            except Exception as e:  # pylint: disable=broad-except
+                print(f"Topic model update failed: {e}")
+
+    def flush(self):
+        """
+        Fold the queued sentences into the model, save a new version and load it.
+        Runs in the calling thread; returns once every sentence queued before
+        the call is in the model.
+        """
+        with self._update_lock:
+            with self._pending_lock:
+                texts, self._pending = self._pending, []
+            if texts:
+                if self._writer is None:
+                    self._writer = GlobalTopicModel(
+                        self.directory,
+                        num_topics=self.num_topics,
+                        batch_size=self.batch_size,
+                        bootstrap_size=self.bootstrap_size,
+                        corpus_size=self.corpus_size,
+                        vocab_size=self.vocab_size,
+                        retrain_seconds=self.retrain_seconds,
+                        passes=self.passes,
+                    )
+                self._writer.update(texts)
+            self.refresh()
+
+    def update(self, texts):
+        """
+        Fold sentences into the model right away and save a new version: the
+        first model is trained on them, an overdue one is retrained from the
+        retained corpus, otherwise the model is updated online.
+
+        :param texts: Token lists of sentences
+        """
+        with self._lock():
+            self.refresh()
+            self._append_corpus(texts)
+            self._compact_corpus()
+            if self.lda is None:
+                self._train(texts)
+            elif self._retrain_due():
+                self._train(self._read_corpus())
+            else:
+                self.lda.update([self.dictionary.doc2bow(tokens) for tokens in texts])
+                self._save(trained_at=self._read_meta()["trained_at"])
+
+    def retrain(self):
+        """Rebuild the vocabulary and the model from the retained corpus."""
+        with self._lock():
+            self.refresh()
+            texts = self._read_corpus()
+            if texts:
+                self._train(texts)
+
+    def recent_texts(self, count):
+        """
+        Most recent sentences of the retained corpus.
+
+        :param count: Maximum number of sentences
+        :return: List of token lists, oldest first
+        """
+        return self._read_corpus()[-count:]
+
+    def _retrain_due(self):
+        # read from disk, as another process may have retrained the model meanwhile
+        trained_at = self._read_meta()["trained_at"]
+        return self.retrain_seconds and time.time() - trained_at >= self.retrain_seconds
+
+    def _train(self, texts):
+        dictionary = corpora.Dictionary(texts)
+        if len(texts) >= self.bootstrap_size:
+            dictionary.filter_extremes(no_below=2, no_above=0.5, keep_n=self.vocab_size)
+        corpus = [dictionary.doc2bow(tokens) for tokens in texts]
+        if len(dictionary) == 0:
+            print("Not enough vocabulary to train the topic model yet.")
+            return
+        self.dictionary = dictionary
+        self.lda = models.LdaModel(
+            corpus,
+            num_topics=self.num_topics,
+            id2word=dictionary,
+            passes=self.passes,
+            alpha="auto",
+            eta="auto",
+            random_state=42,
+        )
+        self._save(trained_at=time.time())
+
+    def _save(self, trained_at):
+        version = (self.version or 0) + 1
+        model_name = f"model-{version}"
+        model_dir = self._path(model_name)
+        os.makedirs(model_dir, exist_ok=True)
+        self.dictionary.save(os.path.join(model_dir, "dictionary"))
+        self.lda.save(os.path.join(model_dir, "lda"))
+
+        meta = {"version": version, "model": model_name, "trained_at": trained_at, "updated_at": time.time()}
+        with open(self._path("meta.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(self._path("meta.json.tmp"), self._path("meta.json"))
+        self.version = version
+        self._meta = meta
+
+        # keep the previous version for readers that are still loading it
+        for name in os.listdir(self.directory):
+            if name.startswith("model-") and name not in (model_name, f"model-{version - 1}"):
+                shutil.rmtree(self._path(name), ignore_errors=True)
+
+    def _append_corpus(self, texts):
+        with open(self._path("corpus.jsonl"), "a", encoding="utf-8") as f:
+            for tokens in texts:
+                f.write(json.dumps(tokens) + "\n")
+
+    def _read_corpus(self):
+        try:
+            with open(self._path("corpus.jsonl"), "r", encoding="utf-8") as f:
+                return [json.loads(line) for line in deque(f, maxlen=self.corpus_size)]
+        except FileNotFoundError:
+            return []
+
+    def _compact_corpus(self):
+        texts = self._read_corpus()
+        with open(self._path("corpus.jsonl.tmp"), "w", encoding="utf-8") as f:
+            for tokens in texts:
+                f.write(json.dumps(tokens) + "\n")
+        os.replace(self._path("corpus.jsonl.tmp"), self._path("corpus.jsonl"))
+
+
+def main(argv=None):
+    """Command line entry point for scheduled retraining."""
+    parser = argparse.ArgumentParser(description="Manage the global topic model.")
+    parser.add_argument("command", choices=["retrain"])
+    parser.add_argument("--directory", default=os.getenv("TOPIC_MODEL_DIR", "topic_model"))
+    args = parser.parse_args(argv)
+
+    model = GlobalTopicModel(args.directory)
+    model.retrain()
+    print(f"Topic model in {args.directory} is at version {model.version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,911 @@
+"""
+Storage of the analysis jobs (the texts collection) behind one interface, so the
+web app and the workers run on MongoDB or on an embedded SQLite database with the
+same semantics: enqueue, fetch by request_id, lease-based claims, and partial or
+complete result writes that only apply while the writer holds the lease.
+
+Large submissions can be stored in the chunked layout: their sentences live in
+chunk records of a fixed number of sentences, keyed by request_id and chunk
+index, instead of in one array on the document. That keeps every record far
+below MongoDB's 16 MB document limit, lets workers write results chunk by chunk
+and readers go through them one chunk at a time (see iter_chunks).
+
+SQLite at a file path is shared by the processes of one node; at ":memory:" it
+lives in the process, e.g. when the web app and a worker run together (see
+local_stack.py). Model-quality diagnostics and the persistent sentence cache
+tier stay on MongoDB.
+
+The web app and the ML client share this module: both images copy it from the
+shared build context (see their Dockerfiles), and pytest finds it through the
+pythonpath in pyproject.toml.
+"""
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import chain
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+
+# exceptions a store raises when the database fails
+STORAGE_ERRORS = (PyMongoError, sqlite3.Error)
+# version of the worker's analyses: the web app only reuses the results of an
+# identical submission and the workers only reuse cached sentence results made
+# by the same version. Bump it whenever the sentiment, emotion or NER analyses
+# change; both services read it from here, so they cannot disagree
+ANALYZER_VERSION = "1"
+
+ACTIVE_STATUSES = ("pending", "processing")
+# documents an identical submission may be aliased to
+REUSABLE_STATUSES = ("pending", "processing", "processed")
+PENDING_INSERTS_PIPELINE = [
+    {"$match": {"operationType": "insert", "fullDocument.overall_status": "pending"}}
+]
+# sentences of a stored document; documents submitted before sentence_count
+# was recorded count their sentence entries
+SENTENCE_COUNT = {"$ifNull": ["$sentence_count", {"$size": {"$ifNull": ["$sentences", []]}}]}
+# document_coherence of a store without scored documents
+NO_COHERENCE = {"documents": 0, "mean_coherence": None, "min_coherence": None, "max_coherence": None}
+
+
+class ChangeStreamsUnavailable(Exception):
+    """Raised by watch_pending when a store cannot stream its inserts; the worker polls it instead."""
+
+
+def split_chunks(sentences, chunk_size):
+    """
+    Sentence entries in chunks of chunk_size.
+
+    :param sentences: List of sentence entries
+    :param chunk_size: Sentences per chunk
+    :return: Iterator of (chunk index, list of sentence entries)
+    """
+    for index, start in enumerate(range(0, len(sentences), chunk_size)):
+        yield index, sentences[start:start + chunk_size]
+
+
+def chunk_owner(document):
+    """
+    Request id the chunks of a document are stored under; an alias resolved to
+    its original (see the web app's find_document) reads the original's chunks.
+
+    :param document: Document
+    :return: Request id
+    """
+    return document.get("alias_of") or document["request_id"]
+
+
+def chunk_projection(fields):
+    """
+    Projection of the sentence entries of a chunk.
+
+    :param fields: Sentence entry fields to read, None for the whole entries
+    :return: MongoDB projection
+    """
+    if fields is None:
+        return {"_id": 0, "sentences": 1}
+    return {"_id": 0, **{f"sentences.{field}": 1 for field in fields}}
+
+
+def load_sentences(store, document):
+    """
+    All sentence entries of a document, read from its chunks if it is chunked.
+
+    :param store: Job store holding the document
+    :param document: Document
+    :return: List of sentence entries
+    """
+    return list(chain.from_iterable(store.iter_chunks(document)))
+
+
+class MongoJobStore:
+    """
+    Jobs in a MongoDB collection.
+
+    :param collection: The texts collection
+    :param chunks: Collection of the sentence chunks, text_chunks of the same
+                   database by default
+    :param diagnostics: Collection the ML client's diagnostics job writes,
+                        model_diagnostics of the same database by default
+    """
+
+    def __init__(self, collection, chunks=None, diagnostics=None):
+        self.collection = collection
+        self.chunks = chunks if chunks is not None else collection.database["text_chunks"]
+        self.diagnostics = (
+            diagnostics if diagnostics is not None else collection.database["model_diagnostics"]
+        )
+
+    def enqueue(self, document, chunk_size=0):
+        """
+        Store a new document. With a chunk_size, a document with more sentences
+        is stored in the chunked layout: the chunks are written first, then the
+        document with chunk_size and chunk_count in place of its sentences, so a
+        worker never claims a document whose chunks are missing.
+
+        :param document: Document; gets its "_id" set
+        :param chunk_size: Sentences per chunk, 0 to always embed the sentences
+        :return: The document's id
+        """
+        if chunk_size and len(document.get("sentences", [])) > chunk_size:
+            sentences = document.pop("sentences")
+            document["chunk_size"] = chunk_size
+            document["chunk_count"] = self.write_chunks(
+                document["request_id"], split_chunks(sentences, chunk_size)
+            )
+        return self.collection.insert_one(document).inserted_id
+
+    def fetch(self, request_id, projection=None):
+        """
+        Document of a request.
+
+        :param request_id: Request id
+        :param projection: Optional MongoDB projection of the fields to read
+        :return: Document or None
+        """
+        return self.collection.find_one({"request_id": request_id}, projection)
+
+    def iter_chunks(self, document, fields=None):
+        """
+        Sentence entries of a document chunk by chunk, read lazily in chunk order.
+
+        :param document: Document
+        :param fields: Sentence entry fields to read from the chunks, None for all
+        :return: Iterator of lists of sentence entries; the embedded sentences
+                 as one list for a document that is not chunked
+        """
+        if not document.get("chunk_count"):
+            yield document.get("sentences", [])
+            return
+        cursor = self.chunks.find(
+            {"request_id": chunk_owner(document)}, chunk_projection(fields)
+        ).sort("chunk", 1)
+        for chunk in cursor:
+            yield chunk["sentences"]
+
+    def write_chunks(self, request_id, chunks, attempt=None):
+        """
+        Store sentence chunks of a document, one write per chunk. A worker
+        passes the attempt of its claim as a fencing token: a chunk written
+        under a later claim is left alone, so a worker that lost its lease
+        cannot overwrite the newer owner's results with its own, possibly
+        partial, ones. Relies on the unique chunk index (see ensure_indexes).
+
+        :param request_id: Request id of the document
+        :param chunks: Iterable of (chunk index, list of sentence entries)
+        :param attempt: Attempt of the writer's claim, None to write unconditionally
+        :return: Number of chunks written
+        """
+        written = 0
+        for index, sentences in chunks:
+            query = {"request_id": request_id, "chunk": index}
+            fields = {"sentences": sentences}
+            if attempt is not None:
+                query["attempt"] = {"$not": {"$gt": attempt}}
+                fields["attempt"] = attempt
+            try:
+                self.chunks.update_one(query, {"$set": fields}, upsert=True)
+            except DuplicateKeyError:
+                # the chunk was written under a later claim
+                continue
+            written += 1
+        return written
+
+    def find_duplicate(self, content_hash, analyzer_version):
+        """
+        Most recent queued or processed document with the same text.
+
+        :param content_hash: Hash of the submitted text
+        :param analyzer_version: Analyzer version the results must come from
+        :return: Dict with "_id" and "request_id", or None
+        """
+        return self.collection.find_one(
+            {
+                "content_hash": content_hash,
+                "analyzer_version": analyzer_version,
+                "overall_status": {"$in": list(REUSABLE_STATUSES)},
+            },
+            {"request_id": 1},
+            sort=[("timestamp", -1)],
+        )
+
+    def claim(self, worker_id, lease_seconds, cost_model, candidates=5):
+        """
+        Atomically claim the pending document with the earliest priority time
+        (see scheduling.JobCostModel), or one whose lease has expired. Candidates
+        another worker claims first are skipped.
+
+        :param worker_id: Identifier of the claiming worker
+        :param lease_seconds: How long the claim is valid without renewal
+        :param cost_model: JobCostModel ordering the documents
+        :param candidates: Documents tried before the candidates are looked up again
+        :return: The claimed document, or None if the queue is empty
+        """
+        while True:
+            now = datetime.now()
+            claimable = {
+                "$or": [
+                    {"overall_status": "pending"},
+                    {"overall_status": "processing", "lease_expires_at": {"$lt": now}},
+                ]
+            }
+            found = list(self.collection.aggregate(cost_model.claim_pipeline(claimable, candidates)))
+            if not found:
+                return None
+            for candidate in found:
+                document = self.collection.find_one_and_update(
+                    {"_id": candidate["_id"], **claimable},
+                    {
+                        "$set": {
+                            "overall_status": "processing",
+                            "worker_id": worker_id,
+                            "claimed_at": now,
+                            "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                        },
+                        "$inc": {"attempts": 1},
+                    },
+                    return_document=ReturnDocument.AFTER,
+                )
+                if document is not None:
+                    return document
+
+    def renew_lease(self, document_id, worker_id, lease_seconds):
+        """
+        Extend the lease on a document the worker is still processing.
+
+        :param document_id: Document id
+        :param worker_id: Identifier of the worker holding the lease
+        :param lease_seconds: New lease length from now
+        :return: True if the lease is still held by the worker
+        """
+        result = self.collection.update_one(
+            {"_id": document_id, "worker_id": worker_id, "overall_status": "processing"},
+            {"$set": {"lease_expires_at": datetime.now() + timedelta(seconds=lease_seconds)}},
+        )
+        return result.modified_count == 1
+
+    def release(self, document_id, worker_id):
+        """
+        Hand a claimed document back to the queue.
+
+        :param document_id: Document id
+        :param worker_id: Identifier of the worker holding the lease
+        """
+        self.collection.update_one(
+            {"_id": document_id, "worker_id": worker_id, "overall_status": "processing"},
+            {
+                "$set": {"overall_status": "pending"},
+                "$unset": {"worker_id": "", "lease_expires_at": ""},
+            },
+        )
+
+    def write_results(self, document_id, fields, worker_id=None):
+        """
+        Store the final fields of a document.
+
+        :param document_id: Document id
+        :param fields: Fields to set
+        :param worker_id: Worker that must still hold the lease, if any
+        :return: True if the document was written
+        """
+        query = {"_id": document_id}
+        if worker_id:
+            query["worker_id"] = worker_id
+        result = self.collection.update_one(query, {"$set": fields})
+        return result.matched_count != 0
+
+    def publish(self, document_id, worker_id, stages, fields):
+        """
+        Store the results of finished stages of a claimed document.
+
+        :param document_id: Document id
+        :param worker_id: Worker that must still hold the lease
+        :param stages: Names of the stages that are now complete
+        :param fields: Result fields to set
+        """
+        self.collection.update_one(
+            {"_id": document_id, "worker_id": worker_id},
+            {"$set": fields, "$addToSet": {"completed_stages": {"$each": stages}}},
+        )
+
+    def queue_depth(self):
+        """
+        Number of queued documents.
+
+        :return: Dict with the pending and processing counts
+        """
+        return {
+            status: self.collection.count_documents({"overall_status": status})
+            for status in ACTIVE_STATUSES
+        }
+
+    def queue_stats(self, since):
+        """
+        Backlog and recent throughput, counted in one aggregation.
+
+        :param since: Start of the throughput window
+        :return: Dict with pending_documents, pending_sentences,
+                 processed_documents and processed_sentences
+        """
+        counts = {"documents": {"$sum": 1}, "sentences": {"$sum": SENTENCE_COUNT}}
+        result = next(iter(self.collection.aggregate([
+            {"$match": {"$or": [
+                {"overall_status": {"$in": list(ACTIVE_STATUSES)}},
+                # processed documents carry the time they were finished
+                {"overall_status": "processed", "timestamp": {"$gte": since}},
+            ]}},
+            {"$facet": {
+                "pending": [
+                    {"$match": {"overall_status": {"$in": list(ACTIVE_STATUSES)}}},
+                    {"$group": {"_id": None, **counts}},
+                ],
+                "processed": [
+                    {"$match": {"overall_status": "processed"}},
+                    {"$group": {"_id": None, **counts}},
+                ],
+            }},
+        ])), {})
+        pending = (result.get("pending") or [{}])[0]
+        processed = (result.get("processed") or [{}])[0]
+        return {
+            "pending_documents": pending.get("documents", 0),
+            "pending_sentences": pending.get("sentences", 0),
+            "processed_documents": processed.get("documents", 0),
+            "processed_sentences": processed.get("sentences", 0),
+        }
+
+    def model_quality_summary(self, limit=20):
+        """
+        Model-quality diagnostics stored by the ML client's background job.
+
+        :param limit: Number of topic model versions, most recent first
+        :return: Dict with the topic_models diagnostics and the document_coherence
+                 summary (count, mean, min and max) of the scored documents
+        """
+        models = list(self.diagnostics.find({}, {"_id": 0}).sort("model_version", -1).limit(limit))
+        summary = next(self.collection.aggregate([
+            {"$match": {"topic_coherence": {"$type": "number"}}},
+            {"$group": {
+                "_id": None,
+                "documents": {"$sum": 1},
+                "mean_coherence": {"$avg": "$topic_coherence"},
+                "min_coherence": {"$min": "$topic_coherence"},
+                "max_coherence": {"$max": "$topic_coherence"},
+            }},
+            {"$project": {"_id": 0}},
+        ]), dict(NO_COHERENCE))
+        return {"topic_models": models, "document_coherence": summary}
+
+    def ensure_indexes(self):
+        """Create the indexes the lookups rely on, if they are missing."""
+        # every route looks documents up by request_id
+        self.collection.create_index([("request_id", 1)], unique=True)
+        # claims, queue depth and admission stats select by status and submission time
+        self.collection.create_index([("overall_status", 1), ("timestamp", 1)])
+        # identical submissions are found by their content hash
+        self.collection.create_index([("content_hash", 1), ("analyzer_version", 1)])
+        self.chunks.create_index([("request_id", 1), ("chunk", 1)], unique=True)
+        # /model_quality summarizes the documents the diagnostics job has scored
+        self.collection.create_index(
+            [("topic_coherence", 1)], partialFilterExpression={"topic_coherence": {"$type": "number"}}
+        )
+        self.diagnostics.create_index([("model_version", -1)])
+
+    def watch_pending(self):
+        """
+        Stream of inserts of pending documents.
+
+        :return: Change stream, a context manager with alive and try_next()
+        :raises: ChangeStreamsUnavailable if the server refuses to open one,
+                 e.g. a standalone mongod
+        """
+        try:
+            return self.collection.watch(PENDING_INSERTS_PIPELINE, max_await_time_ms=1000)
+        except OperationFailure as e:
+            raise ChangeStreamsUnavailable(str(e)) from e
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__}")
+
+
+def _decode(value):
+    if len(value) == 1 and "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def _epoch(value):
+    return value.timestamp() if isinstance(value, datetime) else None
+
+
+def _placeholders(values):
+    return f"({', '.join('?' * len(values))})"
+
+
+def _project(document, projection):
+    # the document is one JSON value, so a projection trims what is returned by
+    # top-level field; "sentences.emotions" keeps the whole sentences
+    if not projection:
+        return document
+    if any(projection.values()):
+        included = {path.split(".")[0] for path, include in projection.items() if include}
+        return {key: value for key, value in document.items() if key in included or key == "_id"}
+    return {key: value for key, value in document.items() if key not in projection}
+
+
+class PendingInserts:
+    """
+    In-process stand-in for a change stream of pending inserts.
+
+    :param condition: Condition notified on every insert of a pending document
+    :param counter: Callable returning the number of such inserts so far
+    :param timeout: Seconds try_next() waits for an insert
+    """
+
+    alive = True
+
+    def __init__(self, condition, counter, timeout=1.0):
+        self.condition = condition
+        self.counter = counter
+        self.timeout = timeout
+        self.seen = counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def try_next(self):
+        """
+        Wait for the next insert.
+
+        :return: Truthy if pending documents were inserted, else None
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.counter() != self.seen, self.timeout)
+            inserted = self.counter() - self.seen
+            self.seen = self.counter()
+        return {"operationType": "insert"} if inserted else None
+
+
+class SQLiteJobStore:
+    """
+    Jobs in an embedded SQLite database. Each document is stored as JSON next to
+    the columns the queue filters and sorts on; read-modify-write updates run in
+    immediate transactions, so they are atomic across processes sharing the file.
+
+    :param path: Database file, or ":memory:" for a database of this process only
+    """
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._lock = threading.RLock()
+        self._inserted = threading.Condition(self._lock)
+        self._pending_inserts = 0
+        self._connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS texts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                request_id TEXT UNIQUE,
+                overall_status TEXT,
+                content_hash TEXT,
+                analyzer_version TEXT,
+                timestamp REAL,
+                sentence_count INTEGER,
+                char_count INTEGER,
+                worker_id TEXT,
+                lease_expires_at REAL,
+                document TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS texts_status ON texts (overall_status, timestamp);
+            CREATE INDEX IF NOT EXISTS texts_content_hash ON texts (content_hash, analyzer_version);
+            CREATE INDEX IF NOT EXISTS texts_topic_coherence
+                ON texts (json_type(document, '$.topic_coherence'));
+            CREATE TABLE IF NOT EXISTS text_chunks (
+                request_id TEXT,
+                chunk INTEGER,
+                sentences TEXT NOT NULL,
+                attempt INTEGER,
+                PRIMARY KEY (request_id, chunk)
+            );
+        """)
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so no other process
+        # can change a row between reading and writing it
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def _row_values(self, document):
+        fields = {key: value for key, value in document.items() if key != "_id"}
+        return (
+            document.get("request_id"),
+            document.get("overall_status"),
+            document.get("content_hash"),
+            document.get("analyzer_version"),
+            _epoch(document.get("timestamp")),
+            document.get("sentence_count", len(document.get("sentences") or [])),
+            document.get("char_count", 0),
+            document.get("worker_id"),
+            _epoch(document.get("lease_expires_at")),
+            json.dumps(fields, default=_encode),
+        )
+
+    def _document(self, row):
+        document_id, body = row
+        return {"_id": document_id, **json.loads(body, object_hook=_decode)}
+
+    def _load(self, document_id):
+        row = self._connection.execute(
+            "SELECT id, document FROM texts WHERE id = ?", (document_id,)
+        ).fetchone()
+        return self._document(row) if row else None
+
+    def _store(self, document):
+        self._connection.execute(
+            "UPDATE texts SET request_id = ?, overall_status = ?, content_hash = ?, "
+            "analyzer_version = ?, timestamp = ?, sentence_count = ?, char_count = ?, "
+            "worker_id = ?, lease_expires_at = ?, document = ? WHERE id = ?",
+            (*self._row_values(document), document["_id"]),
+        )
+
+    def _update(self, document_id, applies, change):
+        """
+        Change a document in one transaction if it matches.
+
+        :param document_id: Document id
+        :param applies: Predicate on the stored document
+        :param change: Function changing the document in place
+        :return: True if the document was changed
+        """
+        with self._transaction():
+            document = self._load(document_id)
+            if document is None or not applies(document):
+                return False
+            change(document)
+            self._store(document)
+            return True
+
+    def enqueue(self, document, chunk_size=0):
+        """
+        Store a new document, with more than chunk_size sentences in the chunked
+        layout.
+
+        :param document: Document; gets its "_id" set
+        :param chunk_size: Sentences per chunk, 0 to always embed the sentences
+        :return: The document's id
+        """
+        with self._lock:
+            if chunk_size and len(document.get("sentences", [])) > chunk_size:
+                sentences = document.pop("sentences")
+                document["chunk_size"] = chunk_size
+                document["chunk_count"] = self.write_chunks(
+                    document["request_id"], split_chunks(sentences, chunk_size)
+                )
+            cursor = self._connection.execute(
+                "INSERT INTO texts (request_id, overall_status, content_hash, analyzer_version, "
+                "timestamp, sentence_count, char_count, worker_id, lease_expires_at, document) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._row_values(document),
+            )
+            document["_id"] = cursor.lastrowid
+            if document.get("overall_status") == "pending":
+                self._pending_inserts += 1
+                self._inserted.notify_all()
+        return document["_id"]
+
+    def fetch(self, request_id, projection=None):
+        """
+        Document of a request.
+
+        :param request_id: Request id
+        :param projection: Optional MongoDB-style projection of top-level fields
+        :return: Document or None
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id, document FROM texts WHERE request_id = ?", (request_id,)
+            ).fetchone()
+        return _project(self._document(row), projection) if row else None
+
+    def iter_chunks(self, document, fields=None):
+        """
+        Sentence entries of a document chunk by chunk, read lazily in chunk order.
+
+        :param document: Document
+        :param fields: Sentence entry fields to read from the chunks, None for all
+        :return: Iterator of lists of sentence entries; the embedded sentences
+                 as one list for a document that is not chunked
+        """
+        if not document.get("chunk_count"):
+            yield document.get("sentences", [])
+            return
+        for index in range(document["chunk_count"]):
+            with self._lock:
+                row = self._connection.execute(
+                    "SELECT sentences FROM text_chunks WHERE request_id = ? AND chunk = ?",
+                    (chunk_owner(document), index),
+                ).fetchone()
+            if row:
+                sentences = json.loads(row[0])
+                if fields is not None:
+                    sentences = [{field: entry[field] for field in fields if field in entry} for entry in sentences]
+                yield sentences
+
+    def write_chunks(self, request_id, chunks, attempt=None):
+        """
+        Store sentence chunks of a document, one write per chunk; like the Mongo
+        store, a chunk written under a later claim than attempt is left alone.
+
+        :param request_id: Request id of the document
+        :param chunks: Iterable of (chunk index, list of sentence entries)
+        :param attempt: Attempt of the writer's claim, None to write unconditionally
+        :return: Number of chunks written
+        """
+        written = 0
+        for index, sentences in chunks:
+            with self._lock:
+                cursor = self._connection.execute(
+                    "INSERT INTO text_chunks (request_id, chunk, sentences, attempt) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (request_id, chunk) DO UPDATE SET sentences = excluded.sentences, "
+                    "attempt = coalesce(excluded.attempt, text_chunks.attempt) "
+                    "WHERE excluded.attempt IS NULL OR text_chunks.attempt IS NULL "
+                    "OR text_chunks.attempt <= excluded.attempt",
+                    (request_id, index, json.dumps(sentences, default=_encode), attempt),
+                )
+            written += cursor.rowcount
+        return written
+
+    def find_duplicate(self, content_hash, analyzer_version):
+        """
+        Most recent queued or processed document with the same text.
+
+        :param content_hash: Hash of the submitted text
+        :param analyzer_version: Analyzer version the results must come from
+        :return: Dict with "_id" and "request_id", or None
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id, request_id FROM texts WHERE content_hash = ? AND analyzer_version = ? "
+                f"AND overall_status IN {_placeholders(REUSABLE_STATUSES)} ORDER BY timestamp DESC LIMIT 1",
+                (content_hash, analyzer_version, *REUSABLE_STATUSES),
+            ).fetchone()
+        return {"_id": row[0], "request_id": row[1]} if row else None
+
+    def claim(self, worker_id, lease_seconds, cost_model, candidates=5):  # pylint: disable=unused-argument
+        """
+        Atomically claim the pending document with the earliest priority time
+        (see scheduling.JobCostModel), or one whose lease has expired.
+
+        :param worker_id: Identifier of the claiming worker
+        :param lease_seconds: How long the claim is valid without renewal
+        :param cost_model: JobCostModel ordering the documents
+        :param candidates: Unused; the claim is a single transaction
+        :return: The claimed document, or None if the queue is empty
+        """
+        now = datetime.now()
+        window = cost_model.window_size
+        with self._transaction():
+            # each branch reads the oldest documents from the status index, so
+            # only the window is sorted by priority time
+            row = self._connection.execute(
+                "SELECT id FROM ("
+                "SELECT * FROM (SELECT id, timestamp, sentence_count, char_count FROM texts "
+                "WHERE overall_status = 'pending' ORDER BY timestamp LIMIT ?) "
+                "UNION ALL "
+                "SELECT * FROM (SELECT id, timestamp, sentence_count, char_count FROM texts "
+                "WHERE overall_status = 'processing' AND lease_expires_at < ? ORDER BY timestamp LIMIT ?) "
+                "ORDER BY timestamp LIMIT ?) "
+                "ORDER BY timestamp + min(?, ? * sentence_count + ? * char_count), id LIMIT 1",
+                (
+                    window,
+                    now.timestamp(),
+                    window,
+                    window,
+                    cost_model.max_delay_seconds,
+                    cost_model.seconds_per_sentence,
+                    cost_model.seconds_per_char,
+                ),
+            ).fetchone()
+            if row is None:
+                return None
+            document = self._load(row[0])
+            document.update({
+                "overall_status": "processing",
+                "worker_id": worker_id,
+                "claimed_at": now,
+                "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                "attempts": document.get("attempts", 0) + 1,
+            })
+            self._store(document)
+            return document
+
+    def renew_lease(self, document_id, worker_id, lease_seconds):
+        """
+        Extend the lease on a document the worker is still processing.
+
+        :param document_id: Document id
+        :param worker_id: Identifier of the worker holding the lease
+        :param lease_seconds: New lease length from now
+        :return: True if the lease is still held by the worker
+        """
+        return self._update(
+            document_id,
+            lambda document: document.get("worker_id") == worker_id
+            and document.get("overall_status") == "processing",
+            lambda document: document.update(
+                lease_expires_at=datetime.now() + timedelta(seconds=lease_seconds)
+            ),
+        )
+
+    def release(self, document_id, worker_id):
+        """
+        Hand a claimed document back to the queue.
+
+        :param document_id: Document id
+        :param worker_id: Identifier of the worker holding the lease
+        """
+        def change(document):
+            document["overall_status"] = "pending"
+            document.pop("worker_id", None)
+            document.pop("lease_expires_at", None)
+
+        self._update(
+            document_id,
+            lambda document: document.get("worker_id") == worker_id
+            and document.get("overall_status") == "processing",
+            change,
+        )
+
+    def write_results(self, document_id, fields, worker_id=None):
+        """
+        Store the final fields of a document.
+
+        :param document_id: Document id
+        :param fields: Fields to set
+        :param worker_id: Worker that must still hold the lease, if any
+        :return: True if the document was written
+        """
+        return self._update(
+            document_id,
+            lambda document: not worker_id or document.get("worker_id") == worker_id,
+            lambda document: document.update(fields),
+        )
+
+    def publish(self, document_id, worker_id, stages, fields):
+        """
+        Store the results of finished stages of a claimed document.
+
+        :param document_id: Document id
+        :param worker_id: Worker that must still hold the lease
+        :param stages: Names of the stages that are now complete
+        :param fields: Result fields to set
+        """
+        def change(document):
+            document.update(fields)
+            completed = document.setdefault("completed_stages", [])
+            completed.extend(stage for stage in stages if stage not in completed)
+
+        self._update(document_id, lambda document: document.get("worker_id") == worker_id, change)
+
+    def queue_depth(self):
+        """
+        Number of queued documents.
+
+        :return: Dict with the pending and processing counts
+        """
+        with self._lock:
+            counts = dict(self._connection.execute(
+                "SELECT overall_status, count(*) FROM texts "
+                f"WHERE overall_status IN {_placeholders(ACTIVE_STATUSES)} GROUP BY overall_status",
+                ACTIVE_STATUSES,
+            ).fetchall())
+        return {status: counts.get(status, 0) for status in ACTIVE_STATUSES}
+
+    def queue_stats(self, since):
+        """
+        Backlog and recent throughput.
+
+        :param since: Start of the throughput window
+        :return: Dict with pending_documents, pending_sentences,
+                 processed_documents and processed_sentences
+        """
+        with self._lock:
+            pending = self._connection.execute(
+                "SELECT count(*), coalesce(sum(sentence_count), 0) FROM texts "
+                f"WHERE overall_status IN {_placeholders(ACTIVE_STATUSES)}",
+                ACTIVE_STATUSES,
+            ).fetchone()
+            processed = self._connection.execute(
+                "SELECT count(*), coalesce(sum(sentence_count), 0) FROM texts "
+                "WHERE overall_status = 'processed' AND timestamp >= ?",
+                (since.timestamp(),),
+            ).fetchone()
+        return {
+            "pending_documents": pending[0],
+            "pending_sentences": pending[1],
+            "processed_documents": processed[0],
+            "processed_sentences": processed[1],
+        }
+
+    def model_quality_summary(self, limit=20):  # pylint: disable=unused-argument
+        """
+        Model-quality diagnostics. The diagnostics job runs on MongoDB only, so
+        there are no topic model diagnostics, and documents only have a
+        coherence if one was stored with their results.
+
+        :param limit: Number of topic model versions, unused
+        :return: Dict with the topic_models diagnostics and the document_coherence
+                 summary (count, mean, min and max) of the scored documents
+        """
+        with self._lock:
+            documents, mean, low, high = self._connection.execute(
+                "SELECT count(*), avg(coherence), min(coherence), max(coherence) FROM ("
+                "SELECT json_extract(document, '$.topic_coherence') AS coherence FROM texts "
+                "WHERE json_type(document, '$.topic_coherence') IN ('integer', 'real'))"
+            ).fetchone()
+        if not documents:
+            return {"topic_models": [], "document_coherence": dict(NO_COHERENCE)}
+        return {
+            "topic_models": [],
+            "document_coherence": {
+                "documents": documents, "mean_coherence": mean, "min_coherence": low, "max_coherence": high,
+            },
+        }
+
+    def ensure_indexes(self):
+        """The indexes are created with the table."""
+
+    def watch_pending(self):
+        """
+        Stream of inserts of pending documents made through this store.
+
+        :return: PendingInserts
+        :raises: ChangeStreamsUnavailable for a database file, which other
+                 processes insert into unseen; the worker polls it instead
+        """
+        if self.path != ":memory:":
+            raise ChangeStreamsUnavailable("SQLite job stores shared between processes are polled")
+        return PendingInserts(self._inserted, lambda: self._pending_inserts)
+
+
+_sqlite_stores = {}
+
+
+def open_job_store(backend, collection=None, path=":memory:"):
+    """
+    Job store of the configured backend. SQLite stores are shared per path
+    within a process, so a web app and a worker running together see the same
+    in-memory database.
+
+    :param backend: "mongo" or "sqlite"
+    :param collection: The texts collection, for "mongo"
+    :param path: Database file or ":memory:", for "sqlite"
+    :return: MongoJobStore or SQLiteJobStore
+    :raises: ValueError for an unknown backend
+    """
+    if backend == "mongo":
+        return MongoJobStore(collection)
+    if backend == "sqlite":
+        if path not in _sqlite_stores:
+            _sqlite_stores[path] = SQLiteJobStore(path)
+        return _sqlite_stores[path]
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,114 @@
+"""
+Admission control for new submissions. The pending backlog (documents and
+sentences) and the workers' recent throughput are counted with one query of the
+job store that is cached for a few seconds, so a burst of submissions costs one query per
+cache period. Submissions that would push the backlog over its limits are
+refused with a Retry-After estimate of how long the workers need to drain the
+excess.
+"""
+
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+
+class QueueStats:
+    """
+    Snapshot of the queue.
+
+    :param pending_documents: Documents waiting or being processed
+    :param pending_sentences: Sentences of those documents
+    :param documents_per_second: Documents processed per second recently
+    :param sentences_per_second: Sentences processed per second recently
+    """
+
+    def __init__(self, pending_documents=0, pending_sentences=0,
+                 documents_per_second=0.0, sentences_per_second=0.0):
+        self.pending_documents = pending_documents
+        self.pending_sentences = pending_sentences
+        self.documents_per_second = documents_per_second
+        self.sentences_per_second = sentences_per_second
+
+
+class AdmissionController:
+    """
+    Decides whether a submission is accepted.
+
+    :param store: Job store of submitted documents (see job_store.py)
+    :param max_pending_documents: Backlog limit in documents, 0 for no limit
+    :param max_pending_sentences: Backlog limit in sentences, 0 for no limit
+    :param throughput_window_seconds: Period the throughput is measured over
+    :param cache_seconds: How long counted stats are reused
+    :param max_retry_after: Upper bound of the Retry-After estimate in seconds
+    """
+
+    def __init__(self, store, max_pending_documents=0, max_pending_sentences=0,
+                 throughput_window_seconds=300, cache_seconds=2, max_retry_after=600):
+        self.store = store
+        self.max_pending_documents = max_pending_documents
+        self.max_pending_sentences = max_pending_sentences
+        self.throughput_window_seconds = throughput_window_seconds
+        self.cache_seconds = cache_seconds
+        self.max_retry_after = max_retry_after
+        self._stats = None
+        self._counted_at = 0.0
+        self._lock = threading.Lock()
+
+    def count(self):
+        """
+        Count the backlog and recent throughput in one query.
+
+        :return: QueueStats
+        """
+        since = datetime.now() - timedelta(seconds=self.throughput_window_seconds)
+        counts = self.store.queue_stats(since)
+        return QueueStats(
+            pending_documents=counts["pending_documents"],
+            pending_sentences=counts["pending_sentences"],
+            documents_per_second=counts["processed_documents"] / self.throughput_window_seconds,
+            sentences_per_second=counts["processed_sentences"] / self.throughput_window_seconds,
+        )
+
+    def stats(self):
+        """
+        Queue stats, counted at most once per cache_seconds.
+
+        :return: QueueStats
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._stats is None or now - self._counted_at >= self.cache_seconds:
+                self._stats = self.count()
+                self._counted_at = now
+            return self._stats
+
+    def check(self, sentence_count):
+        """
+        Decide on a submission of the given size.
+
+        :param sentence_count: Sentences of the submission
+        :return: None if it is accepted, else (status code, Retry-After seconds):
+                 429 while the workers are draining the backlog, 503 when they
+                 have not finished anything recently
+        """
+        if not self.max_pending_documents and not self.max_pending_sentences:
+            return None
+        stats = self.stats()
+        excess_documents = (
+            stats.pending_documents + 1 - self.max_pending_documents
+            if self.max_pending_documents else 0
+        )
+        excess_sentences = (
+            stats.pending_sentences + sentence_count - self.max_pending_sentences
+            if self.max_pending_sentences else 0
+        )
+        if excess_documents <= 0 and excess_sentences <= 0:
+            return None
+
+        if not stats.documents_per_second:
+            return 503, self.max_retry_after
+        waits = [excess_documents / stats.documents_per_second]
+        if stats.sentences_per_second:
+            waits.append(excess_sentences / stats.sentences_per_second)
+        retry_after = min(self.max_retry_after, max(1, math.ceil(max(waits))))
+        return 429, retry_after
@@ -4,14 +4,18 @@ It allows users to submit text, which is then split into sentences and stored in
 Results can later be fetched if the analysis is complete.
 """
 
+import hashlib
 import os
+import re
+import threading
 import uuid
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, url_for
-from pymongo import MongoClient, errors
+from itertools import chain
+from flask import Flask, Response, render_template, request, jsonify, url_for
+from pymongo import MongoClient
 import nltk
 from nltk.tokenize import sent_tokenize
-from collections import defaultdict
+import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib
 import io
@@ -29,6 +33,8 @@ from email.mime.application import MIMEApplication
 from email.mime.text import MIMEText
 from wordcloud import WordCloud
 from werkzeug.exceptions import BadRequest  # Import BadRequest
+from admission import AdmissionController
+from job_store import ANALYZER_VERSION, STORAGE_ERRORS, open_job_store
 
 
 app = Flask(__name__)
@@ -41,8 +47,61 @@ mongo_uri = os.getenv("MONGO_URI")
 client = MongoClient(mongo_uri)  # Adjust the connection string if necessary
 db = client["sentiment"]  # Database name
 collection = db["texts"]  # Collection name
+# submissions are queued in MongoDB, or with STORAGE_BACKEND=sqlite in the embedded
+# database at SQLITE_PATH shared with the workers
+job_store = open_job_store(
+    os.getenv("STORAGE_BACKEND", "mongo"), collection, os.getenv("SQLITE_PATH", "jobs.sqlite3")
+)
 matplotlib.use('Agg')
 
+
+def bootstrap_indexes():
+    """
+    Create the indexes of the job store's lookups (unique request_id, status and
+    submission time, content hash, topic coherence) if they are missing.
+    """
+    try:
+        job_store.ensure_indexes()
+        print("Job store indexes are in place.")
+    except STORAGE_ERRORS as e:
+        print(f"Could not create the job store indexes: {e}")
+
+
+# at startup, in the background so a database that is still starting up does not
+# hold up the app; ENSURE_INDEXES=0 leaves index management to the operator
+if os.getenv("ENSURE_INDEXES", "1") == "1":
+    threading.Thread(target=bootstrap_indexes, name="bootstrap-indexes", daemon=True).start()
+
+# fields find_document needs to follow aliases and find sentence chunks
+LOOKUP_FIELDS = {"request_id": 1, "alias_of": 1, "overall_status": 1, "chunk_count": 1, "chunk_size": 1}
+# per-route projections, so routes do not read sentences they do not use
+STATUS_PROJECTION = LOOKUP_FIELDS
+EMOTIONS_PROJECTION = {**LOOKUP_FIELDS, "sentences.emotions": 1}
+# aggregates the worker stores on processed documents (see the ML client's
+# SentenceColumns.aggregates)
+INTENSITY_PROJECTION = {**LOOKUP_FIELDS, "aggregates.emotion_intensity": 1}
+# queue bookkeeping the client never reads
+RESULTS_PROJECTION = {"worker_id": 0, "lease_expires_at": 0, "claimed_at": 0, "attempts": 0, "content_hash": 0}
+
+_WHITESPACE = re.compile(r"\s+")
+
+# per-request size limits of /checkSentiment
+MAX_SUBMISSION_CHARS = int(os.getenv("MAX_SUBMISSION_CHARS", "500000"))
+MAX_SUBMISSION_SENTENCES = int(os.getenv("MAX_SUBMISSION_SENTENCES", "30000"))
+# submissions with more sentences are stored in chunks of this many sentences
+# instead of one document (see job_store.py); 0 keeps every submission in one document
+SENTENCE_CHUNK_SIZE = int(os.getenv("SENTENCE_CHUNK_SIZE", "0"))
+# submissions that would grow the pending backlog past these limits are refused
+# with a Retry-After estimate; 0 disables a limit
+admission = AdmissionController(
+    job_store,
+    max_pending_documents=int(os.getenv("ADMISSION_MAX_PENDING_DOCUMENTS", "1000")),
+    max_pending_sentences=int(os.getenv("ADMISSION_MAX_PENDING_SENTENCES", "500000")),
+    throughput_window_seconds=float(os.getenv("ADMISSION_THROUGHPUT_WINDOW_SECONDS", "300")),
+    cache_seconds=float(os.getenv("ADMISSION_CACHE_SECONDS", "2")),
+    max_retry_after=int(os.getenv("ADMISSION_MAX_RETRY_AFTER", "600")),
+)
+
 @app.route("/")
 def index():
     """Render the index page."""
@@ -53,11 +112,58 @@ def index():
 def handle_bad_request(e):
     return jsonify({"error": "Invalid input data."}), 400
 
+def content_hash(text):
+    """
+    Hash of a submission's text. Only whitespace is normalized, since case and
+    punctuation change the results.
+
+    :param text: Submitted text
+    :return: Hex digest
+    """
+    normalized = _WHITESPACE.sub(" ", text).strip()
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def find_document(request_id, projection=None):
+    """
+    Document of a request, following the alias of a deduplicated submission to
+    the document holding its results.
+
+    :param request_id: Request id returned by /checkSentiment
+    :param projection: Optional projection of the fields to read; an inclusion
+                       projection must include LOOKUP_FIELDS
+    :return: Document carrying the given request_id, or None
+    """
+    document = job_store.fetch(request_id, projection)
+    if document and document.get("alias_of"):
+        original = job_store.fetch(document["alias_of"], projection)
+        # alias_of stays, so the original's sentence chunks are found
+        document = {**original, "request_id": request_id, "alias_of": document["alias_of"]} if original else None
+    return document
+
+
+def iter_sentences(document, fields=None):
+    """
+    Sentence entries of a document, read one chunk at a time if it is chunked.
+
+    :param document: Document
+    :param fields: Sentence entry fields to read from chunks, None for all
+    :return: Iterator of sentence entries
+    """
+    return chain.from_iterable(job_store.iter_chunks(document, fields))
+
+
 @app.route("/checkSentiment", methods=["POST"])
 def submit_sentence():
     """
     Process the input sentence, split into individual sentences,
     and store them in MongoDB with a unique request_id.
+    A text that is already processed or queued under the same analyzer version
+    is not queued again: the new request_id is stored as an alias of the
+    existing document and resolves to its results.
+    Oversized submissions are refused with a 413; while the pending backlog is
+    over its limits submissions get a 429 (or a 503 if the workers are not
+    finishing anything) with a Retry-After header.
     """
     data = request.get_json()
     if not data:
@@ -66,12 +172,48 @@ def submit_sentence():
 
     if not paragraph:
         return jsonify({"error": "Input text is empty."}), 400
+    if len(paragraph) > MAX_SUBMISSION_CHARS:
+        return jsonify({"error": f"Input text is longer than {MAX_SUBMISSION_CHARS} characters."}), 413
 
     # Split paragraph into individual sentences
     sentences = sent_tokenize(paragraph)
+    if len(sentences) > MAX_SUBMISSION_SENTENCES:
+        return jsonify({"error": f"Input text has more than {MAX_SUBMISSION_SENTENCES} sentences."}), 413
 
     # Generate a unique request_id
     request_id = str(uuid.uuid4())
+    text_hash = content_hash(paragraph)
+
+    try:
+        existing = job_store.find_duplicate(text_hash, ANALYZER_VERSION)
+        if existing:
+            job_store.enqueue({
+                "request_id": request_id,
+                "alias_of": existing["request_id"],
+                "content_hash": text_hash,
+                "analyzer_version": ANALYZER_VERSION,
+                "overall_status": "alias",
+                "timestamp": datetime.now(),
+            })
+            print(f"Request {request_id} is an alias of {existing['request_id']}")
+            return jsonify({"request_id": request_id, "deduplicated": True})
+    except STORAGE_ERRORS as e:
+        print(f"Error looking up an identical submission: {e}")
+        return jsonify({"error": "Database insertion error."}), 500
+
+    try:
+        refusal = admission.check(len(sentences))
+    except STORAGE_ERRORS as e:
+        # the insert below reports a database that is down
+        print(f"Error counting the pending queue: {e}")
+        refusal = None
+    if refusal:
+        status, retry_after = refusal
+        return (
+            jsonify({"error": "Too many pending analyses, please retry later.", "retry_after": retry_after}),
+            status,
+            {"Retry-After": str(retry_after)},
+        )
 
     # Create sentence entries with status "pending" and analysis as null
     sentence_entries = [
@@ -85,12 +227,17 @@ def submit_sentence():
         "sentences": sentence_entries,
         "overall_status": "pending",
         "timestamp": datetime.now(),
+        # the worker claims small submissions first
+        "sentence_count": len(sentences),
+        "char_count": len(paragraph),
+        "content_hash": text_hash,
+        "analyzer_version": ANALYZER_VERSION,
     }
 
     try:
-        # Insert into MongoDB
-        result = collection.insert_one(document)
-        print("Inserted Document ID:", result.inserted_id)
+        # Insert into the job store
+        document_id = job_store.enqueue(document, chunk_size=SENTENCE_CHUNK_SIZE)
+        print("Inserted Document ID:", document_id)
     except Exception as e:
         print(f"Error inserting document: {e}")
         return jsonify({"error": "Database insertion error."}), 500
@@ -100,26 +247,172 @@ def submit_sentence():
 
 
 
+# result fields returned while a document is still being processed
+PARTIAL_RESULT_FIELDS = [
+    "sentences", "sentiment_trend", "overall_emotions", "summary", "summary_sentences", "topics",
+]
+
+# same emotion bit order as the ML client's emotion codes
+EMOTION_LABELS = ["Happy", "Angry", "Surprise", "Sad", "Fear", "Neutral"]
+EMOTION_BITS = {label: 1 << bit for bit, label in enumerate(EMOTION_LABELS)}
+# bins of the compound score histogram over [-1, 1], as stored by the ML client
+COMPOUND_BINS = 20
+
+
+def sentence_columns(sentences):
+    """
+    Columnar view of the sentence results for the charts: compound scores in one
+    array, emotions as bitmask codes over EMOTION_LABELS and entities as ids into
+    a table of distinct (text, label) pairs. The entries are read once, so they
+    can come lazily from a chunked document.
+
+    :param sentences: Iterable of stored sentence entries
+    :return: Dict of column name to array or list
+    """
+    entity_ids = {}
+    texts, compound, analysed, emotions, entities = [], [], [], [], []
+    for sentence in sentences:
+        analysis = sentence.get("analysis")
+        texts.append(sentence.get("sentence", ""))
+        compound.append((analysis or {}).get("compound", 0.0))
+        analysed.append(bool(analysis))
+        emotions.append(sum(EMOTION_BITS.get(emotion, 0) for emotion in set(sentence.get("emotions") or [])))
+        entities.append([
+            entity_ids.setdefault((entity.get("text", ""), entity.get("label", "")), len(entity_ids))
+            for entity in sentence.get("entities") or []
+        ])
+    return {
+        "texts": texts,
+        "compound": np.array(compound, dtype=float),
+        "analysed": np.array(analysed, dtype=bool),
+        "emotions": np.array(emotions, dtype=np.uint8),
+        "entity_table": [list(entity) for entity in entity_ids],
+        "entities": entities,
+    }
+
+
+def emotion_counts(emotion_codes):
+    """
+    Number of sentences with each emotion among their dominant ones.
+
+    :param emotion_codes: Array of emotion bitmask codes
+    :return: Array of counts in EMOTION_LABELS order
+    """
+    bits = (emotion_codes[:, None] >> np.arange(len(EMOTION_LABELS), dtype=np.uint8)) & 1
+    return bits.sum(axis=0)
+
+
+def columns_payload(sentences):
+    """
+    JSON form of sentence_columns, sent instead of the sentence entries.
+
+    :param sentences: Iterable of stored sentence entries
+    :return: Dict of JSON-serializable columns
+    """
+    columns = sentence_columns(sentences)
+    return {
+        **columns,
+        "compound": columns["compound"].tolist(),
+        "analysed": columns["analysed"].tolist(),
+        "emotions": columns["emotions"].tolist(),
+        "emotion_labels": EMOTION_LABELS,
+    }
+
+
+def response_results(results, columns):
+    """
+    Results of a document for the client, with the sentences as columns if asked.
+
+    :param results: Dict of result fields
+    :param columns: Send "columns" instead of "sentences"
+    :return: Dict
+    """
+    if columns and "sentences" in results:
+        results = {**results, "columns": columns_payload(results["sentences"])}
+        del results["sentences"]
+    return results
+
+
+def stream_results(results, chunks):
+    """
+    JSON of the results with the sentence entries written out chunk by chunk.
+
+    :param results: Dict of result fields without "sentences"
+    :param chunks: Iterable of lists of sentence entries
+    :return: Iterator of JSON text
+    """
+    head = app.json.dumps(results)
+    yield head[:-1] + (", " if results else "") + '"sentences": ['
+    first = True
+    for sentences in chunks:
+        if sentences:
+            yield ("" if first else ", ") + ", ".join(app.json.dumps(entry) for entry in sentences)
+            first = False
+    yield "]}"
+
+
+def results_response(results, columns, document=None, status=200):
+    """
+    Response with the results of a document. The sentences of a chunked document
+    are read one chunk at a time: into columns, or streamed as entries.
+
+    :param results: Dict of result fields
+    :param columns: Send "columns" instead of "sentences"
+    :param document: Document whose sentences are sent, if it may be chunked
+    :param status: HTTP status
+    :return: Response
+    """
+    if not document or not document.get("chunk_count"):
+        return jsonify(response_results(results, columns)), status
+    if columns:
+        return jsonify(response_results({**results, "sentences": iter_sentences(document)}, columns)), status
+    return Response(
+        stream_results(results, job_store.iter_chunks(document)), status=status, mimetype="application/json"
+    )
+
+
 @app.route("/get_analysis", methods=["GET"])
 def get_analysis():
     """
     Fetch the sentiment analysis result for a given request_id.
-    Returns both processed and error documents.
+    Returns both processed and error documents. While the document is still being
+    processed, the results of the stages completed so far are returned with a 202
+    and the list of completed_stages. With format=columns the per-sentence results
+    are sent as the arrays of columns_payload instead of "sentences". The sentences
+    of a chunked document are read chunk by chunk while the response is sent.
     """
     request_id = request.args.get("request_id")
+    columns = request.args.get("format") == "columns"
     print(f"Received request to get analysis for request_id: {request_id}")
 
-    document = collection.find_one({"request_id": request_id})
+    document = find_document(request_id, RESULTS_PROJECTION)
     if document:
-        print("Document found:", document)
+        print("Document found:", document.get("request_id"), document.get("overall_status"))
         document["_id"] = str(document["_id"])
         if document.get("overall_status") == "processed":
-            return jsonify(document)
+            return results_response(document, columns, document)
         elif document.get("overall_status") == "error":
             return jsonify({"error": document.get("error_message", "Processing error.")}), 400
         else:
+            # the worker publishes each group of results as soon as it is ready
             print("Document not yet processed.")
-            return jsonify({"message": "Analysis not yet complete."}), 202
+            completed_stages = document.get("completed_stages", [])
+            partial = {
+                field: document[field] for field in PARTIAL_RESULT_FIELDS if field in document
+            } if completed_stages else {}
+            return results_response(
+                {
+                    "message": "Analysis not yet complete.",
+                    "request_id": request_id,
+                    "overall_status": document.get("overall_status"),
+                    "completed_stages": completed_stages,
+                    **partial,
+                },
+                columns,
+                # sentence results are published to the chunks with the first stage
+                document if completed_stages else None,
+                202,
+            )
     print("No analysis found for request_id:", request_id)
     return jsonify({"message": "No analysis found"}), 404
 
@@ -128,32 +421,48 @@ def get_analysis():
 def get_emtion_intensity(request_id):
     """
     Calculate the intensity of each emotion for the given document and return the result as JSON.
+    The worker stores it on processed documents; it is only counted here for
+    documents processed before that, or still being processed.
     """
-    document = collection.find_one({"request_id": request_id})
+    document = find_document(request_id, INTENSITY_PROJECTION)
+    if document and "emotion_intensity" in document.get("aggregates", {}):
+        return jsonify(document["aggregates"]["emotion_intensity"])
 
+    document = find_document(request_id, EMOTIONS_PROJECTION)
     if not document:
         return jsonify({"error": "Document not found"}), 404
     
-    # caculate emotion intensity
-    emotion_intensity = defaultdict(float)
-    for sentence in document.get("sentences", []):
-        emotions = sentence.get("emotions", [])
-        for emotion in emotions:
-            emotion_intensity[emotion] += 1
-    
-    # normalize the values by the total number of sentences to get average intensity
-    total_sentences = len(document.get("sentences", []))
-    if total_sentences > 0:
-        emotion_intensity = {k: v / total_sentences for k, v in emotion_intensity.items()}
+    # caculate emotion intensity: average number of sentences with each emotion
+    codes = sentence_columns(iter_sentences(document, ["emotions"]))["emotions"]
+    emotion_intensity = {}
+    if len(codes) > 0:
+        emotion_intensity = {
+            label: int(count) / len(codes)
+            for label, count in zip(EMOTION_LABELS, emotion_counts(codes))
+            if count
+        }
 
     return jsonify(emotion_intensity)
 
+
+@app.route("/model_quality", methods=["GET"])
+def get_model_quality():
+    """
+    Return the model-quality diagnostics stored by the ML client's background job:
+    the most recent topic model versions and the topic coherence of processed documents.
+    """
+    limit = request.args.get("limit", 20, type=int)
+    return jsonify(job_store.model_quality_summary(limit))
+
 # ----- PDF Generation Functions -----
 def generate_plots(document):
     """
     Generate all the plots using matplotlib and return them as images.
     """
     images = {}
+    columns = sentence_columns(iter_sentences(document))
+    # counts and histogram stored by the worker, computed here for older documents
+    aggregates = document.get('aggregates') or {}
 
     # Sentiment Trend Line Plot
     try:
@@ -180,11 +489,16 @@ def generate_plots(document):
 
     # Sentiment Distribution Histogram
     try:
-        sentences = document.get('sentences', [])
-        compound_scores = [s['analysis']['compound'] for s in sentences if s.get('analysis')]
-        if compound_scores:
+        histogram = aggregates.get('compound_histogram')
+        if histogram:
+            counts, edges = np.array(histogram['counts']), np.array(histogram['edges'])
+        else:
+            counts, edges = np.histogram(
+                columns['compound'][columns['analysed']], bins=COMPOUND_BINS, range=(-1.0, 1.0)
+            )
+        if counts.sum() > 0:
             plt.figure(figsize=(8, 4))
-            plt.hist(compound_scores, bins=20, color='blue', edgecolor='black')
+            plt.hist(edges[:-1], bins=edges, weights=counts, color='blue', edgecolor='black')
             plt.title('Sentiment Distribution')
             plt.xlabel('Compound Score')
             plt.ylabel('Frequency')
@@ -231,16 +545,16 @@ def generate_plots(document):
 
     # Overall Emotions Pie Chart
     try:
-        sentences = document.get('sentences', [])
-        emotion_counts = defaultdict(int)
-        for sentence in sentences:
-            emotions = sentence.get('emotions', [])
-            for emotion in emotions:
-                emotion_counts[emotion] += 1
-
-        if emotion_counts:
-            labels = list(emotion_counts.keys())
-            sizes = [emotion_counts[label] for label in labels]
+        counts = aggregates.get('emotion_counts')
+        if counts is None:
+            counts = {
+                label: int(count)
+                for label, count in zip(EMOTION_LABELS, emotion_counts(columns['emotions']))
+                if count
+            }
+        if counts:
+            labels = list(counts)
+            sizes = list(counts.values())
 
             plt.figure(figsize=(6, 6))
             plt.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=140)
@@ -256,11 +570,10 @@ def generate_plots(document):
 
     # Sentiment Intensity Bar Chart
     try:
-        sentences = document.get('sentences', [])
-        sentence_indices = list(range(1, len(sentences) + 1))
-        compound_scores = [s['analysis']['compound'] for s in sentences if s.get('analysis')]
+        compound_scores = columns['compound']
+        sentence_indices = np.arange(1, len(compound_scores) + 1)
 
-        if compound_scores:
+        if columns['analysed'].any():
             plt.figure(figsize=(8, 4))
             plt.bar(sentence_indices, compound_scores, color='skyblue')
             plt.title('Sentiment Intensity per Sentence')
@@ -278,19 +591,14 @@ def generate_plots(document):
 
     # Emotional Shifts Area Chart
     try:
-        sentences = document.get('sentences', [])
-        emotion_types = ["Happy", "Angry", "Surprise", "Sad", "Fear", "Neutral"]
-        emotion_data = {emotion: [] for emotion in emotion_types}
-        sentence_indices = list(range(1, len(sentences) + 1))
+        codes = columns['emotions']
+        sentence_indices = np.arange(1, len(codes) + 1)
+        # one 0/1 row per emotion
+        emotion_data = (codes[None, :] >> np.arange(len(EMOTION_LABELS), dtype=np.uint8)[:, None]) & 1
 
-        for sentence in sentences:
-            emotions = sentence.get('emotions', [])
-            for emotion in emotion_types:
-                emotion_data[emotion].append(1 if emotion in emotions else 0)
-
-        if sentences:
+        if len(codes) > 0:
             plt.figure(figsize=(8, 4))
-            plt.stackplot(sentence_indices, *[emotion_data[emotion] for emotion in emotion_types], labels=emotion_types)
+            plt.stackplot(sentence_indices, *emotion_data, labels=EMOTION_LABELS)
             plt.title('Emotional Shifts Over Sentences')
             plt.xlabel('Sentence Index')
             plt.ylabel('Emotion Intensity')
@@ -342,7 +650,7 @@ def create_pdf(document, images):
 
     # Add Named Entities Table
     try:
-        sentences = document.get('sentences', [])
+        sentences = iter_sentences(document)
         data_for_table = []
 
         # Define a style for the table cells
@@ -407,7 +715,7 @@ def view_results(request_id):
     """
     Render the analysis results as an HTML page for PDF generation.
     """
-    document = collection.find_one({"request_id": request_id})
+    document = find_document(request_id, STATUS_PROJECTION)
     if not document or document.get("overall_status") != "processed":
         return "Results not available.", 404
 
@@ -421,7 +729,8 @@ def view_results(request_id):
 
 @app.route("/send_pdf/<string:request_id>", methods=["GET", "POST"])
 def send_pdf(request_id):
-    document = collection.find_one({"request_id": request_id})
+    # the full document is only read once the PDF is generated
+    document = find_document(request_id, STATUS_PROJECTION)
     if not document or document.get("overall_status") != "processed":
         return "Results not available.", 404
     if request.method == "POST":
@@ -429,7 +738,7 @@ def send_pdf(request_id):
         if not email:
             return "Email address is required.", 400
 
-        document = collection.find_one({"request_id": request_id})
+        document = find_document(request_id)
         if not document or document.get("overall_status") != "processed":
             return "Results not available.", 404
 
@@ -2,8 +2,14 @@
 This module contains shared fixtures for pytest, such as the test client for the Flask app.
 """
 
+import os
+
 import pytest
-from app import app
+
+# the tests do not reach a database, so the app does not create indexes at import
+os.environ.setdefault("ENSURE_INDEXES", "0")
+
+from app import app  # pylint: disable=wrong-import-position
 
 
 @pytest.fixture
@@ -24,7 +24,9 @@ function analyzeSentence() {
     .then(response => {
         if (!response.ok) {
             return response.json().then(data => {
-                throw new Error(data.error || 'An error occurred');
+                // the server is refusing new work for now (429/503)
+                const retryAfter = data.retry_after ? ` Try again in ${data.retry_after} seconds.` : '';
+                throw new Error((data.error || 'An error occurred') + retryAfter);
             });
         }
         return response.json();
@@ -32,7 +34,7 @@ function analyzeSentence() {
     .then(data => {
         const requestId = data.request_id;
         // Keep checking until the analysis is available
-        fetchAnalysisWithRetry(requestId, 10);  // Max retries: 10
+        fetchAnalysisWithRetry(requestId, MAX_RETRIES);
     })
     .catch(error => {
         console.error('Error:', error);
@@ -92,8 +94,16 @@ function startDictation() {
     }
 }
 
+// Result groups the worker publishes as they complete, fastest first
+const ALL_STAGES = ["sentiment", "emotions", "entities", "summary", "topics"];
+const MAX_RETRIES = 20;
+const MIN_POLL_DELAY = 500;   // first poll after half a second
+const MAX_POLL_DELAY = 5000;  // back off to 5 seconds while nothing changes
+
 // Function to fetch analysis with retries
-function fetchAnalysisWithRetry(requestId, retries) {
+// Partial results are rendered as soon as new stages complete, and every
+// completed stage resets the retry budget and the polling delay.
+function fetchAnalysisWithRetry(requestId, retries, delay = MIN_POLL_DELAY, renderedStages = []) {
     if (retries <= 0) {
         console.error("Failed to retrieve analysis after multiple attempts");
         showToast("Analysis failed or is taking too long. Please try again later.");
@@ -103,7 +113,7 @@ function fetchAnalysisWithRetry(requestId, retries) {
     }
 
     setTimeout(() => {
-        fetch(`/get_analysis?request_id=${requestId}`)
+        fetch(`/get_analysis?request_id=${requestId}&format=columns`)
             .then(response => {
                 if (!response.ok) {
                     return response.json().then(data => {
@@ -114,13 +124,19 @@ function fetchAnalysisWithRetry(requestId, retries) {
             })
             .then(data => {
                 if (data.message) {
-                    console.error(data.message);
-                    // Retry if no analysis found yet
-                    fetchAnalysisWithRetry(requestId, retries - 1);
+                    const completed = data.completed_stages || [];
+                    const nextDelay = Math.min(delay * 2, MAX_POLL_DELAY);
+                    if (completed.length > renderedStages.length) {
+                        // show what is ready and keep polling for the rest
+                        visualizeResults(data, completed);
+                        fetchAnalysisWithRetry(requestId, MAX_RETRIES, MIN_POLL_DELAY, completed);
+                    } else {
+                        console.log(data.message);
+                        fetchAnalysisWithRetry(requestId, retries - 1, nextDelay, renderedStages);
+                    }
                 } else {
                     // Pass the data to visualization functions
-                    visualizeResults(data);
-                    document.getElementById('uploadMessage').classList.add('d-none'); // Hide upload message
+                    visualizeResults(data, data.completed_stages || ALL_STAGES);
                     document.getElementById('loadingSpinner').classList.add('d-none'); // Hide loading spinner
                 }
             })
@@ -130,7 +146,7 @@ function fetchAnalysisWithRetry(requestId, retries) {
                 document.getElementById('uploadMessage').classList.add('d-none');
                 document.getElementById('loadingSpinner').classList.add('d-none');
             });
-    }, 5000);  // Retry interval set to 5 seconds
+    }, delay);
 }
 
 function updateGeneratePdfButton(requestId) {
@@ -141,29 +157,72 @@ function updateGeneratePdfButton(requestId) {
     }
 }
 
-// Function to visualize all results
-function visualizeResults(data) {
+// Per-sentence results as columns: compound scores, emotion bitmask codes over
+// emotion_labels and entity ids into entity_table. The server sends them with
+// format=columns; responses with sentence entries are converted here.
+function sentenceColumns(data) {
+    if (data.columns) {
+        return data.columns;
+    }
+    const emotionLabels = ["Happy", "Angry", "Surprise", "Sad", "Fear", "Neutral"];
+    const entityIds = new Map();
+    const entityTable = [];
+    const sentences = data.sentences || [];
+    return {
+        texts: sentences.map(sentence => sentence.sentence),
+        compound: sentences.map(sentence => (sentence.analysis ? sentence.analysis.compound : 0)),
+        analysed: sentences.map(sentence => Boolean(sentence.analysis)),
+        emotion_labels: emotionLabels,
+        emotions: sentences.map(sentence => (sentence.emotions || []).reduce(
+            (code, emotion) => code | (emotionLabels.includes(emotion) ? 1 << emotionLabels.indexOf(emotion) : 0), 0
+        )),
+        entity_table: entityTable,
+        entities: sentences.map(sentence => (sentence.entities || []).map(entity => {
+            const key = `${entity.label}\u0000${entity.text}`;
+            if (!entityIds.has(key)) {
+                entityIds.set(key, entityTable.length);
+                entityTable.push([entity.text, entity.label]);
+            }
+            return entityIds.get(key);
+        }))
+    };
+}
+
+// Function to visualize the results of the completed stages
+function visualizeResults(data, completedStages = ALL_STAGES) {
     window.request_id = data.request_id;
-    document.querySelector('.results-section').classList.remove('d-none');
-    updateGeneratePdfButton(window.request_id);
-    // Hide the upload message and loading spinner
+    const finished = data.overall_status === "processed";
+    if (finished) {
+        updateGeneratePdfButton(window.request_id);
+        document.getElementById('loadingSpinner').classList.add('d-none');
+    }
+    // Hide the upload message
     document.getElementById('uploadMessage').classList.add('d-none');
-    document.getElementById('loadingSpinner').classList.add('d-none');
 
     // Show the results section
     document.querySelector('.results-section').classList.remove('d-none');
 
-    // Visualization functions
-    displaySummary(data);
-    visualizeTopics(data);
-    visualizeOverallEmotions(data);
-    visualizeSentimentTrend(data);
-    visualizeSentimentIntensity(data);
-    visualizeSentimentDistribution(data);
-    visualizeEmotionalShifts(data);
-    visualizeEntities(data);
-
-    window.graphsRendered = true;
+    // Visualization functions, for the stages whose results are in
+    if (completedStages.includes("sentiment")) {
+        visualizeSentimentTrend(data);
+        visualizeSentimentIntensity(data);
+        visualizeSentimentDistribution(data);
+    }
+    if (completedStages.includes("emotions")) {
+        visualizeOverallEmotions(data);
+        visualizeEmotionalShifts(data);
+    }
+    if (completedStages.includes("entities")) {
+        visualizeEntities(data);
+    }
+    if (completedStages.includes("summary")) {
+        displaySummary(data);
+    }
+    if (completedStages.includes("topics")) {
+        visualizeTopics(data);
+    }
+
+    window.graphsRendered = finished;
 }
 
 
@@ -228,13 +287,12 @@ function visualizeTopics(data) {
 
 // Function to visualize overall emotions using a pie chart
 function visualizeOverallEmotions(data) {
-    const sentences = data.sentences;
+    const compoundScores = sentenceColumns(data).compound;
 
     // Classify each sentence based on the compound score
     const sentimentCounts = { Positive: 0, Negative: 0, Neutral: 0 };
 
-    sentences.forEach(sentence => {
-        const compoundScore = sentence.analysis.compound;
+    compoundScores.forEach(compoundScore => {
         if (compoundScore >= 0.05) {
             sentimentCounts.Positive += 1;
         } else if (compoundScore <= -0.05) {
@@ -244,7 +302,7 @@ function visualizeOverallEmotions(data) {
         }
     });
 
-    const totalSentences = sentences.length;
+    const totalSentences = compoundScores.length;
     const pieData = [
         { sentiment: 'Positive', count: sentimentCounts.Positive },
         { sentiment: 'Negative', count: sentimentCounts.Negative },
@@ -425,9 +483,8 @@ function visualizeSentimentTrend(data) {
 
 // Function to visualize sentiment intensity per sentence using a bar chart
 function visualizeSentimentIntensity(data) {
-    const sentences = data.sentences;
-    const sentenceIndices = sentences.map((_, i) => i + 1); // Start from 1
-    const compoundScores = sentences.map(sentence => sentence.analysis.compound);
+    const compoundScores = sentenceColumns(data).compound;
+    const sentenceIndices = compoundScores.map((_, i) => i + 1); // Start from 1
 
     // Get container dimensions
     const container = document.getElementById('sentimentIntensity');
@@ -524,7 +581,8 @@ function visualizeSentimentIntensity(data) {
 
 // Function to visualize sentiment distribution using a histogram
 function visualizeSentimentDistribution(data) {
-    const compoundScores = data.sentences.map(sentence => sentence.analysis.compound);
+    const columns = sentenceColumns(data);
+    const compoundScores = columns.compound.filter((_, i) => columns.analysed[i]);
 
     // Get container dimensions
     const container = document.getElementById('sentimentDistribution');
@@ -615,15 +673,14 @@ function visualizeSentimentDistribution(data) {
 
 // Function to visualize emotional shifts using a stacked area chart
 function visualizeEmotionalShifts(data) {
-    const sentences = data.sentences;
-    const emotionTypes = ["Happy", "Angry", "Surprise", "Sad", "Fear", "Neutral"];
+    const columns = sentenceColumns(data);
+    const emotionTypes = columns.emotion_labels;
     const emotionData = [];
 
-    sentences.forEach((sentence, index) => {
-        const emotions = sentence.emotions;
+    columns.emotions.forEach((code, index) => {
         const emotionCounts = { sentence_index: index + 1 };
-        emotionTypes.forEach(emotion => {
-            emotionCounts[emotion] = emotions.includes(emotion) ? 1 : 0;
+        emotionTypes.forEach((emotion, bit) => {
+            emotionCounts[emotion] = (code >> bit) & 1;
         });
         emotionData.push(emotionCounts);
     });
@@ -652,7 +709,7 @@ function visualizeEmotionalShifts(data) {
 
     // Create scales
     const x = d3.scaleLinear()
-        .domain([1, sentences.length])
+        .domain([1, columns.emotions.length])
         .range([0, chartAreaWidth]);
 
     const y = d3.scaleLinear()
@@ -728,7 +785,7 @@ function visualizeEmotionalShifts(data) {
 
 // Function to visualize Named Entities in a table format
 function visualizeEntities(data) {
-    const sentences = data.sentences;
+    const columns = sentenceColumns(data);
 
     // Remove existing content
     const entitiesContainer = document.getElementById('entities');
@@ -760,12 +817,11 @@ function visualizeEntities(data) {
     // Create table body
     const tbody = document.createElement('tbody');
 
-    sentences.forEach((sentenceEntry, index) => {
-        const sentenceText = sentenceEntry.sentence;
-        const entities = sentenceEntry.entities;
+    columns.texts.forEach((sentenceText, index) => {
+        const entities = columns.entities[index].map(entityId => columns.entity_table[entityId]);
 
-        if (entities && entities.length > 0) {
-            entities.forEach(entity => {
+        if (entities.length > 0) {
+            entities.forEach(([entityText, entityLabel]) => {
                 const row = document.createElement('tr');
 
                 const sentenceCell = document.createElement('td');
@@ -773,11 +829,11 @@ function visualizeEntities(data) {
                 row.appendChild(sentenceCell);
 
                 const entityCell = document.createElement('td');
-                entityCell.innerText = entity.text;
+                entityCell.innerText = entityText;
                 row.appendChild(entityCell);
 
                 const attributeCell = document.createElement('td');
-                attributeCell.innerText = entity.label;
+                attributeCell.innerText = entityLabel;
                 row.appendChild(attributeCell);
 
                 tbody.appendChild(row);
@@ -0,0 +1,71 @@
+"""
+Unit tests for the admission control of new submissions.
+"""
+
+from unittest.mock import MagicMock
+
+from admission import AdmissionController, QueueStats
+
+
+def controller(stats, **limits):
+    """Controller whose counts are the given stats."""
+    admission = AdmissionController(MagicMock(), **limits)
+    admission.count = MagicMock(return_value=stats)
+    return admission
+
+
+def test_check_accepts_below_limits():
+    """Test that submissions are accepted while the backlog is under its limits."""
+    admission = controller(
+        QueueStats(pending_documents=5, pending_sentences=100),
+        max_pending_documents=10, max_pending_sentences=1000,
+    )
+    assert admission.check(sentence_count=900) is None
+
+
+def test_check_refuses_with_retry_after():
+    """Test that the Retry-After covers the time to drain the excess."""
+    admission = controller(
+        QueueStats(pending_documents=5, pending_sentences=1000,
+                   documents_per_second=1.0, sentences_per_second=10.0),
+        max_pending_documents=10, max_pending_sentences=1000,
+    )
+    # 250 sentences over the limit at 10 sentences per second
+    assert admission.check(sentence_count=250) == (429, 25)
+
+
+def test_check_refuses_with_service_unavailable_without_throughput():
+    """Test that a full backlog nobody is draining gives a 503."""
+    admission = controller(
+        QueueStats(pending_documents=10), max_pending_documents=10, max_retry_after=120,
+    )
+    assert admission.check(sentence_count=1) == (503, 120)
+
+
+def test_check_without_limits_does_not_count():
+    """Test that the queue is not counted when no limit is set."""
+    admission = controller(QueueStats())
+    assert admission.check(sentence_count=10 ** 6) is None
+    admission.count.assert_not_called()
+
+
+def test_stats_are_cached():
+    """Test that the queue is counted once per cache period."""
+    admission = controller(QueueStats(), cache_seconds=60)
+    assert admission.stats() is admission.stats()
+    assert admission.count.call_count == 1
+
+
+def test_count_converts_store_counts_to_rates():
+    """Test that backlog and throughput come from one job store query."""
+    store = MagicMock()
+    store.queue_stats.return_value = {
+        "pending_documents": 3,
+        "pending_sentences": 40,
+        "processed_documents": 60,
+        "processed_sentences": 600,
+    }
+    stats = AdmissionController(store, throughput_window_seconds=60).count()
+    assert (stats.pending_documents, stats.pending_sentences) == (3, 40)
+    assert (stats.documents_per_second, stats.sentences_per_second) == (1.0, 10.0)
+    store.queue_stats.assert_called_once()
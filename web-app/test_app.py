@@ -6,13 +6,17 @@ import json
 from unittest.mock import patch
 import io
 from pymongo import errors
-from app import generate_plots
+from app import generate_plots, sentence_columns, emotion_counts, content_hash, ANALYZER_VERSION
+from app import bootstrap_indexes, EMOTIONS_PROJECTION, STATUS_PROJECTION, RESULTS_PROJECTION
+from app import INTENSITY_PROJECTION
 from app import create_pdf
 import datetime
 from unittest.mock import patch
 from app import send_email_with_pdf
+from job_store import SQLiteJobStore
 from datetime import datetime
 import warnings
+import matplotlib.pyplot as plt
 
 # Test the index route
 def test_index(test_client):
@@ -23,8 +27,10 @@ def test_index(test_client):
 
 
 # Test the /checkSentiment route
+@patch("app.admission.check", return_value=None)
+@patch("app.collection.find_one", return_value=None)
 @patch("app.collection.insert_one")
-def test_submit_sentence(mock_insert, test_client):
+def test_submit_sentence(mock_insert, _mock_find, _mock_check, test_client):
     """Test if the /checkSentiment route handles valid input correctly."""
     # Mock the insertion to prevent actual MongoDB interaction
     mock_insert.return_value.inserted_id = "fake_id"
@@ -38,6 +44,87 @@ def test_submit_sentence(mock_insert, test_client):
     response_data = response.get_json()
     assert "request_id" in response_data
     assert isinstance(response_data["request_id"], str)
+    document = mock_insert.call_args.args[0]
+    assert document["sentence_count"] == 2
+    assert document["char_count"] == len(data["sentence"])
+    assert document["content_hash"] == content_hash(data["sentence"])
+    assert document["analyzer_version"] == ANALYZER_VERSION
+
+
+@patch("app.admission.check", return_value=(429, 30))
+@patch("app.collection.find_one", return_value=None)
+@patch("app.collection.insert_one")
+def test_submit_sentence_backpressure(mock_insert, _mock_find, _mock_check, test_client):
+    """Test if the /checkSentiment route refuses work while the queue is full."""
+    data = {"sentence": "This is a test paragraph."}
+    response = test_client.post(
+        "/checkSentiment", data=json.dumps(data), content_type="application/json"
+    )
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+    assert response.get_json()["retry_after"] == 30
+    mock_insert.assert_not_called()
+
+
+@patch("app.MAX_SUBMISSION_SENTENCES", 1)
+@patch("app.collection.insert_one")
+def test_submit_sentence_too_large(mock_insert, test_client):
+    """Test if the /checkSentiment route enforces the size limits."""
+    data = {"sentence": "This is a test paragraph. It contains multiple sentences."}
+    response = test_client.post(
+        "/checkSentiment", data=json.dumps(data), content_type="application/json"
+    )
+
+    assert response.status_code == 413
+    assert "more than 1 sentences" in response.get_json()["error"]
+    mock_insert.assert_not_called()
+
+
+@patch("app.admission.check")
+@patch("app.collection.find_one")
+@patch("app.collection.insert_one")
+def test_submit_sentence_deduplicates(mock_insert, mock_find, mock_check, test_client):
+    """Test if an identical submission is aliased to the existing document."""
+    mock_find.return_value = {"_id": "fake_id", "request_id": "original_request_id"}
+    data = {"sentence": "This is a test   paragraph."}
+    response = test_client.post(
+        "/checkSentiment", data=json.dumps(data), content_type="application/json"
+    )
+
+    assert response.status_code == 200
+    assert response.get_json()["deduplicated"] is True
+    query = mock_find.call_args.args[0]
+    assert query["content_hash"] == content_hash("This is a test paragraph.")
+    assert query["analyzer_version"] == ANALYZER_VERSION
+    alias = mock_insert.call_args.args[0]
+    assert alias["alias_of"] == "original_request_id"
+    assert alias["overall_status"] == "alias"
+    assert "sentences" not in alias
+    mock_check.assert_not_called()
+
+
+@patch("app.collection.find_one")
+def test_get_analysis_follows_alias(mock_find, test_client):
+    """Test if the request_id of a deduplicated submission resolves to the original results."""
+    original = {
+        "_id": "fake_id",
+        "request_id": "original_request_id",
+        "sentences": [{"sentence": "This is a test.", "analysis": {"compound": 0.5}}],
+        "overall_status": "processed",
+    }
+    mock_find.side_effect = lambda query, projection=None: {
+        "alias_request_id": {"_id": "alias_id", "request_id": "alias_request_id",
+                             "alias_of": "original_request_id", "overall_status": "alias"},
+        "original_request_id": original,
+    }.get(query["request_id"])
+
+    response = test_client.get("/get_analysis?request_id=alias_request_id")
+
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert response_data["request_id"] == "alias_request_id"
+    assert response_data["sentences"] == original["sentences"]
 
 
 # Test the /checkSentiment route with an empty input
@@ -85,6 +172,162 @@ def test_get_analysis(mock_find, test_client):
     assert response_data["overall_status"] == "processed"
 
 
+@patch("app.collection.find_one")
+def test_get_analysis_partial(mock_find, test_client):
+    """Test if the /get_analysis route returns the stages that already completed."""
+    mock_find.return_value = {
+        "_id": "fake_id",
+        "request_id": "unique_request_id",
+        "sentences": [{"sentence": "This is a test.", "analysis": {"compound": 0.5}}],
+        "sentiment_trend": [0.5],
+        "overall_status": "processing",
+        "completed_stages": ["sentiment"],
+    }
+
+    response = test_client.get("/get_analysis?request_id=unique_request_id")
+
+    assert response.status_code == 202
+    response_data = response.get_json()
+    assert response_data["completed_stages"] == ["sentiment"]
+    assert response_data["sentiment_trend"] == [0.5]
+    assert "summary" not in response_data
+
+
+@patch("app.collection.find_one")
+def test_get_analysis_pending(mock_find, test_client):
+    """Test if the /get_analysis route holds back results while no stage completed."""
+    mock_find.return_value = {
+        "_id": "fake_id",
+        "request_id": "unique_request_id",
+        "sentences": [{"sentence": "This is a test.", "status": "pending", "analysis": None}],
+        "overall_status": "pending",
+    }
+
+    response = test_client.get("/get_analysis?request_id=unique_request_id")
+
+    assert response.status_code == 202
+    response_data = response.get_json()
+    assert response_data["message"] == "Analysis not yet complete."
+    assert response_data["completed_stages"] == []
+    assert "sentences" not in response_data
+
+
+def test_sentence_columns():
+    """Test the columnar view of the sentence results used by the charts."""
+    columns = sentence_columns([
+        {
+            "sentence": "Obama visited Paris.",
+            "analysis": {"compound": 0.4},
+            "emotions": ["Happy", "Surprise"],
+            "entities": [{"text": "Obama", "label": "PERSON"}, {"text": "Paris", "label": "GPE"}],
+        },
+        {"sentence": "Paris again.", "analysis": {"compound": -0.1}, "emotions": ["Neutral"],
+         "entities": [{"text": "Paris", "label": "GPE"}]},
+        {"sentence": "Pending.", "analysis": None},
+    ])
+
+    assert columns["compound"].tolist() == [0.4, -0.1, 0.0]
+    assert columns["analysed"].tolist() == [True, True, False]
+    assert columns["emotions"].tolist() == [0b101, 0b100000, 0]
+    assert emotion_counts(columns["emotions"]).tolist() == [1, 0, 1, 0, 0, 1]
+    assert columns["entity_table"] == [["Obama", "PERSON"], ["Paris", "GPE"]]
+    assert columns["entities"] == [[0, 1], [1], []]
+    assert sentence_columns(iter([{"sentence": "Once.", "analysis": {"compound": 0.2}}]))["compound"].tolist() == [0.2]
+
+
+@patch("app.collection.find_one")
+def test_get_analysis_columns(mock_find, test_client):
+    """Test if the /get_analysis route can send the sentences as columns."""
+    mock_find.return_value = {
+        "_id": "fake_id",
+        "request_id": "unique_request_id",
+        "sentences": [
+            {"sentence": "This is a test.", "analysis": {"compound": 0.5}, "emotions": ["Happy"], "entities": []}
+        ],
+        "overall_status": "processed",
+    }
+
+    response = test_client.get("/get_analysis?request_id=unique_request_id&format=columns")
+
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert "sentences" not in response_data
+    assert response_data["columns"]["texts"] == ["This is a test."]
+    assert response_data["columns"]["compound"] == [0.5]
+    assert response_data["columns"]["emotions"] == [1]
+    assert response_data["columns"]["emotion_labels"][0] == "Happy"
+
+
+
+@patch("app.collection.find_one")
+def test_get_analysis_leaves_out_queue_fields(mock_find, test_client):
+    """Test that /get_analysis does not read the queue bookkeeping of a document."""
+    mock_find.return_value = {"_id": "fake_id", "request_id": "r1", "overall_status": "pending"}
+    test_client.get("/get_analysis?request_id=r1")
+    assert mock_find.call_args.args == ({"request_id": "r1"}, RESULTS_PROJECTION)
+
+
+def test_bootstrap_indexes_reports_failures(capsys):
+    """Test that a database that is down does not stop the app from starting."""
+    with patch("app.collection.create_index", side_effect=errors.ServerSelectionTimeoutError("down")):
+        bootstrap_indexes()
+    assert "Could not create the job store indexes: down" in capsys.readouterr().out
+
+
+def chunked_store():
+    """Job store holding a processed document in three chunks."""
+    store = SQLiteJobStore()
+    store.enqueue({
+        "request_id": "chunked",
+        "sentences": [
+            {"sentence": f"Sentence {index}.", "status": "processed", "analysis": {"compound": index / 10},
+             "emotions": ["Happy"], "entities": []}
+            for index in range(5)
+        ],
+        "overall_status": "processed",
+        "completed_stages": ["sentiment", "emotions", "entities", "summary", "topics"],
+        "summary": "Sentence 0.",
+        "timestamp": datetime.now(),
+    }, chunk_size=2)
+    return store
+
+
+@patch("app.admission.check", return_value=None)
+@patch("app.SENTENCE_CHUNK_SIZE", 1)
+def test_submit_sentence_chunked(_mock_check, test_client):
+    """Test that a submission over SENTENCE_CHUNK_SIZE sentences is stored in chunks."""
+    store = SQLiteJobStore()
+    with patch("app.job_store", store):
+        response = test_client.post("/checkSentiment", json={"sentence": "First one. Second one."})
+
+    assert response.status_code == 200
+    document = store.fetch(response.get_json()["request_id"])
+    assert "sentences" not in document
+    assert (document["chunk_count"], document["sentence_count"]) == (2, 2)
+    assert list(store.iter_chunks(document))[1][0]["sentence"] == "Second one."
+
+
+def test_get_analysis_chunked(test_client):
+    """Test that the sentences of a chunked document are read from its chunks."""
+    with patch("app.job_store", chunked_store()):
+        response = test_client.get("/get_analysis?request_id=chunked")
+        columns = test_client.get("/get_analysis?request_id=chunked&format=columns").get_json()["columns"]
+
+    assert response.status_code == 200
+    response_data = json.loads(response.data)
+    assert response_data["summary"] == "Sentence 0."
+    assert [entry["sentence"] for entry in response_data["sentences"]] == [f"Sentence {index}." for index in range(5)]
+    assert columns["compound"] == [0.0, 0.1, 0.2, 0.3, 0.4]
+    assert columns["emotions"] == [1] * 5
+
+
+def test_emotion_intensity_chunked(test_client):
+    """Test that emotion intensity counts the sentences of every chunk."""
+    with patch("app.job_store", chunked_store()):
+        response = test_client.get("/emotion_intensity/chunked")
+    assert response.get_json() == {"Happy": 1.0}
+
+
 @patch("app.collection.find_one")
 def test_get_analysis_not_found(mock_find, test_client):
     """Test if the /get_analysis route returns 404 when the request_id is not found."""
@@ -122,6 +365,22 @@ def test_emotion_intensity(mock_find, test_client):
         "Sad": 0.25,
         "Angry": 0.25,
     }
+    # only the emotions of the sentences are read
+    assert mock_find.call_args.args[1] == EMOTIONS_PROJECTION
+
+@patch("app.collection.find_one")
+def test_emotion_intensity_precomputed(mock_find, test_client):
+    """Test that a stored emotion intensity is served without reading the sentences."""
+    mock_find.return_value = {
+        "_id": "fake_id",
+        "request_id": "unique_request_id",
+        "overall_status": "processed",
+        "aggregates": {"emotion_intensity": {"Happy": 0.75, "Sad": 0.25}},
+    }
+    response = test_client.get("/emotion_intensity/unique_request_id")
+    assert response.get_json() == {"Happy": 0.75, "Sad": 0.25}
+    mock_find.assert_called_once_with({"request_id": "unique_request_id"}, INTENSITY_PROJECTION)
+
 
 @patch("app.collection.find_one")
 def test_emotion_intensity_not_found(mock_find, test_client):
@@ -132,6 +391,34 @@ def test_emotion_intensity_not_found(mock_find, test_client):
     response_data = response.get_json()
     assert response_data == {"error": "Document not found"}
 
+
+@patch("app.job_store.model_quality_summary")
+def test_model_quality(mock_summary, test_client):
+    """Test if the /model_quality route returns the stored diagnostics."""
+    mock_summary.return_value = {
+        "topic_models": [{"model_version": 3, "coherence_c_v": 0.41, "topic_diversity": 0.8}],
+        "document_coherence": {"documents": 2, "mean_coherence": 0.35},
+    }
+
+    response = test_client.get("/model_quality?limit=1")
+
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert response_data["topic_models"][0]["model_version"] == 3
+    assert response_data["document_coherence"]["documents"] == 2
+    mock_summary.assert_called_once_with(1)
+
+
+def test_model_quality_empty(test_client):
+    """Test if the /model_quality route handles a database without diagnostics."""
+    with patch("app.job_store", SQLiteJobStore()):
+        response = test_client.get("/model_quality")
+
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert response_data["topic_models"] == []
+    assert response_data["document_coherence"]["documents"] == 0
+
 @patch("app.collection.find_one")
 def test_view_results(mock_find, test_client):
     """Test the /results/<request_id> route when results are available."""
@@ -194,6 +481,7 @@ def test_send_pdf_get(mock_find, test_client):
     response = test_client.get("/send_pdf/unique_request_id")
     assert response.status_code == 200
     assert b"Enter Your Email Address" in response.data
+    assert mock_find.call_args.args[1] == STATUS_PROJECTION
 
 @patch("app.collection.find_one")
 def test_send_pdf_get_not_available(mock_find, test_client):
@@ -216,8 +504,10 @@ def test_send_pdf_post_no_email(mock_find, test_client):
     assert response.status_code == 400
     assert b"Email address is required." in response.data
 
+@patch("app.admission.check", return_value=None)
+@patch("app.collection.find_one", return_value=None)
 @patch("app.collection.insert_one")
-def test_submit_sentence_db_error(mock_insert, test_client):
+def test_submit_sentence_db_error(mock_insert, _mock_find, _mock_check, test_client):
     """Test if the /checkSentiment route handles database insertion errors."""
     # Mock the insertion to raise a PyMongoError
     mock_insert.side_effect = errors.PyMongoError("Database error")
@@ -295,8 +585,29 @@ def test_generate_plots():
     assert isinstance(images, dict)
     assert 'sentiment_trend' in images
     assert 'sentiment_distribution' in images
+    assert 'overall_emotions' in images
+    assert 'emotional_shifts' in images
     # Add assertions for other expected keys
 
+def test_generate_plots_from_stored_aggregates():
+    """Test that the histogram and emotion chart come from the aggregates the worker stored."""
+    document = {
+        'sentences': [],
+        'aggregates': {
+            'emotion_counts': {'Happy': 3, 'Sad': 1},
+            'compound_histogram': {'edges': [-1.0, 0.0, 1.0], 'counts': [1, 3]},
+        },
+    }
+    with patch("app.plt.hist", wraps=plt.hist) as mock_hist, patch("app.plt.pie", wraps=plt.pie) as mock_pie:
+        images = generate_plots(document)
+
+    assert 'sentiment_distribution' in images
+    assert 'overall_emotions' in images
+    assert mock_hist.call_args.kwargs['weights'].tolist() == [1, 3]
+    assert mock_pie.call_args.args[0] == [3, 1]
+    assert mock_pie.call_args.kwargs['labels'] == ['Happy', 'Sad']
+
+
 def test_create_pdf():
     """Test the create_pdf function."""
     document = {